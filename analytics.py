@@ -0,0 +1,454 @@
+"""
+InsightX – pre-aggregated analytics
+====================================
+Nearly every routed question is a failure rate, fraud rate, average amount or
+volume over one or two low-cardinality columns.  `Cube` computes those sums
+once per dataset — for every dimension in CUBE_DIMENSIONS and every pair in
+CUBE_PAIRS — with one `np.bincount` per metric over the integer group codes
+(categorical codes, never string comparisons).  A question is then answered
+from a few hundred cells instead of a scan over every row.
+
+Metrics kept per cell: count, failed, success, fraud (int32) and amount sum /
+sum of squares (float64), from which means, standard deviations and rates
+are derived on the way out.  Any other combination of columns is aggregated
+from the frame on first use and kept, so only the first such question pays
+for a scan.
+
+`group_stats()` is the kernel behind both: one pass over integer group keys
+for any grouping (column names or a derived Series such as the month) and
+any row mask, returning counts, rates and amount mean/std — plus median,
+min and max on request.  Routed questions the cube cannot answer call it
+directly instead of filtering and grouping twice.
+
+`PredicateIndex` keeps a packed bitmap per (column, value) of the
+low-cardinality columns.  Filters combine with bitwise &, | and ~ into a
+`Selection`, which group_stats() accepts as its mask — so filter-then-group
+questions never compare strings row by row.
+
+Used by app.py (the routed templates call `cube.stats(...)` and
+`group_stats(...)`) and benchmark.py.
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Columns the router groups or filters by
+CUBE_DIMENSIONS = [
+    "sender_bank", "sender_state", "device_type", "network_type",
+    "transaction_type", "merchant_category", "sender_age_group",
+    "is_weekend", "hour_of_day", "day_of_week",
+]
+
+# Pairs the router slices (e.g. bank failure rate for iOS, device failure rate for P2P)
+CUBE_PAIRS = [
+    ("sender_bank", "transaction_type"),
+    ("device_type", "sender_bank"),
+    ("transaction_type", "device_type"),
+    ("transaction_type", "network_type"),
+    ("transaction_type", "hour_of_day"),
+    ("transaction_type", "sender_age_group"),
+    ("is_weekend", "merchant_category"),
+    ("is_weekend", "sender_bank"),
+    ("is_weekend", "sender_age_group"),
+]
+
+COUNT_METRICS = ["count", "failed", "success", "fraud"]
+
+
+# ── Group codes ───────────────────────────────────────────────────────────────
+def dimension_codes(series):
+    """Integer codes (-1 = missing) and the labels they index, in groupby order."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        cat = series.array
+        labels = pd.CategoricalIndex(cat.categories, categories=cat.categories,
+                                     ordered=cat.ordered, name=series.name)
+        return cat.codes, labels
+    if pd.api.types.is_integer_dtype(series.dtype) and len(series):
+        # Small non-negative ints (flags, hour of day) are their own codes;
+        # values that never occur become empty cells and are dropped later
+        values = series.to_numpy()
+        lo, hi = values.min(), values.max()
+        if lo >= 0 and hi < 4096:
+            return values, pd.Index(np.arange(hi + 1, dtype=values.dtype), name=series.name)
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes.astype(np.int32), pd.Index(uniques, name=series.name)
+
+
+def combine_codes(codes, sizes):
+    """
+    Fold per-column codes into one cell number (row-major over sizes).
+    Rows with a missing value in any column go to the spill cell sizes.prod().
+    """
+    key = codes[0].astype(np.intp)
+    valid = key >= 0
+    for c, n in zip(codes[1:], sizes[1:]):
+        key = key * n + c
+        valid &= c >= 0
+    spill = int(np.prod(sizes))
+    return (key if valid.all() else np.where(valid, key, spill)), spill
+
+
+# ── Kernel ────────────────────────────────────────────────────────────────────
+def row_measures(df, rows=None):
+    """
+    Per-row inputs to the metrics, for all rows or the positions in rows.
+    Status and fraud flag are folded into one small "outcome" code,
+    (status_code + 1) * 2 + fraud, so a single integer bincount yields
+    count, failed, success and fraud together.
+    """
+    status, labels = dimension_codes(df["transaction_status"])
+    fraud = df["fraud_flag"].to_numpy()
+    amount = df["amount_inr"].to_numpy(dtype=np.float64, na_value=0.0)
+    if rows is not None:
+        status, fraud, amount = status[rows], fraud[rows], amount[rows]
+    return {
+        "outcome":    (status.astype(np.int8) + 1) * 2 + (fraud != 0),
+        "n_outcomes": (len(labels) + 1) * 2,
+        "failed":     labels.get_loc("FAILED") + 1 if "FAILED" in labels else None,
+        "success":    labels.get_loc("SUCCESS") + 1 if "SUCCESS" in labels else None,
+        "amount":     amount,
+        "amount_sq":  amount * amount,
+    }
+
+
+def accumulate(key, n_cells, rows):
+    """
+    Sum every metric per cell: one integer bincount over (cell, outcome) plus
+    two weighted bincounts for the amount.  Returns {metric: array of n_cells}.
+    """
+    n_out = rows["n_outcomes"]
+    joint = np.bincount(key * n_out + rows["outcome"], minlength=(n_cells + 1) * n_out)
+    joint = joint.reshape(n_cells + 1, n_out // 2, 2)[:n_cells]   # cell × status × fraud
+
+    def status_count(code):
+        return joint[:, code, :].sum(axis=1) if code is not None else np.zeros(n_cells, np.int64)
+
+    cells = {
+        "count":   joint.sum(axis=(1, 2)),
+        "failed":  status_count(rows["failed"]),
+        "success": status_count(rows["success"]),
+        "fraud":   joint[:, :, 1].sum(axis=1),
+    }
+    cells = {name: a.astype(np.int32) for name, a in cells.items()}
+    for name, weights in (("amount_sum", rows["amount"]), ("amount_sumsq", rows["amount_sq"])):
+        cells[name] = np.bincount(key, weights=weights, minlength=n_cells + 1)[:n_cells]
+    return cells
+
+
+def accumulate_all(rows):
+    """accumulate() for a single cell holding every row — plain reductions, no keys."""
+    n_out = rows["n_outcomes"]
+    joint = np.bincount(rows["outcome"], minlength=n_out).reshape(n_out // 2, 2)
+    cells = {
+        "count":   joint.sum(),
+        "failed":  joint[rows["failed"]].sum() if rows["failed"] is not None else 0,
+        "success": joint[rows["success"]].sum() if rows["success"] is not None else 0,
+        "fraud":   joint[:, 1].sum(),
+    }
+    cells = {name: np.array([v], dtype=np.int32) for name, v in cells.items()}
+    cells["amount_sum"] = np.array([rows["amount"].sum()])
+    cells["amount_sumsq"] = np.array([rows["amount_sq"].sum()])
+    return cells
+
+
+def amount_order_stats(key, n_cells, amount, counts):
+    """
+    Median, min and max amount per cell.  Rows are bucketed by cell with a
+    stable sort on the small integer key (radix sort for < 65536 cells), then
+    each non-empty bucket is partitioned — O(rows), no full sort of amounts.
+    """
+    if key is None:   # one cell holding every row
+        grouped = amount
+    else:
+        small = key.astype(np.uint16) if n_cells < np.iinfo(np.uint16).max else key
+        grouped = amount[np.argsort(small, kind="stable")]
+    stats = {name: np.full(n_cells, np.nan) for name in ("amount_median", "amount_min", "amount_max")}
+    start = 0
+    for cell, n in enumerate(counts):
+        if n:
+            part = grouped[start:start + n]
+            stats["amount_median"][cell] = np.median(part)
+            stats["amount_min"][cell] = part.min()
+            stats["amount_max"][cell] = part.max()
+        start += n
+    return stats
+
+
+def derive_metrics(sums, index, drop_empty=True):
+    """
+    Frame of counts, amount mean/std and % rates from per-cell sums, one row
+    per (non-empty) cell of index.  Computed on the arrays, then wrapped once.
+    """
+    keep = sums["count"] > 0 if drop_empty else np.ones(len(sums["count"]), dtype=bool)
+    cells = {name: a[keep] for name, a in sums.items()}
+    n = cells["count"].astype(np.int64)
+    out = {name: cells[name].astype(np.int64) for name in COUNT_METRICS}
+    out["amount_sum"] = cells["amount_sum"]
+    with np.errstate(divide="ignore", invalid="ignore"):   # empty cells → NaN, like pandas
+        out["amount_mean"] = cells["amount_sum"] / n
+        var = (cells["amount_sumsq"] - cells["amount_sum"] ** 2 / n) / (n - 1)
+        out["amount_std"] = np.sqrt(np.clip(var, 0, None))
+        for name in ("amount_median", "amount_min", "amount_max"):
+            if name in cells:
+                out[name] = cells[name]
+        out["failure_rate"] = out["failed"] / n * 100
+        out["success_rate"] = out["success"] / n * 100
+        out["fraud_rate"]   = out["fraud"] / n * 100
+    return pd.DataFrame(out, index=index[keep])
+
+
+def group_stats(df, by=None, mask=None, median=False):
+    """
+    Per-group statistics in one pass — the fused replacement for
+    `df[df['transaction_status']=='FAILED'].groupby(col).size() / df.groupby(col).size()`.
+
+    by:     column name, list of names, or a Series aligned with df (like groupby);
+            None treats the selected rows as one group and returns a Series.
+    mask:   optional boolean array / Series or a PredicateIndex Selection choosing
+            the rows to include; only those rows are gathered, so selective
+            masks make it cheaper.
+    median: also return amount_median, amount_min and amount_max (costs a sort).
+
+    Columns: count, failed, success, fraud, amount_sum, amount_mean, amount_std,
+    failure_rate, success_rate, fraud_rate (rates in %). Empty groups are dropped.
+    """
+    keys = [] if by is None else (list(by) if isinstance(by, (list, tuple)) else [by])
+    coded = [dimension_codes(df[k] if isinstance(k, str) else k) for k in keys]
+    if mask is None:
+        selected = None
+    elif isinstance(mask, Selection):
+        selected = mask.rows()
+    else:
+        selected = np.flatnonzero(np.asarray(mask, dtype=bool))
+    rows = row_measures(df, selected)
+    if coded:
+        codes = [c if selected is None else c[selected] for c, _ in coded]
+        key, n_cells = combine_codes(codes, [len(lab) for _, lab in coded])
+        sums = accumulate(key, n_cells, rows)
+    else:
+        key, n_cells = None, 1
+        sums = accumulate_all(rows)
+    if median:
+        sums.update(amount_order_stats(key, n_cells, rows["amount"], sums["count"]))
+    labels = [lab for _, lab in coded]
+    if not labels:
+        return derive_metrics(sums, pd.RangeIndex(1), drop_empty=False).iloc[0]
+    return derive_metrics(sums, cell_index(labels))
+
+
+def cell_index(labels):
+    """groupby-style index over every cell of a cuboid."""
+    return labels[0] if len(labels) == 1 else pd.MultiIndex.from_product(labels)
+
+
+# ── Cube ──────────────────────────────────────────────────────────────────────
+class Cube:
+    """
+    Pre-aggregated metrics per dimension value and per dimension pair.
+    Holds a view of the frame only to aggregate combinations it was not built for.
+    """
+
+    def __init__(self, df, cells, totals, build_ms=0.0):
+        self._df = df
+        self._cells = cells      # frozenset(dims) → (dims, labels, {metric: array})
+        self._frames = {}        # frozenset(dims) → derived metrics frame, built on first use
+                                 # (also holds combinations aggregated by group_stats)
+        self._totals = totals
+        self._lock = threading.Lock()
+        self.build_ms = build_ms
+        self.hits = self.fallbacks = 0
+
+    @classmethod
+    def build(cls, df, dimensions=CUBE_DIMENSIONS, pairs=CUBE_PAIRS):
+        start = time.perf_counter()
+        rows = row_measures(df)
+        codes = {d: dimension_codes(df[d]) for d in dimensions if d in df.columns}
+        groups = [(d,) for d in codes] + [p for p in pairs if all(d in codes for d in p)]
+        cells = {}
+        for dims in groups:
+            labels = [codes[d][1] for d in dims]
+            key, n_cells = combine_codes([codes[d][0] for d in dims], [len(lab) for lab in labels])
+            cells[frozenset(dims)] = (dims, labels, accumulate(key, n_cells, rows))
+        totals = accumulate_all(rows)
+        return cls(df, cells, totals, (time.perf_counter() - start) * 1000)
+
+    def _frame(self, dims):
+        """Derived metrics for one cuboid (non-empty cells only), indexed by its dims."""
+        key = frozenset(dims)
+        frame = self._frames.get(key)
+        if frame is not None:
+            with self._lock:
+                self.hits += 1
+            return frame
+        entry = self._cells.get(key)
+        if entry is None:
+            # Not pre-aggregated: one pass over the frame, then keep the result
+            frame = group_stats(self._df, list(dims))
+        else:
+            _, labels, arrays = entry
+            frame = derive_metrics(arrays, cell_index(labels))
+        with self._lock:
+            if entry is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+            self._frames[key] = frame
+        return frame
+
+    def stats(self, by, where=None):
+        """
+        Per-group metrics like df.groupby(by), optionally for the rows matching
+        where={column: value} — e.g. stats('sender_bank', where={'device_type': 'iOS'}).
+        Columns: count, failed, success, fraud, amount_sum, amount_mean, amount_std,
+        failure_rate, success_rate, fraud_rate (rates in %). Empty groups are dropped.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        dims = by + [c for c in where if c not in by]
+        frame = self._frame(dims)
+        for col, value in where.items():
+            frame = frame[frame.index.get_level_values(col) == value]
+            if col not in by:
+                frame = frame.droplevel(col)
+        if len(by) > 1 and list(frame.index.names) != by:
+            frame = frame.reorder_levels(by).sort_index()
+        # Shallow copy: callers may add columns without touching the cached frame
+        return frame.copy(deep=False)
+
+    def totals(self):
+        """Whole-dataset metrics as a Series (same fields as stats())."""
+        return derive_metrics(self._totals, pd.RangeIndex(1), drop_empty=False).iloc[0]
+
+    def info(self):
+        cells = sum(len(arrays["count"]) for _, _, arrays in self._cells.values())
+        nbytes = sum(a.nbytes for _, _, arrays in self._cells.values() for a in arrays.values())
+        return {"cuboids": len(self._cells), "cells": cells, "bytes": nbytes,
+                "build_ms": self.build_ms, "hits": self.hits, "fallbacks": self.fallbacks}
+
+
+# ── Predicate index ───────────────────────────────────────────────────────────
+# Columns with at most this many distinct values get one bitmap per value
+INDEX_MAX_VALUES = 64
+
+# Set bits per byte value, for counting rows in a packed bitmap
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class Selection:
+    """A set of rows as a packed bitmap (1 bit per row). Combine with &, | and ~."""
+
+    __slots__ = ("bits", "n_rows")
+
+    def __init__(self, bits, n_rows):
+        self.bits = bits
+        self.n_rows = n_rows
+
+    def __and__(self, other):
+        return Selection(np.bitwise_and(self.bits, other.bits), self.n_rows)
+
+    def __or__(self, other):
+        return Selection(np.bitwise_or(self.bits, other.bits), self.n_rows)
+
+    def __invert__(self):
+        bits = np.invert(self.bits)
+        tail = self.n_rows % 8
+        if tail:  # keep the padding bits of the last byte clear
+            bits[-1] &= (0xFF << (8 - tail)) & 0xFF
+        return Selection(bits, self.n_rows)
+
+    def count(self):
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def mask(self):
+        """Boolean array over all rows — usable as df[sel.mask()]."""
+        return np.unpackbits(self.bits, count=self.n_rows).view(bool)
+
+    def rows(self):
+        """Positions of the selected rows (for df.iloc / group_stats)."""
+        return np.flatnonzero(self.mask())
+
+    def __repr__(self):
+        return f"Selection({self.count():,} of {self.n_rows:,} rows)"
+
+
+class PredicateIndex:
+    """
+    Packed bitmaps for every (column, value) of the low-cardinality columns, so
+    filters like status == 'FAILED' & device_type == 'iOS' are a few bitwise ANDs
+    over n/8 bytes instead of string comparisons over every row.
+    """
+
+    def __init__(self, bitmaps, labels, n_rows, build_ms=0.0):
+        self._bitmaps = bitmaps  # column → {value: packed bits}
+        self._labels = labels    # column → Index of its values
+        self.n_rows = n_rows
+        self.build_ms = build_ms
+
+    @classmethod
+    def build(cls, df, max_values=INDEX_MAX_VALUES):
+        start = time.perf_counter()
+        bitmaps, labels = {}, {}
+        for col in df.columns:
+            dtype = df[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                if len(dtype.categories) > max_values:
+                    continue
+            elif not pd.api.types.is_integer_dtype(dtype) or df[col].nunique() > max_values:
+                continue
+            codes, values = dimension_codes(df[col])
+            present = np.bincount(codes[codes >= 0], minlength=len(values)) > 0
+            bitmaps[col] = {values[i]: np.packbits(codes == i)
+                            for i in np.flatnonzero(present)}
+            labels[col] = values[present]
+        return cls(bitmaps, labels, len(df), (time.perf_counter() - start) * 1000)
+
+    @property
+    def columns(self):
+        return list(self._bitmaps)
+
+    def values(self, column):
+        return self._labels[column]
+
+    def _column(self, column):
+        try:
+            return self._bitmaps[column]
+        except KeyError:
+            raise KeyError(f"'{column}' is not indexed; indexed columns: {', '.join(self._bitmaps)}") from None
+
+    def all(self):
+        return ~self.none()
+
+    def none(self):
+        return Selection(np.zeros((self.n_rows + 7) // 8, dtype=np.uint8), self.n_rows)
+
+    def eq(self, column, value):
+        """Rows where column == value (no rows if the value never occurs)."""
+        bits = self._column(column).get(value)
+        return Selection(bits, self.n_rows) if bits is not None else self.none()
+
+    def isin(self, column, values):
+        sel = self.none()
+        for value in values:
+            sel = sel | self.eq(column, value)
+        return sel
+
+    def select(self, **where):
+        """
+        AND of the given filters; a list value means any of those values.
+        e.g. idx.select(transaction_type='P2P', device_type=['Android', 'iOS'])
+        """
+        sel = self.all()
+        for column, value in where.items():
+            if isinstance(value, (list, tuple, set)):
+                sel = sel & self.isin(column, value)
+            else:
+                sel = sel & self.eq(column, value)
+        return sel
+
+    def info(self):
+        maps = [bits for col in self._bitmaps.values() for bits in col.values()]
+        return {"columns": len(self._bitmaps), "bitmaps": len(maps),
+                "bytes": sum(b.nbytes for b in maps), "build_ms": self.build_ms}
@@ -0,0 +1,414 @@
+"""
+InsightX – rendered answers
+============================
+A routed data question ("which bank has the highest failure rate?") always
+gets the same TYPE A answer: direct answer, ranked breakdown, how it was
+computed, business context, follow-up.  For those the insight LLM only
+restates a sorted table — 500 tokens and several seconds to copy numbers it
+can still misquote.
+
+`render_answer()` writes that answer straight from the result: the ranked
+rows with their counts and sample sizes, the methodology for the metric,
+a comparison with the dataset-wide rate from the profile and a follow-up
+question the query planner can answer.  Every number is formatted from the
+result itself, so the text cannot disagree with the verification panel.
+
+It only accepts shapes it fully understands — a frame of dimension labels
+plus known metric columns (router tables and query plans), or a flat
+label → number dict whose labels are values of one dataset column — and only
+when the result answers the metric and dimension the question names.
+Everything else returns None and goes to the LLM as before.
+
+Used by app.py (routed and planned answers) and benchmark.py.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from queryplan import ASC_WORDS, DIMENSION_LABELS, DIMENSION_PATTERNS, METRIC_PATTERNS
+
+# Longest breakdown written out; the rest stay in the result table
+MAX_ROWS = 25
+
+# Fewer transactions than this behind the leading value gets a caveat
+SMALL_SAMPLE = 1000
+
+
+@dataclass(frozen=True)
+class Metric:
+    """How a metric column reads in the answer."""
+    name: str             # "failure rate"
+    family: str           # failure / success / fraud / amount / count
+    kind: str             # rate / amount / count
+    numerator: str = ""   # "failed" — rates only
+    aggregate: str = ""   # "Mean" / "Median" / "Sum" — amounts only
+
+
+FAILURE_RATE = Metric("failure rate", "failure", "rate", numerator="failed")
+SUCCESS_RATE = Metric("success rate", "success", "rate", numerator="successful")
+FRAUD_RATE   = Metric("fraud rate", "fraud", "rate", numerator="flagged")
+AVG_AMOUNT   = Metric("average amount", "amount", "amount", aggregate="Mean")
+MEDIAN_AMOUNT = Metric("median amount", "amount", "amount", aggregate="Median")
+TOTAL_AMOUNT = Metric("total amount", "amount", "amount", aggregate="Sum")
+TRANSACTIONS = Metric("transactions", "count", "count")
+FAILED       = Metric("failed transactions", "failure", "count")
+FLAGGED      = Metric("flagged transactions", "fraud", "count")
+
+# Result column (lower case) → metric, for router tables and query plans
+METRIC_COLUMNS = {
+    "failure_rate_%": FAILURE_RATE, "success_rate_%": SUCCESS_RATE, "fraud_rate_%": FRAUD_RATE,
+    "avg_amount_inr": AVG_AMOUNT, "median_amount_inr": MEDIAN_AMOUNT, "total_amount_inr": TOTAL_AMOUNT,
+}
+COUNT_COLUMNS = {
+    "failed": FAILED, "failed_count": FAILED,
+    "flagged": FLAGGED, "fraud_count": FLAGGED,
+    "successful": Metric("successful transactions", "success", "count"),
+    "transactions": TRANSACTIONS, "transaction_count": TRANSACTIONS,
+}
+TOTAL_COLUMNS = {"total", "total_count", "total_transactions"}
+
+# queryplan metric → Metric, for dicts whose metric only the question names
+PLAN_METRICS = {
+    "failure_rate": FAILURE_RATE, "success_rate": SUCCESS_RATE, "fraud_rate": FRAUD_RATE,
+    "amount_mean": AVG_AMOUNT, "amount_median": MEDIAN_AMOUNT, "amount_sum": TOTAL_AMOUNT,
+    "count": TRANSACTIONS, "failed": FAILED, "fraud": FLAGGED,
+}
+# A rate the question names, answered with whole numbers, is that count
+RATE_COUNTS = {"failure": FAILED, "fraud": FLAGGED}
+
+# Label column → dataset column (router tables use a few shorter names)
+LABEL_COLUMNS = {label.lower(): col for col, label in DIMENSION_LABELS.items()}
+LABEL_COLUMNS.update({"type": "transaction_type", "category": "merchant_category"})
+LABEL_COLUMNS.update({col: col for col in DIMENSION_LABELS})
+
+DIMENSION_NOUNS = {
+    "sender_bank": "bank", "sender_state": "state", "device_type": "device",
+    "network_type": "network", "transaction_type": "transaction type",
+    "merchant_category": "merchant category", "sender_age_group": "age group",
+    "hour_of_day": "hour", "day_of_week": "day", "is_weekend": "period", "month": "month",
+}
+
+# Follow-ups drill into the leader along the next of these dimensions
+FOLLOW_UP_DIMENSIONS = ["transaction_type", "device_type", "network_type", "sender_age_group", "sender_bank"]
+# Dimensions whose labels are also filter values the query planner understands
+FILTERABLE = {"sender_bank", "sender_state", "device_type", "network_type", "transaction_type",
+              "merchant_category", "sender_age_group", "day_of_week"}
+
+# Reasoning questions keep the LLM even when a template produced the data
+WHY = re.compile(r"\bwhy\b|\bexplain\b|\breason")
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+
+@dataclass
+class Row:
+    label: str
+    value: float
+    count: int = None     # numerator of a rate / transactions behind an amount
+    total: int = None     # transactions behind a rate
+
+
+def needs_reasoning(question):
+    """Why / explain questions: the LLM answers them even when the data is routed."""
+    return bool(WHY.search(question.lower()))
+
+
+def render_answer(question, value, profile=None):
+    """TYPE A answer text for a routed or planned result, or None for the LLM."""
+    q = question.lower()
+    if needs_reasoning(q):
+        return None
+    if isinstance(value, pd.DataFrame):
+        parsed = _from_frame(value)
+    elif isinstance(value, dict):
+        parsed = _from_dict(q, value, profile or {})
+    else:
+        return None
+    if parsed is None:
+        return None
+    metric, dims, rows, scope = parsed
+    if not rows or not _answers(q, metric, dims):
+        return None
+    if scope is not None:
+        return _render_scalar(metric, rows[0], scope, profile or {})
+    return _render_ranked(q, metric, dims, rows, profile or {})
+
+
+# ── Reading results ─────────────────────────────────────────────────────────
+def _from_frame(df):
+    """(metric, dims, rows, scope) from a router / plan table, or None."""
+    if len(df) == 0:
+        return None
+    if not isinstance(df.index, pd.RangeIndex):
+        df = df.reset_index()
+    cols = {c: str(c).lower() for c in df.columns}
+    labels = [c for c, low in cols.items() if low in LABEL_COLUMNS]
+    scope = [c for c, low in cols.items() if low == "scope"]
+    metrics = [c for c, low in cols.items() if low in METRIC_COLUMNS]
+    counts = [c for c, low in cols.items() if low in COUNT_COLUMNS]
+    totals = [c for c, low in cols.items() if low in TOTAL_COLUMNS]
+    if len(labels) + len(scope) + len(metrics) + len(counts) + len(totals) != len(df.columns):
+        return None                     # a column we cannot describe
+    if scope and (labels or len(df) != 1):
+        return None
+    if not scope and not labels:
+        return None
+
+    if metrics:
+        metric_col = metrics[0]
+        metric = METRIC_COLUMNS[cols[metric_col]]
+        if metric.kind == "rate":
+            count_col = next((c for c in counts if COUNT_COLUMNS[cols[c]].family == metric.family), None)
+        else:
+            count_col = next((c for c in counts if COUNT_COLUMNS[cols[c]] is TRANSACTIONS), None)
+    elif len(counts) == 1 and not totals:
+        metric_col, count_col = counts[0], None
+        metric = COUNT_COLUMNS[cols[metric_col]]
+    else:
+        return None
+    total_col = totals[0] if totals and metric.kind == "rate" else None
+    if not pd.api.types.is_numeric_dtype(df[metric_col]):
+        return None
+
+    dims = [LABEL_COLUMNS[cols[c]] for c in labels]
+    rows = []
+    for rec in df.to_dict("records"):
+        label = " · ".join(_label(rec[c], dim) for c, dim in zip(labels, dims))
+        rows.append(Row(label, float(rec[metric_col]),
+                        int(rec[count_col]) if count_col else None,
+                        int(rec[total_col]) if total_col else None))
+    return metric, dims, rows, (str(df[scope[0]].iloc[0]) if scope else None)
+
+
+def _from_dict(q, value, profile):
+    """(metric, dims, rows, None) from a flat label → number dict, or None."""
+    if len(value) < 2 or not all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool)
+                                 for v in value.values()):
+        return None
+    dim = _column_of(value.keys(), profile)
+    plan_metric = next((m for m, pattern in METRIC_PATTERNS if re.search(pattern, q)), None)
+    if dim is None or plan_metric is None:
+        return None
+    metric = PLAN_METRICS[plan_metric]
+    whole = all(float(v).is_integer() for v in value.values())
+    if metric.kind == "rate" and whole and metric.family in RATE_COUNTS:
+        metric = RATE_COUNTS[metric.family]
+    elif (metric.kind == "count") != whole:
+        return None
+    return metric, [dim], [Row(str(k), float(v)) for k, v in value.items()], None
+
+
+def _column_of(keys, profile):
+    """The dimension column whose profiled values include every key."""
+    keys = {str(k) for k in keys}
+    for col in DIMENSION_NOUNS:
+        values = profile.get("columns", {}).get(col, {}).get("values")
+        if values and keys <= {str(v) for v in values}:
+            return col
+    return None
+
+
+def _answers(q, metric, dims):
+    """False when the question names a different metric family or dimension."""
+    asked = next((m for m, pattern in METRIC_PATTERNS if re.search(pattern, q)), None)
+    if asked is not None and PLAN_METRICS[asked].family != metric.family:
+        return False
+    if not dims:
+        return True                     # one-row plan: its scope already names the filters
+    named = _named_dimensions(q)
+    return not named or bool(named & set(dims))
+
+
+def _named_dimensions(q):
+    named, text = set(), q
+    for col, pattern in DIMENSION_PATTERNS:
+        if re.search(pattern, text):
+            named.add(col)
+            text = re.sub(pattern, " ", text)
+    if re.search(r"\bweekends?\b.*\bweekdays?\b|\bweekdays?\b.*\bweekends?\b", q):
+        named.add("is_weekend")
+    return named
+
+
+def _wants_low(q, metric):
+    """The question asks for the low end: "lowest", or "best" of a failure / fraud metric."""
+    words = set(re.findall(r"[a-z]+", q))
+    if words & ASC_WORDS:
+        return True
+    bad_is_high = metric.family in ("failure", "fraud")
+    return bool(words & {"best", "safest"}) if bad_is_high else "worst" in words
+
+
+def _label(value, dim):
+    if dim == "hour_of_day" and not isinstance(value, str):
+        return f"{int(value)}:00"
+    return str(value)
+
+
+# ── Formatting ──────────────────────────────────────────────────────────────
+def _decimals(values):
+    """Decimals the result was rounded to, so 0.2496 stays 0.2496 and 5.0 reads 5.00."""
+    places = 0
+    for v in values:
+        text = repr(round(float(v), 4))
+        if "." in text and not text.endswith(".0"):
+            places = max(places, len(text.split(".")[1]))
+    return places
+
+
+def _fmt(metric, value, places):
+    if metric.kind == "rate":
+        return f"{value:.{max(places, 2)}f}%"
+    if metric is TOTAL_AMOUNT:
+        return f"₹{value:,.0f}"
+    if metric.kind == "amount":
+        return f"₹{value:,.2f}"
+    return f"{int(value):,}"
+
+
+def _sample(metric, row):
+    if metric.kind == "rate" and row.count is not None and row.total is not None:
+        return f"{row.count:,} {metric.numerator} of {row.total:,} total"
+    if metric.kind == "amount" and row.count is not None:
+        return f"{row.count:,} transactions"
+    return ""
+
+
+def _render_scalar(metric, row, scope, profile):
+    scope = scope[:1].upper() + scope[1:]
+    value = _fmt(metric, row.value, _decimals([row.value]))
+    sample = _sample(metric, row)
+    if metric.kind == "count":
+        value += f" {metric.name}"
+    lines = [f"📊 **{scope}: {value}**" + (f" ({sample})" if sample else "") + "."]
+    context = _overall_context(metric, row.value, profile, "This", _decimals([row.value]))
+    if context:
+        lines.append(f"💼 **Business context:** {context}")
+    if metric.kind == "rate" and row.total is not None and row.total < SMALL_SAMPLE:
+        lines.append(f"⚠️ Only {row.total:,} transactions match — treat this rate as indicative.")
+    return "\n\n".join(lines)
+
+
+def _render_ranked(q, metric, dims, rows, profile):
+    values = [r.value for r in rows]
+    places = _decimals(values)
+    desc = all(a >= b for a, b in zip(values, values[1:]))
+    asc = not desc and all(a <= b for a, b in zip(values, values[1:]))
+    ranked = (desc or asc) and len(rows) > 1
+    want_low = _wants_low(q, metric) or (ranked and asc)
+    best = min(values) if want_low else max(values)
+    leaders = [r for r in rows if r.value == best]
+    noun = " × ".join(DIMENSION_NOUNS[d] for d in dims)
+
+    # 📊 direct answer
+    names = " and ".join(f"**{r.label}**" for r in leaders[:3])
+    extreme = ("fewest" if want_low else "most") if metric.kind == "count" else ("lowest" if want_low else "highest")
+    verb = "tie for" if len(leaders) > 1 else "has"
+    head = leaders[0]
+    sample = _sample(metric, head)
+    if metric.kind == "count":
+        direct = f"📊 {names} {verb} the {extreme} {metric.name}: **{_fmt(metric, head.value, places)}**"
+    else:
+        direct = f"📊 {names} {verb} the {extreme} {metric.name} at **{_fmt(metric, head.value, places)}**"
+    direct += (f" ({sample})." if sample and len(leaders) == 1 else ".")
+
+    # 📋 breakdown
+    lines = [direct, f"📋 **{metric.name[:1].upper() + metric.name[1:]} by {noun}:**"]
+    for i, r in enumerate(rows[:MAX_ROWS]):
+        if not ranked:
+            mark = "•"
+        elif asc == want_low and i < 3:
+            mark = MEDALS[i]            # medals only when the ranking runs the way the question asks
+        else:
+            mark = f"{i + 1}."
+        sample = _sample(metric, r)
+        lines[-1] += f"\n{mark} {r.label}: {_fmt(metric, r.value, places)}" + (f"  ({sample})" if sample else "")
+    if len(rows) > MAX_ROWS:
+        lines[-1] += f"\n… {len(rows) - MAX_ROWS} more in the result table."
+
+    # 🔍 methodology
+    lines.append(f"🔍 **How this was computed:** {_methodology(metric, noun, rows)}")
+
+    # 💼 business context
+    context = [_overall_context(metric, head.value, profile, head.label, places), _spread(metric, rows, places, noun)]
+    context = " ".join(c for c in context if c)
+    if context:
+        lines.append(f"💼 **Business context:** {context}")
+    small = [r for r in leaders if r.total is not None and r.total < SMALL_SAMPLE]
+    if metric.kind == "rate" and small:
+        lines.append(f"⚠️ {small[0].label} has only {small[0].total:,} transactions — treat its rate as indicative.")
+
+    # 💡 follow-up
+    follow = _follow_up(metric, dims, head.label.split(" · ")[0])
+    if follow:
+        lines.append(f"💡 **Follow-up:** {follow}")
+    return "\n\n".join(lines)
+
+
+def _methodology(metric, noun, rows):
+    """One sentence on how the metric was computed and over how many transactions."""
+    if all(r.total is not None for r in rows):
+        n = sum(r.total for r in rows)
+    elif metric.kind == "amount" and all(r.count is not None for r in rows):
+        n = sum(r.count for r in rows)
+    elif metric is TRANSACTIONS:
+        n = int(sum(r.value for r in rows))
+    else:
+        n = None
+    over = f"over the {n:,} transactions behind these rows" if n else "from the transaction data"
+    if metric.kind == "rate":
+        return (f"{metric.numerator.capitalize()} transactions ÷ all transactions for each {noun}, × 100 — "
+                f"counted directly {over}, no sampling.")
+    if metric.kind == "amount":
+        return f"{metric.aggregate} of `amount_inr` for each {noun}, computed directly {over}."
+    return f"Number of {metric.name} for each {noun}, counted directly {over}."
+
+
+def _overall_context(metric, value, profile, who, places=2):
+    key = {"failure": "failure_rate", "success": "success_rate", "fraud": "fraud_rate"}.get(metric.family)
+    if metric.kind == "rate" and key and profile.get(key) is not None:
+        overall = profile[key]
+        gap = value - overall
+        side = "above" if gap > 0 else "below" if gap < 0 else "level with"
+        places = max(places, 2)
+        size = f"{abs(gap):.{places}f} percentage points " if gap else ""
+        return f"{who} sits {size}{side} the dataset-wide {metric.name} of {overall:.{places}f}%."
+    if metric is AVG_AMOUNT and profile.get("avg_amount"):
+        overall = profile["avg_amount"]
+        return f"{who} averages {(value / overall - 1) * 100:+.1f}% against the dataset-wide ₹{overall:,.2f}."
+    return ""
+
+
+def _spread(metric, rows, places, noun):
+    if len(rows) < 2:
+        return ""
+    hi = max(rows, key=lambda r: r.value)
+    lo = min(rows, key=lambda r: r.value)
+    if hi.value == lo.value:
+        return f"Every {noun} shows the same {metric.name}."
+    if metric.kind == "count":
+        total = sum(r.value for r in rows)
+        return (f"{hi.label} carries {hi.value / total * 100:.1f}% of the {metric.name} shown; "
+                f"the smallest, {lo.label}, carries {lo.value / total * 100:.1f}%.")
+    gap = (f"{hi.value - lo.value:.{max(places, 2)}f} percentage points" if metric.kind == "rate"
+           else _fmt(metric, hi.value - lo.value, places))
+    if not lo.value:
+        return f"Highest ({hi.label}) and lowest ({lo.label}) differ by {gap} — {lo.label} has none at all."
+    relative = (hi.value - lo.value) / lo.value * 100
+    tone = f"a narrow spread, so no single {noun} stands out" if relative < 10 else "a wide spread worth investigating"
+    return f"Highest ({hi.label}) and lowest ({lo.label}) differ by {gap} ({relative:.1f}% relative) — {tone}."
+
+
+def _follow_up(metric, dims, top):
+    phrase = {"count": "number of transactions"}.get(metric.kind, metric.name)
+    if metric in (FAILED, FLAGGED):
+        phrase = {"failure": "failure rate", "fraud": "fraud rate"}[metric.family]
+    other = next((d for d in FOLLOW_UP_DIMENSIONS if d not in dims), None)
+    if dims[0] in FILTERABLE and other:
+        return f"*\"{phrase} for {top} by {DIMENSION_NOUNS[other]}\"* — what drives {top}'s number?"
+    if "is_weekend" not in dims:
+        return f"*\"{phrase} by {' and '.join(DIMENSION_NOUNS[d] for d in dims)} on weekends\"* — does the pattern hold at the weekend?"
+    return f"*\"{phrase} by {DIMENSION_NOUNS[other]} on weekends\"* — which {DIMENSION_NOUNS[other]}s drive the weekend figure?"
@@ -1,8 +1,35 @@
 import streamlit as st
 import pandas as pd
+import ast
+import contextvars
+import functools
+import hashlib
 import json
 import re
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from openai import OpenAI
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from analytics import Cube, PredicateIndex, group_stats
+from answers import needs_reasoning, render_answer
+from conversation import ConversationContext
+from datastore import CACHE_DIR, CSV_PATH, csv_stamp, dataset_profile, format_report, load_compaction_report, open_dataset, plain_columns
+from fewshot import PatternIndex, split_patterns
+from llmcache import CACHE_FILE, CompletionCache, completion_key
+from llmclient import LLMUnavailable, ResilientClient
+from metrics import REGISTRY, Counter, Gauge, observe_trace, serve, write_file
+from queryplan import QueryParser, QueryPlan, execute_plan
+from serializer import estimate_tokens, serialize_result
+from tracing import annotate, span, span_rows, stage_summary, start_span, to_chrome, trace, traced, write_chrome
 
 # ── Page config ──────────────────────────────────────────────────────────────
 st.set_page_config(
@@ -399,6 +426,7 @@ from datetime import datetime
 HISTORY_DIR = "chat_histories"
 os.makedirs(HISTORY_DIR, exist_ok=True)
 
+@traced()
 def save_chat(session_name, messages):
     """Save chat session to JSON file."""
     path = os.path.join(HISTORY_DIR, f"{session_name}.json")
@@ -443,226 +471,351 @@ def delete_session(session_name):
     if os.path.exists(path):
         os.remove(path)
 
+# ── Conversation Context ──────────────────────────────────────────────────────
+# History one LLM call carries, in estimated tokens (conversation.py); the
+# "summarise everything" recap has a budget of its own
+CONTEXT_TOKENS = int(os.environ.get("INSIGHTX_CONTEXT_TOKENS", 400))
+RECAP_TOKENS = int(os.environ.get("INSIGHTX_RECAP_TOKENS", 600))
+
+def conversation_context(messages):
+    """This session's ConversationContext, synced with messages; rebuilt when another chat is loaded."""
+    context = st.session_state.get("conversation")
+    if context is None or st.session_state.get("conversation_of") is not messages or context.seen > len(messages):
+        context = ConversationContext()
+        st.session_state["conversation"] = context
+        st.session_state["conversation_of"] = messages
+    return context.sync(messages)
+
 # ── LM Studio Client ──────────────────────────────────────────────────────────
+# Every call gets a per-attempt timeout and an overall deadline (seconds);
+# transient failures are retried with backoff, and after a run of failed calls
+# the circuit breaker answers at once for a cooldown (llmclient.py) — routed
+# questions are then answered from templates (degraded_insight).
+# INSIGHTX_LLM_URL points the app at another OpenAI-compatible server, e.g. the
+# offline stub (stubllm.py) for benchmarks and tests.
+LLM_URL = os.environ.get("INSIGHTX_LLM_URL", "http://127.0.0.1:1234/v1")
+LLM_TIMEOUT_S = float(os.environ.get("INSIGHTX_LLM_TIMEOUT", 20))
+LLM_DEADLINE_S = float(os.environ.get("INSIGHTX_LLM_DEADLINE", 60))
+LLM_RETRIES = int(os.environ.get("INSIGHTX_LLM_RETRIES", 2))
+
 @st.cache_resource
-def get_client():
-    return OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
+def get_client(base_url=LLM_URL):
+    return ResilientClient(
+        OpenAI(base_url=base_url, api_key="lm-studio", max_retries=0),
+        timeout_s=LLM_TIMEOUT_S,
+        deadline_s=LLM_DEADLINE_S,
+        retries=LLM_RETRIES,
+        failures=int(os.environ.get("INSIGHTX_LLM_BREAKER_FAILURES", 3)),
+        cooldown_s=float(os.environ.get("INSIGHTX_LLM_BREAKER_COOLDOWN", 30)),
+    )
+
+def llm_available(client):
+    """False while the client's circuit breaker is open (plain clients are always available)."""
+    available = getattr(client, "available", None)
+    return available() if available else True
 
 # ── Load & Normalise Columns ──────────────────────────────────────────────────
-@st.cache_data
+# Parsing, column normalisation and the Arrow cache live in datastore.py so
+# test_accuracy.py loads exactly the same typed frame.
+#
+# cache_resource (not cache_data): one SharedDataset per server process, never
+# pickled/copied per rerun. Keyed on the CSV's size+mtime so an edited file is
+# picked up without a restart; max_entries=1 drops the stale one.
+@st.cache_resource(max_entries=1, show_spinner="Loading transactions...")
+def _open_dataset(csv_stamp_key):
+    return open_dataset(CSV_PATH)
+
+def get_dataset():
+    return _open_dataset(csv_stamp(CSV_PATH))
+
 def load_data():
-    df = pd.read_csv("upi_transactions_2024.csv")
-
-    # Normalise: strip, lowercase, spaces→underscore, remove brackets
-    df.columns = (
-        df.columns
-        .str.strip()
-        .str.lower()
-        .str.replace(" ", "_", regex=False)
-        .str.replace(r"[()]", "", regex=True)
-    )
+    """Read-only view of the shared frame (no row data is copied)."""
+    return get_dataset().view()
 
-    # "amount_inr" may come out as "amount_inr" or "amount_inr_" etc.
-    # Specifically handle "amount (INR)" → becomes "amount_inr" after normalisation ✓
-    # But just in case, rename any column containing "amount" to "amount_inr"
-    for col in df.columns:
-        if "amount" in col and col != "amount_inr":
-            df.rename(columns={col: "amount_inr"}, inplace=True)
-            break
+# Pre-aggregated metrics the routed templates read instead of scanning rows
+# (see analytics.py). Rebuilt only when the dataset fingerprint changes.
+@st.cache_resource(max_entries=1, show_spinner="Building aggregates...")
+def _build_cube(fingerprint):
+    return Cube.build(get_dataset().view())
+
+def get_cube():
+    return _build_cube(get_dataset().fingerprint)
 
-    # Parse timestamp
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+# Packed row bitmaps per (column, value) for filters on low-cardinality columns
+@st.cache_resource(max_entries=1, show_spinner="Indexing filters...")
+def _build_index(fingerprint):
+    return PredicateIndex.build(get_dataset().view())
 
-    return df
+def get_index():
+    return _build_index(get_dataset().fingerprint)
+
+# Row count, date range, distinct values and headline rates — computed once per
+# dataset and kept next to the data cache (see datastore.dataset_profile)
+@st.cache_resource(max_entries=1, show_spinner="Profiling dataset...")
+def _load_profile(fingerprint):
+    return dataset_profile(get_dataset())
+
+def get_profile():
+    return _load_profile(get_dataset().fingerprint)
+
+# Question → QueryPlan grammar, using the profile's value lists as vocabulary
+@st.cache_resource(max_entries=1)
+def _build_parser(fingerprint):
+    return QueryParser(get_profile())
+
+def get_parser():
+    return _build_parser(get_dataset().fingerprint)
 
 # ── Data Summary for LLM ──────────────────────────────────────────────────────
-def get_data_summary(df):
+def get_data_summary(profile):
+    """
+    Dataset facts for the code-generation prompt, as compact JSON. Column
+    names and the value lists the prompt's schema already spells out (banks,
+    devices, networks, age groups, categories) are left out; the text is
+    identical for a given profile, so it stays part of the cacheable prefix.
+    """
     def safe(fn):
         try: return fn()
         except: return "N/A"
 
+    cols = profile["columns"]
     summary = {
-        "total_transactions": len(df),
-        "columns": list(df.columns),
-        "date_range": safe(lambda: f"{df['timestamp'].min()} to {df['timestamp'].max()}"),
-        "transaction_types": safe(lambda: df["transaction_type"].value_counts().to_dict()),
-        "overall_success_rate": safe(lambda: f"{(df['transaction_status'] == 'SUCCESS').mean()*100:.1f}%"),
-        "overall_failure_rate": safe(lambda: f"{(df['transaction_status'] == 'FAILED').mean()*100:.1f}%"),
-        "avg_amount_inr": safe(lambda: f"₹{df['amount_inr'].mean():.2f}"),
-        "fraud_flag_rate": safe(lambda: f"{df['fraud_flag'].mean()*100:.2f}%"),
-        "merchant_categories": safe(lambda: df["merchant_category"].dropna().unique().tolist()),
-        "sender_states": safe(lambda: df["sender_state"].dropna().unique().tolist()),
-        "banks": safe(lambda: df["sender_bank"].dropna().unique().tolist()),
-        "age_groups": safe(lambda: df["sender_age_group"].dropna().unique().tolist()),
-        "device_types": safe(lambda: df["device_type"].dropna().unique().tolist()),
-        "network_types": safe(lambda: df["network_type"].dropna().unique().tolist()),
+        "total_transactions": profile["rows"],
+        "date_range": safe(lambda: " to ".join(profile["date_range"])),
+        "transaction_types": safe(lambda: cols["transaction_type"]["counts"]),
+        "overall_success_rate": safe(lambda: f"{profile['success_rate']:.1f}%"),
+        "overall_failure_rate": safe(lambda: f"{profile['failure_rate']:.1f}%"),
+        "avg_amount_inr": safe(lambda: f"₹{profile['avg_amount']:.2f}"),
+        "fraud_flag_rate": safe(lambda: f"{profile['fraud_rate']:.2f}%"),
+        "sender_states": safe(lambda: cols["sender_state"]["values"]),
     }
-    return json.dumps(summary, default=str)
+    return json.dumps(summary, default=str, ensure_ascii=False, separators=(",", ":"))
 
 
 # ── Smart Query Router — handles complex queries directly ─────────────────────
-def route_query(user_query, df):
-    q = user_query.lower()
-
-    def code(*lines):
-        return "\n".join(lines)
-
-    # ── Explainability & Strategic questions → skip router, let LLM answer ──
-    # These need explanation not data computation
-    # ── Explain questions: run real pandas first, then LLM explains ──────────
-    # "explain why 3G higher failure" → fetch real network data first
+# Each rule below is tried in the order it is defined and the first one that
+# returns code answers the question.  @route(...) lists keywords at least one
+# of which must occur in the question (as a substring, like the rule's own
+# `"x" in q` tests) for the rule to match.  route_query() splits the question
+# once, looks its words up in the keyword index and only tries the rules whose
+# keywords are present, still in definition order.
+ROUTES       = []        # rules in precedence order
+_ROUTE_MASKS = {}        # keyword → bitmask over ROUTES of the rules it can match
+SKIP_ROUTER  = object()  # rule result: send the question straight to the LLM
+
+def route(*keywords):
+    """Register a rule that can only match questions containing one of keywords."""
+    def register(fn):
+        for kw in keywords:
+            _ROUTE_MASKS[kw] = _ROUTE_MASKS.get(kw, 0) | (1 << len(ROUTES))
+        ROUTES.append(fn)
+        return fn
+    return register
+
+def template(*lines):
+    return "\n".join(lines)
+
+# Explainability & strategic questions → skip router, let LLM answer
+# (these need explanation, not data computation)
+EXPLAIN_PHRASES = [
+    "how did you calculate", "how did you determine", "walk me through",
+    "explain how", "explain why", "explain the difference",
+    "how confident", "limitations of this data", "in simple terms",
+    "step by step", "why does education", "why does 3g",
+    "how would you build", "how would you detect", "how would this",
+    "design a smart", "build a risk score", "which 3 metrics",
+    "what machine learning", "production-ready", "scale to 10",
+    "if failure rate crosses", "fraud patterns are shifting",
+    "what additional data", "what would a production",
+    "ceo dashboard",
+    "how is the average", "what does it tell us",
+    "what does a 0", "actually mean in real numbers", "mean in real",
+    "what does the", "what do these numbers",
+]
+
+DEEP_DIVE_PHRASES = [
+    "deeper breakdown", "deeper analysis", "deep dive", "drill down",
+    "break it down", "breakdown of",
+]
+
+PERFORMANCE_PHRASES = [
+    "worst performance", "best performance", "worst performing", "best performing",
+    "poorly performing", "worst device", "best device",
+]
+
+INSIGHT_PHRASES = [
+    "most important insight", "key insight", "biggest insight", "main insight",
+    "top insight", "most critical",
+]
+
+DIAGNOSIS_PHRASES = [
+    "complete diagnosis", "full diagnosis", "system diagnosis", "payment diagnosis",
+    "overall health", "system health", "complete analysis", "full analysis",
+    "overall performance", "how is our system", "how are we performing", "complete overview",
+    "how are payments doing", "payments doing", "how is it going", "overall summary",
+    "quick summary", "how are we doing overall", "payments overall",
+]
+
+# ── Explain questions: run real pandas first, then LLM explains ──────────
+# "explain why 3G higher failure" → fetch real network data first
+@route("3g", "3 g")
+def explain_3g_failure(q, words):
     if ("3g" in q or "3 g" in q) and ("why" in q or "explain" in q or "higher" in q):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-            "total  = df.groupby('network_type').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Network': rate.index.tolist(), 'Failed': [int(failed[n]) for n in rate.index], 'Total': [int(total[n]) for n in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('network_type')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Network': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # Q26: "how did you determine which state" → get real state data
+# Q26: "how did you determine which state" → get real state data
+@route("how did you determine")
+def explain_state_choice(q, words):
     if "how did you determine" in q and "state" in q:
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('sender_state').size()",
-            "total  = df.groupby('sender_state').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'State': rate.index.tolist(), 'Failed': failed.values.tolist(), 'Total': total.values.tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('sender_state')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'State': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # Q27: "why does education have the highest" → get real merchant data
+# Q27: "why does education have the highest" → get real merchant data
+@route("education")
+def explain_education_average(q, words):
     if ("why does education" in q or ("why" in q and "education" in q and "average" in q)):
-        return code(
-            "g = df[df['merchant_category'].notna()].groupby('merchant_category')['amount_inr'].mean().round(2).reset_index()",
+        return template(
+            "g = cube.stats('merchant_category')['amount_mean'].round(2).reset_index()",
             "g.columns = ['Category', 'Avg_Amount_INR']",
             "result = g.sort_values('Avg_Amount_INR', ascending=False).reset_index(drop=True)"
         )
 
-    # Q29: "explain how weekend vs weekday" → get real weekend data
+# Q29: "explain how weekend vs weekday" → get real weekend data
+@route("weekend")
+def explain_weekend_comparison(q, words):
     if ("explain how weekend" in q or ("explain" in q and "weekend" in q and "weekday" in q)):
-        return code(
-            "wk0 = df[df['is_weekend']==0]",
-            "wk1 = df[df['is_weekend']==1]",
-            "result = pd.DataFrame({'Period': ['Weekday','Weekend'], 'Transactions': [len(wk0),len(wk1)], 'Failed': [int((wk0['transaction_status']=='FAILED').sum()),int((wk1['transaction_status']=='FAILED').sum())], 'Failure_Rate_%': [round((wk0['transaction_status']=='FAILED').mean()*100,2),round((wk1['transaction_status']=='FAILED').mean()*100,2)]})"
-        )
-
-    explain_phrases = [
-        "how did you calculate", "how did you determine", "walk me through",
-        "explain how", "explain why", "explain the difference",
-        "how confident", "limitations of this data", "in simple terms",
-        "step by step", "why does education", "why does 3g",
-        "how would you build", "how would you detect", "how would this",
-        "design a smart", "build a risk score", "which 3 metrics",
-        "what machine learning", "production-ready", "scale to 10",
-        "if failure rate crosses", "fraud patterns are shifting",
-        "what additional data", "what would a production",
-        "ceo dashboard",
-        "how is the average", "what does it tell us",
-        "what does a 0", "actually mean in real numbers", "mean in real",
-        "what does the", "what do these numbers",
-    ]
-    if any(phrase in q for phrase in explain_phrases):
-        return None  # Skip router — LLM will explain directly
-
-    # ── Basic overall stats — must be FIRST to avoid wrong routing ─────────────
-
-    # Overall success rate
-    if ("success rate" in q or "successful" in q) and not any(x in q.split() for x in ["bank","state","age","device","network","type","merchant","compare"]):
-        return code(
-            "total = len(df)",
-            "success = int((df['transaction_status']=='SUCCESS').sum())",
-            "failed  = int((df['transaction_status']=='FAILED').sum())",
+        return template(
+            "wk = cube.stats('is_weekend').loc[[0, 1]]",
+            "result = pd.DataFrame({'Period': ['Weekday','Weekend'], 'Transactions': wk['count'].tolist(), 'Failed': wk['failed'].tolist(), 'Failure_Rate_%': wk['failure_rate'].round(2).tolist()})"
+        )
+
+@route(*EXPLAIN_PHRASES)
+def explain_only(q, words):
+    if any(phrase in q for phrase in EXPLAIN_PHRASES):
+        return SKIP_ROUTER  # Skip router — LLM will explain directly
+
+# ── Basic overall stats — must be FIRST to avoid wrong routing ─────────────
+
+# Overall success rate
+@route("success rate", "successful")
+def overall_success_rate(q, words):
+    if ("success rate" in q or "successful" in q) and not any(x in words for x in ["bank","state","age","device","network","type","merchant","compare"]):
+        return template(
+            "t = cube.totals()",
+            "total = int(t['count'])",
+            "success = int(t['success'])",
+            "failed  = int(t['failed'])",
             "success_rate = round(success/total*100, 2)",
             "failure_rate = round(failed/total*100, 2)",
             "result = pd.DataFrame({'Metric': ['Success Rate','Failure Rate','Total Transactions'], 'Count': [success, failed, total], 'Percentage': [success_rate, failure_rate, 100.0]})"
         )
 
-    # Overall failure rate
-    if ("failure rate" in q or "failed rate" in q or "fail rate" in q) and not any(x in q.split() for x in ["bank","state","age","device","network","type","merchant","compare","recharge","p2p","p2m","bill"]):
-        return code(
-            "total = len(df)",
-            "failed  = int((df['transaction_status']=='FAILED').sum())",
-            "success = int((df['transaction_status']=='SUCCESS').sum())",
+# Overall failure rate
+@route("failure rate", "failed rate", "fail rate")
+def overall_failure_rate(q, words):
+    if ("failure rate" in q or "failed rate" in q or "fail rate" in q) and not any(x in words for x in ["bank","state","age","device","network","type","merchant","compare","recharge","p2p","p2m","bill"]):
+        return template(
+            "t = cube.totals()",
+            "total = int(t['count'])",
+            "failed  = int(t['failed'])",
+            "success = int(t['success'])",
             "failure_rate = round(failed/total*100, 2)",
             "success_rate = round(success/total*100, 2)",
             "result = pd.DataFrame({'Metric': ['Failure Rate','Success Rate','Total Transactions'], 'Count': [failed, success, total], 'Percentage': [failure_rate, success_rate, 100.0]})"
         )
 
-    # Overall fraud flag rate
-    if ("fraud" in q or "flag" in q) and ("overall" in q or "total" in q or "what is" in q or "whats" in q or "rate" in q) and not any(x in q.split() for x in ["bank","state","age","device","network","type","merchant","compare","profile","risk"]):
-        return code(
-            "total   = len(df)",
-            "flagged = int(df['fraud_flag'].sum())",
-            "rate    = round(df['fraud_flag'].mean()*100, 4)",
+# Overall fraud flag rate
+@route("fraud", "flag")
+def overall_fraud_rate(q, words):
+    if ("fraud" in q or "flag" in q) and ("overall" in q or "total" in q or "what is" in q or "whats" in q or "rate" in q) and not any(x in words for x in ["bank","state","age","device","network","type","merchant","compare","profile","risk"]):
+        return template(
+            "t = cube.totals()",
+            "total   = int(t['count'])",
+            "flagged = int(t['fraud'])",
+            "rate    = round(t['fraud_rate'], 4)",
             "result  = pd.DataFrame({'Metric': ['Fraud Flag Rate','Total Flagged','Total Transactions'], 'Value': [str(rate)+'%', flagged, total]})"
         )
 
-    # ── Merchant category avg amount ─────────────────────────────────────────
+# ── Merchant category avg amount ─────────────────────────────────────────
+@route("merchant", "categor")
+def merchant_avg_amount_top(q, words):
     if ("merchant" in q or "categor" in q) and ("average" in q or "avg" in q or "highest" in q or "most" in q or "high" in q) and ("amount" in q or "spend" in q or "value" in q):
-        return code(
-            "tmp = df[df['merchant_category'].notna()].groupby('merchant_category')['amount_inr'].mean().round(2).sort_values(ascending=False).reset_index()",
+        return template(
+            "tmp = cube.stats('merchant_category')['amount_mean'].round(2).sort_values(ascending=False).reset_index()",
             "tmp.columns = ['Merchant_Category','Avg_Amount_INR']",
             "result = tmp"
         )
 
-    # Average transaction amount
-    if ("average" in q or "avg" in q or "mean" in q) and ("amount" in q or "transaction amount" in q or "value" in q or "transaction value" in q) and not any(x in q.split() for x in ["bank","state","age","device","network","type","merchant","compare"]):
-        return code(
-            "stats = df['amount_inr'].describe()",
+# Average transaction amount
+@route("average", "avg", "mean")
+def overall_amount_stats(q, words):
+    if ("average" in q or "avg" in q or "mean" in q) and ("amount" in q or "transaction amount" in q or "value" in q or "transaction value" in q) and not any(x in words for x in ["bank","state","age","device","network","type","merchant","compare"]):
+        return template(
+            "stats = group_stats(df, median=True)",
             "result = pd.DataFrame({",
             "    'Metric': ['Average (Mean)', 'Median', 'Min', 'Max', 'Std Dev', 'Total Transactions'],",
             "    'Value': [",
-            "        round(df['amount_inr'].mean(), 2),",
-            "        round(df['amount_inr'].median(), 2),",
-            "        round(df['amount_inr'].min(), 2),",
-            "        round(df['amount_inr'].max(), 2),",
-            "        round(df['amount_inr'].std(), 2),",
-            "        len(df)",
+            "        round(stats['amount_mean'], 2),",
+            "        round(stats['amount_median'], 2),",
+            "        round(stats['amount_min'], 2),",
+            "        round(stats['amount_max'], 2),",
+            "        round(stats['amount_std'], 2),",
+            "        int(stats['count'])",
             "    ]",
             "})"
         )
 
-    # ── Bank failure rate for iOS — MUST be before device check ─────────────
-    if "ios" in q and ("bank" in q or len(q.split()) <= 5):
-        return code(
-            "ios = df[df['device_type']=='iOS']",
-            "failed = ios[ios['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total  = ios.groupby('sender_bank').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': [int(failed[b]) for b in rate.index], 'Total': [int(total[b]) for b in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+# ── Bank failure rate for iOS — MUST be before device check ─────────────
+@route("ios")
+def ios_bank_failure(q, words):
+    if "ios" in q and ("bank" in q or len(words) <= 5):
+        return template(
+            "s      = cube.stats('sender_bank', where={'device_type': 'iOS'})",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Device type failure rates ─────────────────────────────────────────────
+# ── Device type failure rates ─────────────────────────────────────────────
+@route("fail")
+def device_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and ("android" in q or "ios" in q or "device" in q):
         txn = "P2P" if "p2p" in q else ("P2M" if "p2m" in q else None)
         if txn:
-            return code(
-                f"df_f = df[df['transaction_type']=='{txn}']",
-                "failed = df_f[df_f['transaction_status']=='FAILED'].groupby('device_type').size()",
-                "total  = df_f.groupby('device_type').size()",
-                "rate   = (failed / total * 100).round(2)",
-                "result = pd.DataFrame({'failed_count': failed, 'total_count': total, 'failure_rate_%': rate}).sort_values('failure_rate_%', ascending=False)"
+            return template(
+                f"s      = cube.stats('device_type', where={{'transaction_type': '{txn}'}})",
+                "result = pd.DataFrame({'failed_count': s['failed'], 'total_count': s['count'], 'failure_rate_%': s['failure_rate'].round(2)}).sort_values('failure_rate_%', ascending=False)"
             )
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('device_type').size()",
-            "total  = df.groupby('device_type').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Device': rate.index.tolist(), 'Failed': [int(failed[d]) for d in rate.index], 'Total': [int(total[d]) for d in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('device_type')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Device': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Bank highest FAILURE RATE (most common question) ────────────────────
+# ── Bank highest FAILURE RATE (most common question) ────────────────────
+@route("bank")
+def bank_failure_rate(q, words):
     if ("fail" in q or "failure" in q) and "bank" in q and not any(x in q for x in ["weekend","ios","android","type","combination","average","avg","worst","bad","most failed"]):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total  = df.groupby('sender_bank').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': [int(failed[b]) for b in rate.index], 'Total': [int(total[b]) for b in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('sender_bank')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Bank most failed by COUNT ─────────────────────────────────────────────
+# ── Bank most failed by COUNT ─────────────────────────────────────────────
+@route("bank")
+def bank_most_failed(q, words):
     if ("most failed" in q or "most failures" in q or "highest failed" in q or "most fail" in q) and "bank" in q:
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size().sort_values(ascending=False)",
-            "total  = df.groupby('sender_bank').size()",
+        return template(
+            "s = cube.stats('sender_bank')",
+            "failed = s['failed'].sort_values(ascending=False)",
+            "total  = s['count']",
             "top_bank = str(failed.index[0])",
             "top_count = int(failed.iloc[0])",
             "top_total = int(total[failed.index[0]])",
@@ -672,71 +825,70 @@ def route_query(user_query, df):
             "result = ans + chr(10) + chr(10) + rows.to_string(index=False)"
         )
 
-    # ── Bank + transaction type failure rate ──────────────────────────────────
+# ── Bank + transaction type failure rate ──────────────────────────────────
+@route("bank")
+def bank_type_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and "bank" in q and ("type" in q or "combination" in q):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby(['sender_bank','transaction_type']).size()",
-            "total  = df.groupby(['sender_bank','transaction_type']).size()",
-            "rate   = (failed/total*100).round(2)",
-            "tmp = pd.DataFrame({'failed_count': failed, 'total_count': total, 'failure_rate_%': rate}).sort_values('failure_rate_%', ascending=False).reset_index()",
+        return template(
+            "s   = cube.stats(['sender_bank','transaction_type'])",
+            "tmp = pd.DataFrame({'failed_count': s['failed'], 'total_count': s['count'], 'failure_rate_%': s['failure_rate'].round(2)}).sort_values('failure_rate_%', ascending=False).reset_index()",
             "tmp.columns = ['Bank','Transaction_Type','Failed_Count','Total_Count','Failure_Rate_%']",
             "result = tmp.head(10)"
         )
 
-    # ── Network failure rate ──────────────────────────────────────────────────
+# ── Network failure rate ──────────────────────────────────────────────────
+@route("network")
+def network_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and "network" in q:
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-            "total  = df.groupby('network_type').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Network': rate.index.tolist(), 'Failed': [int(failed[n]) for n in rate.index], 'Total': [int(total[n]) for n in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('network_type')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Network': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Merchant category failure rate ────────────────────────────────────────
+# ── Merchant category failure rate ────────────────────────────────────────
+@route("merchant", "categor")
+def merchant_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and ("merchant" in q or "categor" in q):
-        wkend = "is_weekend==1" if "weekend" in q else ("is_weekend==0" if "weekday" in q else None)
-        if wkend:
-            col = wkend.split('==')[0]
-            val = wkend.split('==')[1]
-            return code(
-                "df_f = df[df['" + col + "']==" + val + "]",
-                "failed = df_f[df_f['transaction_status']=='FAILED'].groupby('merchant_category').size()",
-                "total  = df_f.groupby('merchant_category').size()",
-                "result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()"
+        wkend = 1 if "weekend" in q else (0 if "weekday" in q else None)
+        if wkend is not None:
+            return template(
+                f"s = cube.stats('merchant_category', where={{'is_weekend': {wkend}}})",
+                "result = s['failure_rate'].round(2).sort_values(ascending=False).to_dict()"
             )
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('merchant_category').size()",
-            "total  = df.groupby('merchant_category').size()",
-            "result = (failed / total * 100).round(2).sort_values(ascending=False).dropna().to_dict()"
+        return template(
+            "s = cube.stats('merchant_category')",
+            "result = s['failure_rate'].round(2).sort_values(ascending=False).dropna().to_dict()"
         )
 
-    # ── Bank failure rate for weekend (context-follow-up) ────────────────────
+# ── Bank failure rate for weekend (context-follow-up) ────────────────────
+@route("weekend")
+def bank_weekend_failure_rate(q, words):
     if ("fail" in q or "failure" in q) and "bank" in q and "weekend" in q:
-        return code(
-            "wk = df[df['is_weekend']==1]",
-            "failed = wk[wk['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total  = wk.groupby('sender_bank').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': failed.values.tolist(), 'Total': total.values.tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('sender_bank', where={'is_weekend': 1})",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Bank failure rate for iOS (context-follow-up) ─────────────────────────
+# ── Bank failure rate for iOS (context-follow-up) ─────────────────────────
+@route("ios")
+def bank_ios_failure_rate(q, words):
     if ("fail" in q or "failure" in q) and "bank" in q and "ios" in q:
-        return code(
-            "ios = df[df['device_type']=='iOS']",
-            "failed = ios[ios['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total  = ios.groupby('sender_bank').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': failed.values.tolist(), 'Total': total.values.tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('sender_bank', where={'device_type': 'iOS'})",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # ── Transaction type failure rate ─────────────────────────────────────────
+# ── Transaction type failure rate ─────────────────────────────────────────
+@route("fail")
+def transaction_type_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and ("transaction type" in q or "all" in q or ("compare" in q and "transaction" in q)):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('transaction_type').size()",
-            "total  = df.groupby('transaction_type').size()",
-            "rate   = (failed / total * 100).round(2).sort_values(ascending=False)",
-            "rows = pd.DataFrame({'Type': rate.index, 'Failed': [int(failed[t]) for t in rate.index], 'Total': [int(total[t]) for t in rate.index], 'Failure_Rate_%': rate.values})",
+        return template(
+            "s    = cube.stats('transaction_type')",
+            "s    = s.assign(rate=s['failure_rate'].round(2)).sort_values('rate', ascending=False)",
+            "rows = pd.DataFrame({'Type': s.index, 'Failed': s['failed'].values, 'Total': s['count'].values, 'Failure_Rate_%': s['rate'].values})",
             "top_type = str(rows['Type'].iloc[0])",
             "top_rate = rows['Failure_Rate_%'].iloc[0]",
             "bot_type = str(rows['Type'].iloc[-1])",
@@ -745,65 +897,69 @@ def route_query(user_query, df):
             "result = ans + chr(10) + chr(10) + rows.to_string(index=False)"
         )
 
-
-    # ── State failure rate ────────────────────────────────────────────────────
+# ── State failure rate ────────────────────────────────────────────────────
+@route("state")
+def state_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and "state" in q:
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('sender_state').size()",
-            "total  = df.groupby('sender_state').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'failed_count': failed, 'total_count': total, 'failure_rate_%': rate}).sort_values('failure_rate_%', ascending=False)"
+        return template(
+            "s      = cube.stats('sender_state')",
+            "result = pd.DataFrame({'failed_count': s['failed'], 'total_count': s['count'], 'failure_rate_%': s['failure_rate'].round(2)}).sort_values('failure_rate_%', ascending=False)"
         )
 
-    # ── Age group failure rate ────────────────────────────────────────────────
+# ── Age group failure rate ────────────────────────────────────────────────
+@route("age")
+def age_failure_rate(q, words):
     if ("failure rate" in q or "fail" in q) and "age" in q:
-        return code(
-            "grp = df.groupby('sender_age_group')",
-            "failed = grp.apply(lambda x: (x['transaction_status']=='FAILED').sum())",
-            "total  = grp.size()",
-            "rate   = (failed / total * 100).round(4)",
-            "result = pd.DataFrame({'failed_count': failed, 'total_count': total, 'failure_rate_%': rate}).sort_values('failure_rate_%', ascending=False)"
+        return template(
+            "s      = cube.stats('sender_age_group')",
+            "result = pd.DataFrame({'failed_count': s['failed'], 'total_count': s['count'], 'failure_rate_%': s['failure_rate'].round(4)}).sort_values('failure_rate_%', ascending=False)"
         )
 
-    # Weekend vs weekday now handled earlier in router
+# Weekend vs weekday now handled earlier in router
 
-    # ── Weekend vs weekday failure ────────────────────────────────────────────
+# ── Weekend vs weekday failure ────────────────────────────────────────────
+@route("weekend")
+def weekend_vs_weekday(q, words):
     if ("weekend" in q and "weekday" in q) or ("weekend" in q and ("compare" in q or "versus" in q or "vs" in q or "fail" in q)):
-        return code(
-            "wkend = df[df['is_weekend']==1]",
-            "wkday = df[df['is_weekend']==0]",
+        return template(
+            "wk = cube.stats('is_weekend').loc[[1, 0]]",
             "result = pd.DataFrame({",
             "    'Period': ['Weekend','Weekday'],",
-            "    'Total_Transactions': [len(wkend), len(wkday)],",
-            "    'Failed': [int(wkend['transaction_status'].eq('FAILED').sum()), int(wkday['transaction_status'].eq('FAILED').sum())],",
-            "    'Failure_Rate_%': [round(wkend['transaction_status'].eq('FAILED').mean()*100,2), round(wkday['transaction_status'].eq('FAILED').mean()*100,2)],",
-            "    'Avg_Amount_INR': [round(wkend['amount_inr'].mean(),2), round(wkday['amount_inr'].mean(),2)]",
+            "    'Total_Transactions': wk['count'].tolist(),",
+            "    'Failed': wk['failed'].tolist(),",
+            "    'Failure_Rate_%': wk['failure_rate'].round(2).tolist(),",
+            "    'Avg_Amount_INR': wk['amount_mean'].round(2).tolist()",
             "})"
         )
 
-    # ── Weekend FRAUD by age (must be before spending pattern) ───────────────
+# ── Weekend FRAUD by age (must be before spending pattern) ───────────────
+@route("weekend")
+def weekend_fraud_by_age(q, words):
     if ("fraud" in q or "flag" in q) and "age" in q and "weekend" in q:
-        return code(
-            "wknd_df = df[df['is_weekend']==1]",
-            "fraud_wk = wknd_df.groupby('sender_age_group')['fraud_flag'].agg(['sum','count'])",
-            "fraud_wk.columns = ['Fraud_Count','Total_Count']",
+        return template(
+            "s = cube.stats('sender_age_group', where={'is_weekend': 1})",
+            "fraud_wk = pd.DataFrame({'Fraud_Count': s['fraud'], 'Total_Count': s['count']})",
             "fraud_wk['Fraud_Rate_%'] = (fraud_wk['Fraud_Count']/fraud_wk['Total_Count']*100).round(4)",
             "fraud_wk = fraud_wk.sort_values('Fraud_Rate_%', ascending=False).reset_index()",
             "fraud_wk.rename(columns={'sender_age_group':'Age_Group'}, inplace=True)",
             "result = fraud_wk"
         )
 
-    # ── Weekend spending by age ───────────────────────────────────────────────
+# ── Weekend spending by age ───────────────────────────────────────────────
+@route("weekend")
+def weekend_spending_by_age(q, words):
     if "weekend" in q and ("age" in q or "spend" in q or "amount" in q):
-        return code(
-            "result = df[df['is_weekend']==1].groupby('sender_age_group')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_age_group', where={'is_weekend': 1})['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # ── Fraud by bank ─────────────────────────────────────────────────────────
+# ── Fraud by bank ─────────────────────────────────────────────────────────
+@route("bank")
+def fraud_by_bank(q, words):
     if ("fraud" in q or "flag" in q) and "bank" in q:
-        return code(
-            "tmp = df.groupby('sender_bank')['fraud_flag'].agg(['sum','count']).copy()",
-            "tmp.columns = ['Fraud_Count','Total_Count']",
+        return template(
+            "s   = cube.stats('sender_bank')",
+            "tmp = pd.DataFrame({'Fraud_Count': s['fraud'], 'Total_Count': s['count']})",
             "tmp['Fraud_Rate_%'] = (tmp['Fraud_Count']/tmp['Total_Count']*100).round(4)",
             "tmp = tmp.sort_values('Fraud_Rate_%', ascending=False).reset_index().rename(columns={'sender_bank':'Bank'})",
             "top_fb = str(tmp['Bank'].iloc[0])", 
@@ -816,34 +972,43 @@ def route_query(user_query, df):
             "result = summary + chr(10) + chr(10) + tmp.to_string(index=False)"
         )
 
-    # ── Fraud by network ──────────────────────────────────────────────────────
+# ── Fraud by network ──────────────────────────────────────────────────────
+@route("network")
+def fraud_by_network(q, words):
     if ("fraud" in q or "flag" in q) and "network" in q:
-        return code(
-            "result = df[df['fraud_flag']==1].groupby('network_type').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "fraud  = cube.stats('network_type')['fraud']",
+            "result = fraud[fraud > 0].sort_values(ascending=False).to_dict()"
         )
 
-    # ── High value fraud ──────────────────────────────────────────────────────
+# ── High value fraud ──────────────────────────────────────────────────────
+@route("5000", "high value", "above")
+def high_value_fraud(q, words):
     if ("fraud" in q or "flag" in q) and ("high value" in q or "above" in q or "5000" in q or "percent" in q or "%" in q) and ("5000" in q or "high value" in q or "above" in q):
-        return code(
-            "high_val = df[df['amount_inr'] > 5000]",
-            "total_high = len(high_val)",
-            "flagged_high = int(high_val['fraud_flag'].sum())",
-            "rate = round(high_val['fraud_flag'].mean() * 100, 4)",
-            "overall_rate = round(df['fraud_flag'].mean()*100, 4)",
+        return template(
+            "high_val = group_stats(df, mask=df['amount_inr'] > 5000)",
+            "total_high = int(high_val['count'])",
+            "flagged_high = int(high_val['fraud'])",
+            "rate = round(high_val['fraud_rate'], 4)",
+            "overall_rate = round(cube.totals()['fraud_rate'], 4)",
             "result = pd.DataFrame({'Metric': ['Total transactions above Rs5000', 'Flagged among those', 'Flag Rate above Rs5000', 'Overall flag rate all transactions'], 'Value': [total_high, flagged_high, str(rate)+'%', str(overall_rate)+'%']})"
         )
 
-    # ── Fraud by age ──────────────────────────────────────────────────────────
+# ── Fraud by age ──────────────────────────────────────────────────────────
+@route("age")
+def fraud_by_age(q, words):
     if ("fraud" in q or "flag" in q) and "age" in q:
-        return code(
-            "result = df.groupby('sender_age_group')['fraud_flag'].mean().mul(100).round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_age_group')['fraud_rate'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # ── Fraud by state ────────────────────────────────────────────────────────
+# ── Fraud by state ────────────────────────────────────────────────────────
+@route("state")
+def fraud_by_state(q, words):
     if ("fraud" in q or "flag" in q) and "state" in q:
-        return code(
-            "tmp = df.groupby('sender_state')['fraud_flag'].agg(['sum','count'])",
-            "tmp.columns = ['Fraud_Count','Total_Count']",
+        return template(
+            "s   = cube.stats('sender_state')",
+            "tmp = pd.DataFrame({'Fraud_Count': s['fraud'], 'Total_Count': s['count']})",
             "tmp['Fraud_Rate_%'] = (tmp['Fraud_Count']/tmp['Total_Count']*100).round(4)",
             "tmp = tmp.sort_values('Fraud_Rate_%', ascending=False).reset_index().rename(columns={'sender_state':'State'})",
             "top_ss = str(tmp['State'].iloc[0])", 
@@ -854,276 +1019,307 @@ def route_query(user_query, df):
             "result = summary + chr(10) + chr(10) + tmp.head(10).to_string(index=False)"
         )
 
-    # ── Peak hours ────────────────────────────────────────────────────────────
+# ── Peak hours ────────────────────────────────────────────────────────────
+@route("hour")
+def failures_by_hour(q, words):
     if ("peak hour" in q or "hour" in q) and "fail" in q:
-        return code(
-            "result = df[df['transaction_status']=='FAILED'].groupby('hour_of_day').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "failed = cube.stats('hour_of_day')['failed']",
+            "result = failed[failed > 0].sort_values(ascending=False).to_dict()"
         )
 
+@route("p2m")
+def p2m_peak_hours(q, words):
     if "peak hour" in q and "p2m" in q:
-        return code(
-            "result = df[df['transaction_type']=='P2M'].groupby('hour_of_day').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('hour_of_day', where={'transaction_type': 'P2M'})['count'].sort_values(ascending=False).to_dict()"
         )
 
+@route("hour")
+def peak_hours(q, words):
     if "peak hour" in q or ("hour" in q and ("most" in q or "highest" in q)):
-        return code(
-            "hourly = df.groupby('hour_of_day').size().sort_values(ascending=False).reset_index()",
+        return template(
+            "hourly = cube.stats('hour_of_day')['count'].sort_values(ascending=False).reset_index()",
             "hourly.columns = ['Hour', 'Transaction_Count']",
             "hourly['Hour'] = hourly['Hour'].astype(str) + ':00'",
             "result = hourly"
         )
 
-    # ── Monthly trend ─────────────────────────────────────────────────────────
+# ── Monthly trend ─────────────────────────────────────────────────────────
+@route("month")
+def monthly_trend(q, words):
     if "month" in q and ("trend" in q or "volume" in q or "count" in q or "transactions" in q or "2024" in q):
-        return code(
-            "df2 = df.copy()",
-            "df2['month'] = df2['timestamp'].dt.to_period('M').astype(str)",
-            "monthly = df2.groupby('month').size().sort_index()",
+        return template(
+            "monthly = group_stats(df, df['timestamp'].dt.to_period('M'))['count']",
             "highest = monthly.idxmax()",
             "lowest  = monthly.idxmin()",
             "result = (",
-            "    f'>>> HIGHEST MONTH: {highest} with {int(monthly[highest]):,} transactions <<<\n'",
-            "    f'>>> LOWEST MONTH: {lowest} with {int(monthly[lowest]):,} transactions <<<\n'",
-            "    f'Average per month: {int(monthly.mean()):,}\n\n'",
-            "    + '\n'.join([f'{m}: {int(v):,} transactions' for m, v in monthly.items()])",
+            "    f'>>> HIGHEST MONTH: {highest} with {int(monthly[highest]):,} transactions <<<' + chr(10)",
+            "    + f'>>> LOWEST MONTH: {lowest} with {int(monthly[lowest]):,} transactions <<<' + chr(10)",
+            "    + f'Average per month: {int(monthly.mean()):,}' + chr(10) + chr(10)",
+            "    + chr(10).join([f'{m}: {int(v):,} transactions' for m, v in monthly.items()])",
             ")"
         )
 
-    # ── Day of week ───────────────────────────────────────────────────────────
+# ── Day of week ───────────────────────────────────────────────────────────
+@route("day")
+def weekday_pattern(q, words):
     if "day of week" in q or "day_of_week" in q or ("day" in q and ("week" in q or "highest" in q or "average" in q)):
         if "amount" in q or "spend" in q or "average" in q or "avg" in q:
-            return code(
+            return template(
                 "order = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']",
-                "result = df.groupby('day_of_week')['amount_inr'].mean().round(2).reindex(order).to_dict()"
+                "result = cube.stats('day_of_week')['amount_mean'].round(2).reindex(order).to_dict()"
             )
-        return code(
+        return template(
             "order = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']",
-            "result = df.groupby('day_of_week').size().reindex(order).to_dict()"
+            "result = cube.stats('day_of_week')['count'].reindex(order).to_dict()"
         )
 
-    # ── Success rate comparisons ──────────────────────────────────────────────
+# ── Success rate comparisons ──────────────────────────────────────────────
+@route("network")
+def network_success_rate(q, words):
     if "success rate" in q and "network" in q:
-        return code(
-            "success = df[df['transaction_status']=='SUCCESS'].groupby('network_type').size()",
-            "total   = df.groupby('network_type').size()",
-            "result  = (success / total * 100).round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result  = cube.stats('network_type')['success_rate'].round(2).sort_values(ascending=False).to_dict()"
         )
 
+@route("bank")
+def bank_success_rate(q, words):
     if "success rate" in q and "bank" in q:
-        return code(
-            "success = df[df['transaction_status']=='SUCCESS'].groupby('sender_bank').size()",
-            "total   = df.groupby('sender_bank').size()",
-            "result  = (success / total * 100).round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result  = cube.stats('sender_bank')['success_rate'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # ── P2P by age group ──────────────────────────────────────────────────────
+# ── P2P by age group ──────────────────────────────────────────────────────
+@route("p2p")
+def p2p_by_age(q, words):
     if "p2p" in q and ("age" in q or "most" in q or "frequently" in q):
-        return code(
-            "result = df[df['transaction_type']=='P2P'].groupby('sender_age_group').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_age_group', where={'transaction_type': 'P2P'})['count'].sort_values(ascending=False).to_dict()"
         )
 
-    # ── Average amount by state ───────────────────────────────────────────────
+# ── Average amount by state ───────────────────────────────────────────────
+@route("state")
+def state_avg_amount(q, words):
     if ("average" in q or "avg" in q) and "state" in q:
-        return code(
-            "result = df.groupby('sender_state')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_state')['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # ── Average amount for failed by bank ─────────────────────────────────────
+# ── Average amount for failed by bank ─────────────────────────────────────
+@route("fail")
+def failed_avg_amount_by_bank(q, words):
     if ("average" in q or "avg" in q) and "bank" in q and "fail" in q:
-        return code(
-            "result = df[df['transaction_status']=='FAILED'].groupby('sender_bank')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "failed = group_stats(df, 'sender_bank', mask=idx.eq('transaction_status', 'FAILED'))",
+            "result = failed['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # Average amount by merchant category
+# Average amount by merchant category
+@route("merchant", "categor")
+def merchant_avg_amount(q, words):
     if ("average" in q or "avg" in q) and ("merchant" in q or "categor" in q):
-        return code(
-            "result = df.groupby('merchant_category')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
-        )
-
-    # Average amount by state
-    if ("average" in q or "avg" in q) and "state" in q:
-        return code(
-            "result = df.groupby('sender_state')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('merchant_category')['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # Average amount by age group
+# Average amount by age group
+@route("age")
+def age_avg_amount(q, words):
     if ("average" in q or "avg" in q) and "age" in q:
-        return code(
-            "result = df.groupby('sender_age_group')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_age_group')['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # Average amount by bank
+# Average amount by bank
+@route("bank")
+def bank_avg_amount(q, words):
     if ("average" in q or "avg" in q) and "bank" in q and "fail" not in q:
-        return code(
-            "result = df.groupby('sender_bank')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_bank')['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # Average amount by transaction type
+# Average amount by transaction type
+@route("amount")
+def transaction_type_avg_amount(q, words):
     if ("average" in q or "avg" in q) and ("transaction" in q or "type" in q) and "amount" in q:
-        return code(
-            "result = df.groupby('transaction_type')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('transaction_type')['amount_mean'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # Count/volume by state
+# Count/volume by state
+@route("state")
+def state_volume(q, words):
     if ("count" in q or "volume" in q or "number" in q or "transactions" in q) and "state" in q:
-        return code(
-            "result = df.groupby('sender_state').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_state')['count'].sort_values(ascending=False).to_dict()"
         )
 
-    # Count by transaction type
+# Count by transaction type
+@route("count", "volume", "number")
+def transaction_type_volume(q, words):
     if ("count" in q or "volume" in q or "number" in q) and ("transaction" in q or "type" in q):
-        return code(
-            "result = df.groupby('transaction_type').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('transaction_type')['count'].sort_values(ascending=False).to_dict()"
         )
 
-    # Count by bank
+# Count by bank
+@route("bank")
+def bank_volume(q, words):
     if ("count" in q or "volume" in q or "number" in q) and "bank" in q:
-        return code(
-            "result = df.groupby('sender_bank').size().sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_bank')['count'].sort_values(ascending=False).to_dict()"
         )
 
-    # Just "pct" alone or "pct of fraud"
+# Just "pct" alone or "pct of fraud"
+@route("pct", "percent")
+def bare_percentage(q, words):
     if q.strip() in ["pct","percentage","percent"]:
-        return code("result = round(df['fraud_flag'].mean() * 100, 2)")
+        return template("result = round(cube.totals()['fraud_rate'], 2)")
 
-    # Fraud percentage
+# Fraud percentage
+@route("fraud", "flag")
+def fraud_percentage(q, words):
     if ("pct" in q or "percent" in q or "percentage" in q or "rate" in q) and ("fraud" in q or "flag" in q) and not any(x in q for x in ["state","bank","age","network","device"]):
-        return code(
-            "result = round(df['fraud_flag'].mean() * 100, 2)"
+        return template(
+            "result = round(cube.totals()['fraud_rate'], 2)"
         )
 
-    # Deep dive / drill down — break down by multiple dimensions
-    if any(phrase in q for phrase in ["deeper breakdown","deeper analysis","deep dive","drill down","break it down","breakdown of"]):
+# Deep dive / drill down — break down by multiple dimensions
+@route(*DEEP_DIVE_PHRASES)
+def deep_dive(q, words):
+    if any(phrase in q for phrase in DEEP_DIVE_PHRASES):
         if "fail" in q or "failure" in q:
-            return code(
-                "failed_dev = df[df['transaction_status']=='FAILED'].groupby('device_type').size()",
-                "total_dev  = df.groupby('device_type').size()",
-                "failed_net = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-                "total_net  = df.groupby('network_type').size()",
-                "failed_age = df[df['transaction_status']=='FAILED'].groupby('sender_age_group').size()",
-                "total_age  = df.groupby('sender_age_group').size()",
+            return template(
+                "rate_dev = cube.stats('device_type')['failure_rate']",
+                "rate_net = cube.stats('network_type')['failure_rate']",
+                "rate_age = cube.stats('sender_age_group')['failure_rate']",
                 "result = {",
-                "    'By Device': (failed_dev/total_dev*100).round(2).to_dict(),",
-                "    'By Network': (failed_net/total_net*100).round(2).to_dict(),",
-                "    'By Age Group': (failed_age/total_age*100).round(2).to_dict(),",
+                "    'By Device': rate_dev.round(2).to_dict(),",
+                "    'By Network': rate_net.round(2).to_dict(),",
+                "    'By Age Group': rate_age.round(2).to_dict(),",
                 "}"
             )
         if "recharge" in q:
-            return code(
-                "df_r = df[df['transaction_type']=='Recharge']",
-                "failed_dev = df_r[df_r['transaction_status']=='FAILED'].groupby('device_type').size()",
-                "total_dev  = df_r.groupby('device_type').size()",
-                "failed_net = df_r[df_r['transaction_status']=='FAILED'].groupby('network_type').size()",
-                "total_net  = df_r.groupby('network_type').size()",
-                "failed_bank = df_r[df_r['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-                "total_bank  = df_r.groupby('sender_bank').size()",
+            return template(
+                "rate_dev = cube.stats('device_type', where={'transaction_type': 'Recharge'})['failure_rate']",
+                "rate_net = cube.stats('network_type', where={'transaction_type': 'Recharge'})['failure_rate']",
+                "rate_bank = cube.stats('sender_bank', where={'transaction_type': 'Recharge'})['failure_rate']",
                 "result = {",
-                "    'Recharge Failure by Device': (failed_dev/total_dev*100).round(2).to_dict(),",
-                "    'Recharge Failure by Network': (failed_net/total_net*100).round(2).to_dict(),",
-                "    'Recharge Failure by Bank': (failed_bank/total_bank*100).round(2).to_dict(),",
+                "    'Recharge Failure by Device': rate_dev.round(2).to_dict(),",
+                "    'Recharge Failure by Network': rate_net.round(2).to_dict(),",
+                "    'Recharge Failure by Bank': rate_bank.round(2).to_dict(),",
                 "}"
             )
 
-    # "Why is X failing" questions - show failure rate comparison
+# "Why is X failing" questions - show failure rate comparison
+@route("why")
+def why_failing(q, words):
     if "why" in q and ("fail" in q or "failing" in q):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('transaction_type').size()",
-            "total  = df.groupby('transaction_type').size()",
-            "result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "rate = cube.stats('transaction_type')['failure_rate']",
+            "result = rate.round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # "Worst performance" / "best performance" by device, network, bank etc
-    if any(phrase in q for phrase in ["worst performance","best performance","worst performing","best performing","poorly performing","worst device","best device"]):
+# "Worst performance" / "best performance" by device, network, bank etc
+@route(*PERFORMANCE_PHRASES)
+def performance_ranking(q, words):
+    if any(phrase in q for phrase in PERFORMANCE_PHRASES):
         if "device" in q or "android" in q or "ios" in q or "web" in q:
-            return code(
-                "failed = df[df['transaction_status']=='FAILED'].groupby('device_type').size()",
-                "total  = df.groupby('device_type').size()",
-                "result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()"
+            return template(
+                "rate = cube.stats('device_type')['failure_rate']",
+                "result = rate.round(2).sort_values(ascending=False).to_dict()"
             )
         elif "network" in q:
-            return code(
-                "failed = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-                "total  = df.groupby('network_type').size()",
-                "result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()"
+            return template(
+                "rate = cube.stats('network_type')['failure_rate']",
+                "result = rate.round(2).sort_values(ascending=False).to_dict()"
             )
         elif "bank" in q:
-            return code(
-                "failed = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-                "total  = df.groupby('sender_bank').size()",
-                "result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()"
+            return template(
+                "rate = cube.stats('sender_bank')['failure_rate']",
+                "result = rate.round(2).sort_values(ascending=False).to_dict()"
             )
         else:
             # Default — compare all dimensions
-            return code(
-                "failed_dev = df[df['transaction_status']=='FAILED'].groupby('device_type').size()",
-                "total_dev  = df.groupby('device_type').size()",
-                "failed_net = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-                "total_net  = df.groupby('network_type').size()",
+            return template(
+                "rate_dev = cube.stats('device_type')['failure_rate']",
+                "rate_net = cube.stats('network_type')['failure_rate']",
                 "result = {",
-                "    'Failure by Device %': (failed_dev/total_dev*100).round(2).sort_values(ascending=False).to_dict(),",
-                "    'Failure by Network %': (failed_net/total_net*100).round(2).sort_values(ascending=False).to_dict(),",
+                "    'Failure by Device %': rate_dev.round(2).sort_values(ascending=False).to_dict(),",
+                "    'Failure by Network %': rate_net.round(2).sort_values(ascending=False).to_dict(),",
                 "}"
             )
 
-    # "Most at risk" age group
+# "Most at risk" age group
+@route("age")
+def most_at_risk_age(q, words):
     if ("most at risk" in q or "highest risk" in q or "riskiest" in q) and "age" in q:
-        return code(
+        return template(
+            "s = cube.stats('sender_age_group')",
             "result = {",
-            "    'Fraud rate by age %': df.groupby('sender_age_group')['fraud_flag'].mean().mul(100).round(2).sort_values(ascending=False).to_dict(),",
-            "    'Failure rate by age %': (df[df['transaction_status']=='FAILED'].groupby('sender_age_group').size() / df.groupby('sender_age_group').size()*100).round(2).sort_values(ascending=False).to_dict(),",
+            "    'Fraud rate by age %': s['fraud_rate'].round(2).sort_values(ascending=False).to_dict(),",
+            "    'Failure rate by age %': s['failure_rate'].round(2).sort_values(ascending=False).to_dict(),",
             "}"
         )
 
-    # "Most important insight" / "key insight"
-    if any(phrase in q for phrase in ["most important insight","key insight","biggest insight","main insight","top insight","most critical"]):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('transaction_type').size()",
-            "total  = df.groupby('transaction_type').size()",
-            "fail_type = (failed/total*100).round(2).sort_values(ascending=False).to_dict()",
-            "failed_net = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-            "total_net  = df.groupby('network_type').size()",
-            "fail_net = (failed_net/total_net*100).round(2).sort_values(ascending=False).to_dict()",
+# "Most important insight" / "key insight"
+@route(*INSIGHT_PHRASES)
+def key_insight(q, words):
+    if any(phrase in q for phrase in INSIGHT_PHRASES):
+        return template(
+            "rate = cube.stats('transaction_type')['failure_rate']",
+            "fail_type = rate.round(2).sort_values(ascending=False).to_dict()",
+            "rate_net = cube.stats('network_type')['failure_rate']",
+            "fail_net = rate_net.round(2).sort_values(ascending=False).to_dict()",
+            "t = cube.totals()",
             "result = {",
-            "    'Overall Success Rate %': round((df['transaction_status']=='SUCCESS').mean()*100,2),",
-            "    'Overall Failure Rate %': round((df['transaction_status']=='FAILED').mean()*100,2),",
+            "    'Overall Success Rate %': round(t['success_rate'],2),",
+            "    'Overall Failure Rate %': round(t['failure_rate'],2),",
             "    'Highest Failure Type': fail_type,",
             "    'Highest Failure Network': fail_net,",
-            "    'Fraud Flag Rate %': round(df['fraud_flag'].mean()*100,2),",
-            "    'Avg Transaction INR': round(df['amount_inr'].mean(),2),",
+            "    'Fraud Flag Rate %': round(t['fraud_rate'],2),",
+            "    'Avg Transaction INR': round(t['amount_mean'],2),",
             "}"
         )
 
-    # "Banks performing poorly" = banks with highest failure rate
+# "Banks performing poorly" = banks with highest failure rate
+@route("bank")
+def poorly_performing_banks(q, words):
     if ("perform" in q and "poor" in q and "bank" in q) or ("worst" in q and "bank" in q) or ("bad" in q and "bank" in q):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total  = df.groupby('sender_bank').size()",
-            "rate   = (failed / total * 100).round(2)",
-            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': [int(failed[b]) for b in rate.index], 'Total': [int(total[b]) for b in rate.index], 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
+        return template(
+            "s      = cube.stats('sender_bank')",
+            "rate   = s['failure_rate'].round(2)",
+            "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), 'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()}).sort_values('Failure_Rate_%', ascending=False).reset_index(drop=True)"
         )
 
-    # "Risky states" = states with highest fraud flag rate
+# "Risky states" = states with highest fraud flag rate
+@route("state")
+def risky_states(q, words):
     if ("risk" in q or "risky" in q or "dangerous" in q or "unsafe" in q) and "state" in q:
-        return code(
-            "result = df.groupby('sender_state')['fraud_flag'].mean().mul(100).round(2).sort_values(ascending=False).to_dict()"
+        return template(
+            "result = cube.stats('sender_state')['fraud_rate'].round(2).sort_values(ascending=False).to_dict()"
         )
 
-    # "Reduce fraud" or "fraud risk profile" or "most at risk fraud"
+# "Reduce fraud" or "fraud risk profile" or "most at risk fraud"
+@route("fraud", "flag")
+def fraud_risk_profile(q, words):
     if ("reduce" in q or "prevent" in q or "stop" in q or "risk profile" in q or "most at risk" in q) and ("fraud" in q or "flag" in q):
-        return code(
-            "total_txns = len(df)",
-            "total_fraud = int(df['fraud_flag'].sum())",
-            "overall_rate = round(df['fraud_flag'].mean()*100, 4)",
+        return template(
+            "t = cube.totals()",
+            "total_txns = int(t['count'])",
+            "total_fraud = int(t['fraud'])",
+            "overall_rate = round(t['fraud_rate'], 4)",
             "# Age group fraud - ranked by rate",
-            "fraud_age = df.groupby('sender_age_group')['fraud_flag'].agg(['sum','count']).rename(columns={'sum':'fraud_count','count':'total_count'})",
+            "fraud_age = cube.stats('sender_age_group')[['fraud','count']].rename(columns={'fraud':'fraud_count','count':'total_count'})",
             "fraud_age['fraud_rate_%'] = (fraud_age['fraud_count']/fraud_age['total_count']*100).round(4)",
             "fraud_age = fraud_age.sort_values('fraud_rate_%', ascending=False)",
             "# State fraud - ranked by rate",
-            "fraud_state = df.groupby('sender_state')['fraud_flag'].agg(['sum','count']).rename(columns={'sum':'fraud_count','count':'total_count'})",
+            "fraud_state = cube.stats('sender_state')[['fraud','count']].rename(columns={'fraud':'fraud_count','count':'total_count'})",
             "fraud_state['fraud_rate_%'] = (fraud_state['fraud_count']/fraud_state['total_count']*100).round(4)",
             "fraud_state = fraud_state.sort_values('fraud_rate_%', ascending=False).head(5)",
             "# Bank fraud - ranked by rate",
-            "fraud_bank = df.groupby('sender_bank')['fraud_flag'].agg(['sum','count']).rename(columns={'sum':'fraud_count','count':'total_count'})",
+            "fraud_bank = cube.stats('sender_bank')[['fraud','count']].rename(columns={'fraud':'fraud_count','count':'total_count'})",
             "fraud_bank['fraud_rate_%'] = (fraud_bank['fraud_count']/fraud_bank['total_count']*100).round(4)",
             "fraud_bank = fraud_bank.sort_values('fraud_rate_%', ascending=False)",
             "result = {",
@@ -1139,30 +1335,25 @@ def route_query(user_query, df):
             "}"
         )
 
-    # "Complete diagnosis" / "overall health" / "system overview"
-    if any(phrase in q for phrase in ["complete diagnosis","full diagnosis","system diagnosis","payment diagnosis",
-        "overall health","system health","complete analysis","full analysis","overall performance",
-        "how is our system","how are we performing","complete overview",
-        "how are payments doing","payments doing","how is it going","overall summary","quick summary",
-        "how are we doing overall","payments overall"]):
-        return code(
-            "failed = df[df['transaction_status']=='FAILED'].groupby('transaction_type').size()",
-            "total  = df.groupby('transaction_type').size()",
-            "fail_by_type = (failed/total*100).round(2).sort_values(ascending=False).to_dict()",
-            "failed_dev = df[df['transaction_status']=='FAILED'].groupby('device_type').size()",
-            "total_dev  = df.groupby('device_type').size()",
-            "fail_by_dev = (failed_dev/total_dev*100).round(2).sort_values(ascending=False).to_dict()",
-            "failed_net = df[df['transaction_status']=='FAILED'].groupby('network_type').size()",
-            "total_net  = df.groupby('network_type').size()",
-            "fail_by_net = (failed_net/total_net*100).round(2).sort_values(ascending=False).to_dict()",
-            "failed_bank = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size()",
-            "total_bank  = df.groupby('sender_bank').size()",
-            "fail_by_bank = (failed_bank/total_bank*100).round(2).sort_values(ascending=False).to_dict()",
+# "Complete diagnosis" / "overall health" / "system overview"
+@route(*DIAGNOSIS_PHRASES)
+def complete_diagnosis(q, words):
+    if any(phrase in q for phrase in DIAGNOSIS_PHRASES):
+        return template(
+            "rate = cube.stats('transaction_type')['failure_rate']",
+            "fail_by_type = rate.round(2).sort_values(ascending=False).to_dict()",
+            "rate_dev = cube.stats('device_type')['failure_rate']",
+            "fail_by_dev = rate_dev.round(2).sort_values(ascending=False).to_dict()",
+            "rate_net = cube.stats('network_type')['failure_rate']",
+            "fail_by_net = rate_net.round(2).sort_values(ascending=False).to_dict()",
+            "rate_bank = cube.stats('sender_bank')['failure_rate']",
+            "fail_by_bank = rate_bank.round(2).sort_values(ascending=False).to_dict()",
+            "t = cube.totals()",
             "result = {",
-            "    '✅ Overall Success Rate %': round((df['transaction_status']=='SUCCESS').mean()*100,2),",
-            "    '❌ Overall Failure Rate %': round((df['transaction_status']=='FAILED').mean()*100,2),",
-            "    '⚠️ Fraud Flag Rate %': round(df['fraud_flag'].mean()*100,2),",
-            "    '💳 Avg Transaction ₹': round(df['amount_inr'].mean(),2),",
+            "    '✅ Overall Success Rate %': round(t['success_rate'],2),",
+            "    '❌ Overall Failure Rate %': round(t['failure_rate'],2),",
+            "    '⚠️ Fraud Flag Rate %': round(t['fraud_rate'],2),",
+            "    '💳 Avg Transaction ₹': round(t['amount_mean'],2),",
             "    '❌ Failure by Transaction Type': fail_by_type,",
             "    '❌ Failure by Device': fail_by_dev,",
             "    '❌ Failure by Network': fail_by_net,",
@@ -1170,36 +1361,155 @@ def route_query(user_query, df):
             "}"
         )
 
-    # "Are weekends better or worse"
+# "Are weekends better or worse"
+@route("weekend")
+def weekend_better_or_worse(q, words):
     if "weekend" in q and ("better" in q or "worse" in q or "good" in q or "bad" in q):
-        return code(
+        return template(
+            "wk = cube.stats('is_weekend')",
             "result = {",
-            "    'Weekend failure rate %': round(df[df['is_weekend']==1]['transaction_status'].eq('FAILED').mean()*100,2),",
-            "    'Weekday failure rate %': round(df[df['is_weekend']==0]['transaction_status'].eq('FAILED').mean()*100,2),",
-            "    'Weekend avg amount ₹': round(df[df['is_weekend']==1]['amount_inr'].mean(),2),",
-            "    'Weekday avg amount ₹': round(df[df['is_weekend']==0]['amount_inr'].mean(),2),",
+            "    'Weekend failure rate %': round(wk.loc[1, 'failure_rate'],2),",
+            "    'Weekday failure rate %': round(wk.loc[0, 'failure_rate'],2),",
+            "    'Weekend avg amount ₹': round(wk.loc[1, 'amount_mean'],2),",
+            "    'Weekday avg amount ₹': round(wk.loc[0, 'amount_mean'],2),",
             "}"
         )
 
-    # "Tell me about [age group]"
+# "Tell me about [age group]"
+@route("tell me")
+def age_group_profile(q, words):
     if "tell me" in q and "age" in q:
-        return code(
+        return template(
+            "s = cube.stats('sender_age_group')",
             "result = {",
-            "    'Transaction count by age': df.groupby('sender_age_group').size().to_dict(),",
-            "    'Avg amount by age ₹': df.groupby('sender_age_group')['amount_inr'].mean().round(2).to_dict(),",
-            "    'Failure rate by age %': (df[df['transaction_status']=='FAILED'].groupby('sender_age_group').size() / df.groupby('sender_age_group').size()*100).round(2).to_dict(),",
-            "    'Fraud rate by age %': df.groupby('sender_age_group')['fraud_flag'].mean().mul(100).round(2).to_dict(),",
+            "    'Transaction count by age': s['count'].to_dict(),",
+            "    'Avg amount by age ₹': s['amount_mean'].round(2).to_dict(),",
+            "    'Failure rate by age %': s['failure_rate'].round(2).to_dict(),",
+            "    'Fraud rate by age %': s['fraud_rate'].round(2).to_dict(),",
             "}"
         )
 
-    return None
+@functools.lru_cache(maxsize=4096)
+def _word_routes(word):
+    """
+    Rules a single word of the question can enable: the mask of one-word keywords
+    found inside it, and the multi-word keywords whose first word it contains
+    (only those are then searched for in the whole question).
+    """
+    mask, phrases = 0, []
+    for kw, rules in _ROUTE_MASKS.items():
+        first, _, rest = kw.partition(" ")
+        if first in word:
+            if rest:
+                phrases.append(kw)
+            else:
+                mask |= rules
+    return mask, tuple(phrases)
+
+def candidate_routes(q, words):
+    """Bitmask over ROUTES of the rules whose keywords occur in q."""
+    mask, phrases = 0, set()
+    for word in words:
+        word_mask, word_phrases = _word_routes(word)
+        mask |= word_mask
+        phrases.update(word_phrases)
+    for kw in phrases:
+        if kw in q:
+            mask |= _ROUTE_MASKS[kw]
+    return mask
+
+def match_route(user_query, indexed=True):
+    """
+    (rule, code) for the first rule that answers the question; code is None when
+    the question should go to the LLM, rule is None when no rule matched.
+    indexed=False tries every rule in turn (the reference order for benchmarks).
+    """
+    q = user_query.lower()
+    words = q.split()
+    mask = candidate_routes(q, words) if indexed else (1 << len(ROUTES)) - 1
+    while mask:
+        low = mask & -mask
+        rule = ROUTES[low.bit_length() - 1]
+        out = rule(q, words)
+        if out is not None:
+            return rule, (None if out is SKIP_ROUTER else out)
+        mask ^= low
+    return None, None
+
+def route_query(user_query, df):
+    return match_route(user_query)[1]
+
+@traced()
+def plan_query(user_query):
+    """QueryPlan for a question no template answers, or None (see queryplan.py)."""
+    return get_parser().parse(user_query)
 
 
 # ── LLM: Generate Pandas Code ────────────────────────────────────────────────
-def generate_pandas_code(user_query, df_summary, conversation_history, client):
-    system_prompt = """You are a senior Python/Pandas data analyst.
-You have a DataFrame called `df` with this schema and summary:
-DF_SUMMARY_PLACEHOLDER
+# ── LLM completion cache ─────────────────────────────────────────────────────
+# Finished completions on disk, keyed by endpoint/model, prompt, sampling
+# parameters and dataset fingerprint (see llmcache.py). Code generation always
+# uses it; insights only with INSIGHTX_LLM_CACHE_INSIGHTS=1, since their
+# wording is meant to vary.
+LLM_CACHE_INSIGHTS = os.environ.get("INSIGHTX_LLM_CACHE_INSIGHTS", "0") == "1"
+
+@st.cache_resource
+def get_llm_cache():
+    return CompletionCache(
+        os.path.join(CACHE_DIR, CACHE_FILE),
+        ttl_s=float(os.environ.get("INSIGHTX_LLM_CACHE_HOURS", 168)) * 3600,
+        max_bytes=int(os.environ.get("INSIGHTX_LLM_CACHE_MB", 32)) * 1024 * 1024,
+    )
+
+def insight_cache():
+    """The completion cache if insights are cached, else None."""
+    return get_llm_cache() if LLM_CACHE_INSIGHTS else None
+
+def llm_cache_key(client, request):
+    return completion_key(request, get_dataset().fingerprint, endpoint=str(getattr(client, "base_url", "")))
+
+@dataclass
+class PromptUsage:
+    """Token counts of one code-generation prompt."""
+    prompt_tokens: int = None     # whole prompt: the server's count, else an estimate
+    prefix_tokens: int = None     # the static system prompt's share of it
+    cached_tokens: int = None     # prompt tokens the server reused from its prefix cache, if reported
+    estimated: bool = False       # no usage from the server — counts are estimate_tokens()
+    sent: bool = True             # False when the completion cache answered
+    patterns: int = None          # SAFE PATTERN examples the prompt carried
+
+def prompt_caption(usage):
+    approx = "≈" if usage.estimated else ""
+    text = (f"🧾 Code prompt: {approx}{usage.prompt_tokens:,} tokens, {approx}{usage.prefix_tokens:,} of them "
+            f"the static prefix ({usage.prefix_tokens / usage.prompt_tokens:.0%})")
+    if usage.patterns is not None:
+        text += f" · {usage.patterns} of {len(PATTERN_INDEX)} patterns"
+    if usage.cached_tokens is not None:
+        text += f" · {usage.cached_tokens:,} reused from the server's prefix cache"
+    if not usage.sent:
+        text += " · not sent — code served from the LLM cache"
+    return text
+
+def record_prompt_usage(usage, messages, response=None):
+    system_chars = len(messages[0]["content"])
+    total_chars = sum(len(m["content"]) for m in messages)
+    reported = getattr(response, "usage", None)
+    if getattr(reported, "prompt_tokens", None):
+        usage.prompt_tokens = reported.prompt_tokens
+        usage.prefix_tokens = round(reported.prompt_tokens * system_chars / total_chars)
+        usage.cached_tokens = getattr(getattr(reported, "prompt_tokens_details", None), "cached_tokens", None)
+    else:
+        usage.prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        usage.prefix_tokens = estimate_tokens(messages[0]["content"])
+        usage.estimated = True
+    usage.sent = response is not None
+
+# Static part of the code-generation system prompt. It comes first and never
+# changes, so a local server's prefix (KV) cache can reuse it across calls;
+# the dataset summary follows, then history, the retrieved patterns and the
+# question.
+CODEGEN_PROMPT = """You are a senior Python/Pandas data analyst.
+You have a DataFrame called `df` with this schema (dataset summary at the end):
 
 EXACT column names:
 - transaction_id, timestamp (datetime), transaction_type (P2P/P2M/Bill Payment/Recharge)
@@ -1219,10 +1529,14 @@ STRICT RULES:
 5. Return ONLY raw code — no markdown fences, no explanation
 6. NEVER use groupby().apply(lambda) — broken in Pandas 2.x
 7. ALWAYS filter binary cols with ==1: df[df['is_weekend']==1], df[df['fraud_flag']==1]
+8. ALWAYS sort group comparisons descending (first row = highest value) and prefer a DataFrame to a dict
+"""
 
-SAFE PATTERNS — always use these exact patterns:
-
-# Failure rate comparison (ALWAYS return DataFrame sorted by rate descending):
+# SAFE PATTERN examples. PATTERN_INDEX picks the INSIGHTX_FEWSHOT_K of them
+# closest to each question (fewshot.py); they go into the last message, after
+# the static prefix and the history. INSIGHTX_FEWSHOT_K=0 sends them all in
+# the system prompt instead.
+CODEGEN_PATTERNS = """# Failure rate comparison (ALWAYS return DataFrame sorted by rate descending):
 failed = df[df['transaction_status']=='FAILED'].groupby('COLUMN').size()
 total  = df.groupby('COLUMN').size()
 rate   = (failed / total * 100).round(2)
@@ -1242,15 +1556,12 @@ result.columns = ['Category', 'Avg_Amount_INR']
 result = df.groupby('COLUMN').size().sort_values(ascending=False).reset_index()
 result.columns = ['Category', 'Count']
 
-CRITICAL: ALWAYS sort descending. ALWAYS use DataFrame not dict. First row = highest value.
-
 # Weekend transactions:
 result = df[df['is_weekend']==1].groupby('COLUMN')['amount_inr'].mean().round(2).to_dict()
 
-# Monthly trend:
-df2 = df.copy()
-df2['month'] = df2['timestamp'].dt.to_period('M').astype(str)
-result = df2.groupby('month').size().to_dict()
+# Monthly trend (never copy df — group by a derived Series instead):
+month = df['timestamp'].dt.to_period('M').astype(str)
+result = df.groupby(month).size().to_dict()
 
 # Peak hour for a transaction type:
 result = df[df['transaction_type']=='P2M'].groupby('hour_of_day').size().idxmax()
@@ -1263,9 +1574,6 @@ failed = df[df['transaction_status']=='FAILED'].groupby(['device_type','transact
 total  = df.groupby(['device_type','transaction_type']).size()
 result = (failed/total*100).round(2).reset_index(name='failure_rate')
 
-# Age group spending on weekends:
-result = df[df['is_weekend']==1].groupby('sender_age_group')['amount_inr'].mean().round(2).sort_values(ascending=False).to_dict()
-
 # Success rate comparison:
 success = df[df['transaction_status']=='SUCCESS'].groupby('COLUMN').size()
 total   = df.groupby('COLUMN').size()
@@ -1277,11 +1585,12 @@ result = round(df[df['amount_inr'] > df['amount_inr'].quantile(0.9)]['fraud_flag
 # Weekday vs weekend comparison:
 result = df.groupby('is_weekend')['amount_inr'].mean().round(2).to_dict()
 
-# Multi-filter then groupby (e.g. P2P only, compare Android vs iOS failure rate):
-df_filtered = df[df['transaction_type']=='P2P']
-failed = df_filtered[df_filtered['transaction_status']=='FAILED'].groupby('device_type').size()
-total  = df_filtered.groupby('device_type').size()
-result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()
+# Multi-filter then groupby (e.g. P2P only, compare Android vs iOS failure rate).
+# idx.select(col=value, ...) picks rows by exact values of category/flag columns;
+# group_stats returns count, failure_rate, success_rate, fraud_rate, amount_mean per group:
+rows   = idx.select(transaction_type='P2P')
+stats  = group_stats(df, 'device_type', mask=rows)
+result = stats['failure_rate'].round(2).sort_values(ascending=False).to_dict()
 
 # Age group fraud rate on weekends:
 df_filtered = df[df['is_weekend']==1]
@@ -1295,52 +1604,415 @@ df_filtered = df[df['is_weekend']==0]
 failed = df_filtered[df_filtered['transaction_status']=='FAILED'].groupby('merchant_category').size()
 total  = df_filtered.groupby('merchant_category').size()
 result = (failed / total * 100).round(2).sort_values(ascending=False).to_dict()
+"""
 
-# Transactions above a threshold flagged for fraud:
-threshold = df['amount_inr'].quantile(0.9)
-result = round(df[df['amount_inr'] > threshold]['fraud_flag'].mean() * 100, 2)
+PATTERN_INDEX = PatternIndex(split_patterns(CODEGEN_PATTERNS))
+FEWSHOT_K = int(os.environ.get("INSIGHTX_FEWSHOT_K", 4))
 
-# Bank + transaction type combination failure rate:
-failed = df[df['transaction_status']=='FAILED'].groupby(['sender_bank','transaction_type']).size()
-total  = df.groupby(['sender_bank','transaction_type']).size()
-result = (failed/total*100).round(2).sort_values(ascending=False).reset_index(name='failure_rate')
-"""
+@functools.lru_cache(maxsize=4)
+def codegen_system_prompt(df_summary, all_patterns=False):
+    """CODEGEN_PROMPT + dataset summary, built once per summary so every call sends identical bytes."""
+    patterns = f"\nSAFE PATTERNS — always use these exact patterns:\n\n{CODEGEN_PATTERNS}" if all_patterns else ""
+    return f"{CODEGEN_PROMPT}{patterns}\nDATASET SUMMARY:\n{df_summary}\n"
 
-    system_prompt = system_prompt.replace("DF_SUMMARY_PLACEHOLDER", df_summary)
+@traced()
+def generate_pandas_code(user_query, df_summary, conversation_history, client, cache=None, usage=None,
+                         k=None):
+    """
+    Pandas code for user_query from the LLM. The system prompt is the shared
+    static prefix; history (ConversationContext.messages(), already within
+    its budget), the k SAFE PATTERN examples closest to the question
+    (FEWSHOT_K by default, 0 = every example in the system prompt) and the
+    question go last. Fills usage (a PromptUsage) with the prompt's token
+    counts when given.
+    """
+    k = FEWSHOT_K if k is None else k
+    system_prompt = codegen_system_prompt(df_summary, all_patterns=k <= 0)
     messages = [{"role": "system", "content": system_prompt}]
-    for msg in conversation_history[-4:]:
+    for msg in conversation_history:
         messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": f"Write pandas code to answer: {user_query}"})
+    patterns = PATTERN_INDEX.top(user_query, k) if k > 0 else []
+    if patterns:
+        examples = "\n\n".join(p.text for p in patterns)
+        question = (f"SAFE PATTERNS for this question — always use these exact patterns:\n\n{examples}\n\n"
+                    f"Write pandas code to answer: {user_query}")
+    else:
+        question = f"Write pandas code to answer: {user_query}"
+    messages.append({"role": "user", "content": question})
 
-    response = client.chat.completions.create(
+    request = dict(
         model="local-model",
         messages=messages,
         temperature=0.1,
         max_tokens=600,  # Code generation
     )
-
-    code = response.choices[0].message.content.strip()
+    key = llm_cache_key(client, request) if cache else None
+    content = cache.get(key) if cache else None
+    response = None
+    if content is None:
+        start = time.perf_counter()
+        response = client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        if cache:
+            cache.put(key, content, (time.perf_counter() - start) * 1000)
+    if usage is not None:
+        record_prompt_usage(usage, messages, response)
+        usage.patterns = len(patterns) if k > 0 else len(PATTERN_INDEX)
+    reported = getattr(response, "usage", None)
+    annotate(llm_cache="hit" if response is None and cache else "miss" if cache else None,
+             prompt_tokens=getattr(reported, "prompt_tokens", None) or estimate_tokens("".join(m["content"] for m in messages)),
+             completion_tokens=getattr(reported, "completion_tokens", None) or estimate_tokens(content or ""),
+             patterns=len(patterns) if k > 0 else len(PATTERN_INDEX))
+
+    code = content.strip()
     code = re.sub(r"```python\n?", "", code)
     code = re.sub(r"```\n?", "", code)
     return code.strip()
 
 # ── Execute Code Safely ───────────────────────────────────────────────────────
-def execute_code(code, df):
-    local_vars = {"df": df.copy(), "pd": pd}
-    try:
-        exec(code, {}, local_vars)
-        result = local_vars.get("result", "No result variable found.")
-        if isinstance(result, pd.DataFrame):
-            return result.to_string(), None
-        elif isinstance(result, dict):
-            return json.dumps(result, indent=2, default=str), None
+def _column_buffers(series):
+    """Addresses of the memory behind a column — changes when copy-on-write copies it."""
+    values = series.array
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return {values.codes.__array_interface__["data"][0]}
+    if hasattr(values, "__arrow_array__"):
+        arrow = values.__arrow_array__()
+        chunks = getattr(arrow, "chunks", [arrow])
+        return {buf.address for chunk in chunks for buf in chunk.buffers() if buf is not None}
+    return {series.to_numpy().__array_interface__["data"][0]}
+
+def find_mutations(original, view):
+    """Columns that generated code added, dropped or wrote to on its view of df."""
+    changes = []
+    for col in original.columns:
+        if col not in view.columns:
+            changes.append(f"dropped '{col}'")
+        elif _column_buffers(view[col]) != _column_buffers(original[col]):
+            changes.append(f"modified '{col}'")
+    changes += [f"added '{col}'" for col in view.columns if col not in original.columns]
+    return changes
+
+@dataclass
+class ExecResult:
+    """One execution of generated code — computed once, shared by insight, recommendations and the panel."""
+    value: object = None          # typed `result` (DataFrame / dict / scalar / str)
+    text: str = None              # string form that goes into LLM prompts
+    error: str = None
+    elapsed_ms: float = 0.0
+    result_bytes: int = 0         # memory held by `value`
+    peak_bytes: int = None        # peak allocation while running (track_memory=True only)
+    mutations: list = field(default_factory=list)
+    cached: bool = False          # served from ResultCache (elapsed_ms is then the lookup time)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+# Prompt budget for one result's text (serializer.py): bigger results keep
+# their top and bottom rows plus totals, so insight prefill stays bounded
+RESULT_TOKENS = int(os.environ.get("INSIGHTX_RESULT_TOKENS", 600))
+
+def result_to_text(result):
+    return serialize_result(result, RESULT_TOKENS)
+
+def _result_bytes(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        usage = result.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(result, pd.DataFrame) else usage)
+    return sys.getsizeof(result)
+
+# Names a compiled router template takes as arguments (execute_code's namespace)
+ROUTE_ARGS = ("df", "pd", "cube", "group_stats", "idx", "execute_plan", "QueryPlan")
+
+@functools.lru_cache(maxsize=512)
+def compile_route(code):
+    """
+    Router template source → function(**ROUTE_ARGS) returning its `result`.
+    Parsed and compiled once per distinct source (template + parameters); the
+    template's variables become the function's locals.
+    """
+    fn = ast.parse(f"def routed({', '.join(ROUTE_ARGS)}):\n    return result").body[0]
+    fn.body = ast.parse(code).body + fn.body
+    namespace = {}
+    exec(compile(ast.Module([fn], type_ignores=[]), "<route>", "exec"), namespace)
+    return namespace["routed"]
+
+def execute_code(code, df, sandbox="view", track_memory=False, context=None, trusted=False):
+    """
+    Run generated pandas code against df and return an ExecResult.
+    sandbox="view" hands the code a shallow copy-on-write view — row data is only
+    copied for columns the code actually writes to (reported in .mutations).
+    sandbox="copy" is the old deep copy. track_memory=True records the peak
+    allocation with tracemalloc, which slows Python-heavy code several-fold.
+    context adds names to the code's namespace (e.g. the `cube` routed code uses).
+    trusted=True (router templates) calls the compile_route() function instead of
+    exec'ing the source.
+
+    Generated code runs on the compact frame too: the int8 / float32 columns it
+    names are widened on its view first (int8 arithmetic wraps silently), and
+    if it raises TypeError — string idioms on a categorical — it is re-run once
+    with the categoricals it names decoded back to strings. Either way only
+    those columns are converted, and only for this run.
+    """
+    names = [] if trusted else [col for col in df.columns if col in code]
+
+    def run(categories):
+        base = df.copy(deep=False) if sandbox == "view" else df.copy()
+        plain_columns(base, names, categories)
+        work = base.copy(deep=False)
+        namespace = {"df": work, "pd": pd, **(context or {})}
+        if trusted:
+            value = compile_route(code)(**{name: namespace.get(name) for name in ROUTE_ARGS})
         else:
-            return str(result), None
+            exec(code, namespace)
+            value = namespace.get("result", "No result variable found.")
+        return value, base, work
+
+    tracing = track_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    start = time.perf_counter()
+    base = work = None
+    try:
+        try:
+            value, base, work = run(categories=False)
+        except TypeError:
+            if not any(isinstance(df[col].dtype, pd.CategoricalDtype) for col in names):
+                raise
+            value, base, work = run(categories=True)
+        res = ExecResult(value=value, text=result_to_text(value), result_bytes=_result_bytes(value))
     except Exception as e:
-        return None, str(e)
+        res = ExecResult(error=str(e))
+    res.elapsed_ms = (time.perf_counter() - start) * 1000
+    if tracing:
+        res.peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if sandbox == "view" and work is not None:
+        res.mutations = find_mutations(base, work)
+    return res
+
+# ── Result Cache ──────────────────────────────────────────────────────────────
+def normalise_code(code):
+    """Formatting- and comment-insensitive form of the code (its AST)."""
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return code.strip()
+
+@functools.lru_cache(maxsize=1024)
+def code_digest(code):
+    """SHA-256 of the normalised code — memoised so repeat lookups skip the parse."""
+    return hashlib.sha256(normalise_code(code).encode()).hexdigest()
+
+class ResultCache:
+    """
+    Bounded LRU of successful ExecResults, keyed by dataset fingerprint + how the
+    code ran + normalised code: a template (compiled, compact frame), generated
+    code (exec'd, columns it names widened or decoded) and a query plan can
+    share a source but not their results' dtypes.
+    Evicts by entry count and by total bytes held; everything is dropped as soon
+    as a different dataset fingerprint shows up (the CSV changed).
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fingerprint = None
+        self._entries = OrderedDict()   # key → (ExecResult, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def key(code, fingerprint, kind="generated"):
+        return f"{fingerprint}:{kind}:{code_digest(code)}"
+
+    def _check_dataset(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            self._entries.clear()
+            self._bytes = 0
+            self.fingerprint = fingerprint
+
+    def get(self, code, fingerprint, kind="generated"):
+        start = time.perf_counter()
+        key = self.key(code, fingerprint, kind)
+        with self._lock:
+            self._check_dataset(fingerprint)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[0].elapsed_ms
+        return replace(entry[0], cached=True, elapsed_ms=(time.perf_counter() - start) * 1000)
+
+    def put(self, code, fingerprint, res, kind="generated"):
+        size = res.result_bytes + len(res.text or "")
+        if not res.ok or size > self.max_bytes:
+            return
+        key = self.key(code, fingerprint, kind)
+        with self._lock:
+            self._check_dataset(fingerprint)
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (res, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "bytes": self._bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_ms": self.saved_ms,
+        }
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(
+        max_entries=int(os.environ.get("INSIGHTX_RESULT_CACHE_ENTRIES", 256)),
+        max_bytes=int(os.environ.get("INSIGHTX_RESULT_CACHE_MB", 64)) * 1024 * 1024,
+    )
+
+def exec_context():
+    """Names available to generated code besides df and pd."""
+    return {"cube": get_cube(), "group_stats": group_stats, "idx": get_index(),
+            "execute_plan": execute_plan, "QueryPlan": QueryPlan}
+
+@contextmanager
+def cube_lookups():
+    """Annotate the current span with the cube lookups and row scans made in the block (process-wide counters)."""
+    cube = get_cube()
+    hits, fallbacks = cube.hits, cube.fallbacks
+    try:
+        yield
+    finally:
+        annotate(cube_hits=cube.hits - hits, row_scans=cube.fallbacks - fallbacks)
+
+def annotate_result(res, df, **attrs):
+    annotate(result_cache="hit" if res.cached else "miss", rows=len(df), exec_ms=round(res.elapsed_ms, 2),
+             result_kb=round(res.result_bytes / 1024, 1), ok=res.ok, **attrs)
+
+@traced()
+def run_code(code, df, trusted=False):
+    """
+    execute_code behind the process-wide result cache (df must be a view of get_dataset()).
+    trusted=True for router templates, which run as compiled functions.
+    """
+    fingerprint = get_dataset().fingerprint
+    kind = "template" if trusted else "generated"
+    cache = get_result_cache()
+    res = cache.get(code, fingerprint, kind)
+    if res is None:
+        with cube_lookups():
+            res = execute_code(code, df, context=exec_context(), trusted=trusted)
+        cache.put(code, fingerprint, res, kind)
+    annotate_result(res, df, trusted=trusted)
+    return res
+
+@traced()
+def run_plan(plan, df):
+    """Answer a QueryPlan directly (no exec), cached under its plan.to_code() source."""
+    code = plan.to_code()
+    fingerprint = get_dataset().fingerprint
+    cache = get_result_cache()
+    res = cache.get(code, fingerprint, "plan")
+    if res is None:
+        start = time.perf_counter()
+        with cube_lookups():
+            try:
+                value = execute_plan(plan, df, cube=get_cube(), idx=get_index())
+                res = ExecResult(value=value, text=result_to_text(value), result_bytes=_result_bytes(value))
+            except Exception as e:
+                res = ExecResult(error=str(e))
+        res.elapsed_ms = (time.perf_counter() - start) * 1000
+        cache.put(code, fingerprint, res, "plan")
+    annotate_result(res, df)
+    return res
+
+def answer_without_llm(user_query, df):
+    """
+    (code, ExecResult) from a router template or a parsed query plan; None when
+    the question needs the LLM (including questions a rule hands to it).
+    A plan that filters rows wins over a template: templates carry only a few
+    fixed filter combinations and answer the unfiltered question otherwise.
+    """
+    with span("route_query") as s:
+        rule, code = match_route(user_query)
+        s.set(rule=rule.__name__ if rule else None, llm=rule is not None and code is None)
+    if rule is not None and code is None:
+        return None
+    plan = plan_query(user_query)
+    if plan is not None and (code is None or plan.narrows()):
+        return plan_source(plan), run_plan(plan, df)
+    if code:
+        return template_source(code), run_code(code, df, trusted=True)
+    return None
+
+# What the verification panel's code tab shows for answers that skipped the LLM:
+# plans as the plain pandas that gives the same numbers, templates with a
+# header naming the in-process helpers they call instead of scanning rows
+PLAN_HEADER = "# Query plan"
+TEMPLATE_HEADER = "# Router template"
+HELPER_NOTES = {
+    "cube":        "cube.stats() / cube.totals(): counts and sums pre-aggregated once per dataset (analytics.Cube)",
+    "group_stats": "group_stats(): counts, failures, fraud and amount sums in one groupby pass",
+    "idx":         "idx.select() / idx.eq(): row bitmaps per column value (analytics.PredicateIndex)",
+}
+
+def plan_source(plan):
+    return (f"{PLAN_HEADER}: {plan.describe()}. Answered in-app by execute_plan();\n"
+            f"# the same numbers in plain pandas:\n{plan.to_pandas()}")
+
+def template_source(code):
+    used = [name for name in HELPER_NOTES if re.search(rf"\b{name}\b", code)]
+    if not used:
+        return code
+    notes = "\n".join(f"#   {HELPER_NOTES[name]}" for name in used)
+    return f"{TEMPLATE_HEADER}: runs against InsightX's in-process helpers, not plain pandas:\n{notes}\n{code}"
 
 # ── LLM: Natural Language Insight ────────────────────────────────────────────
-def generate_insight(user_query, data_result, error, conversation_history, client):
+# Explanatory / strategic questions: the insight explains instead of reporting
+INSIGHT_EXPLAIN_PHRASES = [
+    "how did you calculate", "how did you determine", "walk me through",
+    "explain how", "explain why", "explain the difference",
+    "how confident", "limitations of", "in simple terms", "step by step",
+    "why does education", "why does 3g", "how would you", "design a",
+    "build a risk score", "which 3 metrics", "what machine learning", "what ml model", "ml model would", "predict transaction", "predict failure",
+    "production-ready", "scale to", "if failure rate crosses",
+    "fraud patterns are shifting", "what additional data",
+    "what would a production", "ceo dashboard",
+    "how is the average", "what does it tell us",
+    "what does a 0", "actually mean in real", "mean in real numbers",
+    "summarise everything", "summarize everything", "summarise what",
+    "discussed so far", "we've discussed", "weve discussed",
+    "which one should", "focus on fixing", "fix first",
+]
+
+def is_explain_question(user_query):
+    return any(p in user_query.lower() for p in INSIGHT_EXPLAIN_PHRASES)
+
+def question_type(user_query):
+    """data / explain / reasoning — the TYPE A / B / C of the insight prompt, as a metrics label."""
+    q = user_query.lower()
+    if q.startswith("explain why"):
+        return "reasoning"
+    return "explain" if is_explain_question(q) or needs_reasoning(q) else "data"
+
+def insight_messages(user_query, result, conversation_history, recap=None):
+    """
+    (messages, max_tokens) for the insight request. `result` is the ExecResult for
+    this question, or None for pure reasoning questions. conversation_history is
+    ConversationContext.messages(); recap, ConversationContext.recap() for
+    "summarise everything" questions (rebuilt from the history when not given).
+    """
+    data_result = result.text if result else None
+    error = result.error if result else None
     system_prompt = """You are InsightX, a friendly and expert business intelligence assistant for a digital payments company.
 Your job is to turn raw data into clear, explainable, actionable insights for business leaders.
 
@@ -1388,23 +2060,7 @@ RULES:
 - If result seems surprising, flag it: "⚠️ This is higher than the industry average of ~3-4% — worth investigating."
 - Keep total response under 12 sentences
 """
-    # Detect if this is an explanatory/strategic question (no data needed)
-    explain_phrases_ins = [
-        "how did you calculate", "how did you determine", "walk me through",
-        "explain how", "explain why", "explain the difference",
-        "how confident", "limitations of", "in simple terms", "step by step",
-        "why does education", "why does 3g", "how would you", "design a",
-        "build a risk score", "which 3 metrics", "what machine learning", "what ml model", "ml model would", "predict transaction", "predict failure",
-        "production-ready", "scale to", "if failure rate crosses",
-        "fraud patterns are shifting", "what additional data",
-        "what would a production", "ceo dashboard",
-        "how is the average", "what does it tell us",
-        "what does a 0", "actually mean in real", "mean in real numbers",
-        "summarise everything", "summarize everything", "summarise what",
-        "discussed so far", "we've discussed", "weve discussed",
-        "which one should", "focus on fixing", "fix first",
-    ]
-    is_explain_q = any(p in user_query.lower() for p in explain_phrases_ins)
+    is_explain_q = is_explain_question(user_query)
 
     if error and not is_explain_q:
         content = f"""User asked: {user_query}
@@ -1429,15 +2085,10 @@ Do NOT use numbers from memory or training data. Row 1 = highest value."""
         # For summarise questions, build conversation recap
         conv_summary = ""
         if any(p in user_query.lower() for p in ["summarise","summarize","discussed","so far"]):
-            qa_pairs = []
-            msgs = conversation_history[-20:]  # last 20 messages
-            for i in range(0, len(msgs)-1, 2):
-                if msgs[i]["role"] == "user" and i+1 < len(msgs) and msgs[i+1]["role"] == "assistant":
-                    q_text = msgs[i]["content"][:80]
-                    a_text = msgs[i+1]["content"][:200].replace("\n"," ")
-                    qa_pairs.append(f"Q: {q_text}\nA: {a_text}...")
-            if qa_pairs:
-                conv_summary = "\n\nCONVERSATION HISTORY TO SUMMARISE:\n" + "\n---\n".join(qa_pairs)
+            if recap is None:
+                recap = ConversationContext.from_messages(conversation_history).recap(RECAP_TOKENS)
+            if recap:
+                conv_summary = "\n\nCONVERSATION HISTORY TO SUMMARISE:\n" + recap
                 conv_summary += """\n\nNow write a clear CONVERSATION SUMMARY covering every topic discussed.
 CRITICAL RULES for the summary:
 - Failure rates are always 4-6% (like 5.1%, 4.95%)
@@ -1471,25 +2122,159 @@ STRICT READING RULES:
 6. Show ALL rows in the breakdown, ranked exactly as they appear in the data.
 7. Format: "Name: X failed of Y total (Z%)" using exact numbers from the data.
 8. Preserve decimal places exactly — 0.2496% stays 0.2496%, never round to 0.25% or 0.2%.
+9. Lines starting with # are notes on the whole result; "… N rows not shown …" marks rows left out of the
+   prompt — say the breakdown is partial, never guess the missing rows.
 Generate a clear business insight. The direct answer = the FIRST ROW of the data."""
 
     messages = [{"role": "system", "content": system_prompt}]
-    for msg in conversation_history[-4:]:
+    for msg in conversation_history:
         messages.append({"role": msg["role"], "content": msg["content"]})
     messages.append({"role": "user", "content": content})
 
     # More tokens for multi-question responses
     is_multi = "MULTI-QUESTION" in user_query
-    response = client.chat.completions.create(
+    return messages, 1200 if is_multi else (800 if is_explain_q else 500)
+
+@dataclass
+class InsightTiming:
+    """Latency of one streamed insight, filled in while it streams."""
+    ttft_ms: float = None         # request sent → first content token
+    total_ms: float = None        # request sent → stream finished
+    chunks: int = 0
+    cached: bool = False          # served whole from the LLM completion cache
+    rendered: bool = False        # written by render_answer, no insight call
+
+def stream_insight(user_query, result, conversation_history, client, timing=None, cache=None, recap=None):
+    """
+    The insight as a stream of text deltas (see insight_messages); records TTFT
+    in timing. With a cache, a stored completion is yielded at once and a
+    finished stream is stored.
+    """
+    messages, max_tokens = insight_messages(user_query, result, conversation_history, recap)
+    timing = timing if timing is not None else InsightTiming()
+    request = dict(
         model="local-model",
         messages=messages,
         temperature=0.5,
-        max_tokens=1200 if is_multi else (800 if is_explain_q else 500),
+        max_tokens=max_tokens,
+    )
+    start = time.perf_counter()
+    # Not made current: the caller runs between our yields
+    s = start_span("stream_insight", prompt_tokens=sum(estimate_tokens(m["content"]) for m in messages))
+    try:
+        key = llm_cache_key(client, request) if cache else None
+        text = cache.get(key) if cache else None
+        if text is not None:
+            timing.ttft_ms = timing.total_ms = (time.perf_counter() - start) * 1000
+            timing.chunks, timing.cached = 1, True
+            s.set(llm_cache="hit", completion_tokens=estimate_tokens(text))
+            yield text
+            return
+        stream = client.chat.completions.create(**request, stream=True)
+        deltas = []
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if timing.ttft_ms is None:
+                timing.ttft_ms = (time.perf_counter() - start) * 1000
+            timing.chunks += 1
+            deltas.append(delta)
+            yield delta
+        timing.total_ms = (time.perf_counter() - start) * 1000
+        s.set(llm_cache="miss" if cache else None, completion_tokens=estimate_tokens("".join(deltas)) if deltas else 0,
+              chunks=timing.chunks, ttft_ms=round(timing.ttft_ms, 1) if timing.ttft_ms is not None else None)
+        if cache:
+            cache.put(key, "".join(deltas), timing.total_ms)
+    finally:
+        s.end()
+
+def generate_insight(user_query, result, conversation_history, client, cache=None, recap=None):
+    """Whole insight text at once (stream_insight, collected)."""
+    return "".join(stream_insight(user_query, result, conversation_history, client, cache=cache, recap=recap)).strip()
+
+
+# ── Rendered answers ─────────────────────────────────────────────────────────
+# Routed and planned data questions get their TYPE A answer from the result
+# itself (answers.py) instead of an insight call. INSIGHTX_RENDER_ANSWERS=0
+# sends them to the LLM again; INSIGHTX_RENDER_CONTEXT_LLM=1 adds one short
+# LLM sentence to the rendered business context.
+RENDER_ANSWERS = os.environ.get("INSIGHTX_RENDER_ANSWERS", "1") == "1"
+RENDER_CONTEXT_LLM = os.environ.get("INSIGHTX_RENDER_CONTEXT_LLM", "0") == "1"
+
+@traced()
+def rendered_insight(user_query, result, timing=None, asked=None):
+    """
+    The answer written from a router / plan ExecResult, or None when the LLM
+    should write it (explanatory questions, errors, shapes render_answer does
+    not know). `asked` is the typed question when user_query is its expanded
+    form. Render time is recorded in timing as TTFT and total.
+    """
+    if not RENDER_ANSWERS or result is None or not result.ok:
+        return None
+    if any(is_explain_question(q) or needs_reasoning(q) for q in (user_query, asked or user_query)):
+        return None
+    start = time.perf_counter()
+    text = render_answer(user_query, result.value, get_profile())
+    if text is not None and timing is not None:
+        timing.ttft_ms = timing.total_ms = (time.perf_counter() - start) * 1000
+        timing.chunks, timing.rendered = 1, True
+    return text
+
+def degraded_insight(user_query, result):
+    """
+    The answer while the LLM is unavailable: rendered from the result when
+    render_answer knows its shape (even with INSIGHTX_RENDER_ANSWERS=0),
+    otherwise the serialized result under a notice. None without a result.
+    """
+    if result is None or not result.ok:
+        return None
+    text = render_answer(user_query, result.value, get_profile())
+    if text is not None:
+        return text
+    return ("⚠️ **The language model is not responding**, so this answer is the computed result "
+            "without commentary:\n\n```\n" + result.text + "\n```")
+
+@traced()
+def add_llm_context(answer, client, timing=None, cache=None):
+    """answer with one LLM sentence of interpretation appended to its 💼 line (80 tokens), if the LLM answers."""
+    request = dict(
+        model="local-model",
+        messages=[
+            {"role": "system", "content": "You are InsightX, a business intelligence assistant for a digital payments "
+                                          "company. Reply with ONE sentence of business interpretation for the answer "
+                                          "below. Quote no number that is not in it."},
+            {"role": "user", "content": answer},
+        ],
+        temperature=0.3,
+        max_tokens=80,
     )
-    return response.choices[0].message.content.strip()
+    start = time.perf_counter()
+    key = llm_cache_key(client, request) if cache else None
+    sentence = cache.get(key) if cache else None
+    annotate(llm_cache=("miss" if sentence is None else "hit") if cache else None)
+    if sentence is None:
+        try:
+            response = client.chat.completions.create(**request)
+        except LLMUnavailable:
+            return answer   # the sentence is optional — the rendered answer stands
+        sentence = (response.choices[0].message.content or "").strip()
+        if cache and sentence:
+            cache.put(key, sentence, (time.perf_counter() - start) * 1000)
+    if timing is not None and timing.total_ms is not None:
+        timing.total_ms += (time.perf_counter() - start) * 1000
+    if not sentence:
+        return answer
+    lines = answer.split("\n")
+    at = next((i for i, line in enumerate(lines) if line.startswith("💼")), None)
+    if at is None:
+        return answer + f"\n\n💼 **Business context:** {sentence}"
+    lines[at] += " " + sentence
+    return "\n".join(lines)
 
 
 # ── Multi-part Question Splitter ─────────────────────────────────────────────
+@traced()
 def split_multipart(query):
     """Split multi-part questions into individual queries."""
     import re
@@ -1522,11 +2307,13 @@ def split_multipart(query):
     return [query]  # single question
 
 # ── Smart Recommendations Engine ────────────────────────────────────────────
-def get_recommendations(user_query, data_result):
+@traced()
+def get_recommendations(user_query, result):
     """
     Returns 2-3 actionable business recommendations based on query topic and data result.
     These are pattern-based recommendations triggered by keywords.
     """
+    data_result = result.text if result and result.text else ""
     q = user_query.lower()
     recs = []
 
@@ -1643,6 +2430,7 @@ def get_recommendations(user_query, data_result):
 
 
 # ── Ambiguity Detector ────────────────────────────────────────────────────────
+@traced()
 def detect_ambiguity(query):
     """
     Detects vague/ambiguous queries and returns a helpful clarification response.
@@ -1811,6 +2599,7 @@ def detect_ambiguity(query):
 
 
 # ── Context-Aware Query Expander ──────────────────────────────────────────────
+@traced()
 def expand_query(query, history):
     """
     Expands follow-up queries using conversation context.
@@ -1951,7 +2740,7 @@ def expand_query(query, history):
     return query
 
 # ── Sidebar ───────────────────────────────────────────────────────────────────
-def show_sidebar_stats(df):
+def show_sidebar_stats(df, profile):
     with st.sidebar:
         st.markdown('<div style="font-family:Space Mono,monospace;font-size:1.5rem;color:#e8eaf0;">💳 InsightX</div>', unsafe_allow_html=True)
         st.markdown('<div style="color:#6b7280;font-size:0.82rem;margin-bottom:8px;">Leadership Analytics Dashboard</div>', unsafe_allow_html=True)
@@ -2020,11 +2809,11 @@ def show_sidebar_stats(df):
 
         st.markdown("**📊 Dataset Overview**")
 
-        total        = len(df)
-        success_rate = (df["transaction_status"] == "SUCCESS").mean() * 100 if "transaction_status" in df.columns else 0
+        total        = profile["rows"]
+        success_rate = profile.get("success_rate", 0)
         failure_rate = 100 - success_rate
-        fraud_rate   = df["fraud_flag"].mean() * 100 if "fraud_flag" in df.columns else 0
-        avg_amt      = df["amount_inr"].mean() if "amount_inr" in df.columns else 0
+        fraud_rate   = profile.get("fraud_rate", 0)
+        avg_amt      = profile.get("avg_amount", 0)
 
         col1, col2 = st.columns(2)
         with col1:
@@ -2060,12 +2849,296 @@ def show_sidebar_stats(df):
 
         st.divider()
 
+        with st.expander("⚡ Performance"):
+            rc = get_result_cache().stats()
+            st.markdown(f"**Result cache** — {rc['hits']} hits / {rc['misses']} misses "
+                        f"({rc['hit_rate']*100:.0f}%) · {rc['entries']} entries, {rc['bytes']/1e6:.1f} MB · "
+                        f"{rc['saved_ms']/1000:.1f}s of compute saved")
+            cb = get_cube().info()
+            st.markdown(f"**Aggregate cube** — {cb['cuboids']} cuboids, {cb['cells']:,} cells "
+                        f"({cb['bytes']/1024:.0f} KB), built in {cb['build_ms']:.0f} ms · "
+                        f"{cb['hits']} answered / {cb['fallbacks']} row scans")
+            ix = get_index().info()
+            st.markdown(f"**Filter index** — {ix['bitmaps']} bitmaps over {ix['columns']} columns "
+                        f"({ix['bytes']/1e6:.1f} MB), built in {ix['build_ms']:.0f} ms")
+            lc = get_llm_cache().stats()
+            st.markdown(f"**LLM cache** — {lc['hits']} hits / {lc['misses']} misses "
+                        f"({lc['hit_rate']*100:.0f}%) · {lc['entries']} completions, {lc['bytes']/1e6:.1f} MB · "
+                        f"{lc['saved_ms']/1000:.1f}s of generation saved"
+                        + ("" if LLM_CACHE_INSIGHTS else " (code only)"))
+            ttfts = [t for t in st.session_state.get("ttft_ms", []) if t is not None]
+            if ttfts:
+                st.markdown(f"**Answer streaming** — first words after {statistics.median(ttfts)/1000:.2f} s "
+                            f"(median of {len(ttfts)} answers this session)")
+            code_prompts = st.session_state.get("code_prompts", [])
+            if code_prompts:
+                approx = "≈" if any(u.estimated for u in code_prompts) else ""
+                line = (f"**Code prompts** — {approx}{statistics.median(u.prompt_tokens for u in code_prompts):,.0f} tokens, "
+                        f"{sum(u.prefix_tokens for u in code_prompts) / sum(u.prompt_tokens for u in code_prompts):.0%} "
+                        f"static prefix (median of {len(code_prompts)} calls)")
+                reused = [u.cached_tokens for u in code_prompts if u.cached_tokens is not None]
+                if reused:
+                    line += f" · {sum(reused):,} tokens reused from the server's prefix cache"
+                st.markdown(line)
+            if st.session_state.get("context_tokens") is not None:
+                conversation = st.session_state.get("conversation")
+                st.markdown(f"**Conversation context** — ≈{st.session_state['context_tokens']:,} tokens per call "
+                            f"(budget {CONTEXT_TOKENS:,}; {len(conversation.topics) if conversation else 0} topics remembered)")
+            health = getattr(get_client(), "health", None)
+            if health:
+                h = health()
+                light = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}[h["state"]]
+                line = f"**LLM health** — {light} {h['state']}"
+                if h["p50_ms"] is not None:
+                    line += f" · {h['p50_ms']/1000:.2f} s median, {h['p95_ms']/1000:.2f} s p95"
+                line += (f" · {h['calls']} calls, {h['failures']} failed, {h['retries']} retried, "
+                         f"{h['timeouts']} timed out")
+                if h["short_circuited"]:
+                    line += f", {h['short_circuited']} refused while open"
+                if h["state"] == "open":
+                    line += f" · next try in {h['retry_in_s']:.0f} s"
+                st.markdown(line)
+                if h["last_error"] and h["state"] != "closed":
+                    st.caption(f"Last error: {h['last_error'][:160]}")
+            if st.session_state.get("rendered_answers"):
+                st.markdown(f"**Rendered answers** — {st.session_state['rendered_answers']} written straight "
+                            f"from router / plan results, no insight call")
+
+        traces = st.session_state.get("traces")
+        if traces:
+            with st.expander("🧭 Trace"):
+                last = traces[-1]
+                st.markdown(f"**Last question** — {last.ms:,.0f} ms · {last.attrs.get('question', '')[:60]}")
+                st.dataframe(pd.DataFrame(span_rows(last)), use_container_width=True, hide_index=True)
+                st.markdown(f"**Where the time goes** — {len(traces)} questions this session, most self time first")
+                st.dataframe(pd.DataFrame(stage_summary(traces)), use_container_width=True, hide_index=True)
+                stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(last.wall))
+                st.download_button("⬇️ Last question (Chrome trace)", json.dumps(to_chrome([last])),
+                                   file_name=f"insightx-trace-{stamp}.json", mime="application/json",
+                                   use_container_width=True)
+                st.download_button("⬇️ Whole session (Chrome trace)", json.dumps(to_chrome(traces)),
+                                   file_name=f"insightx-session-{stamp}.json", mime="application/json",
+                                   use_container_width=True)
+                st.caption("Open in chrome://tracing, ui.perfetto.dev or speedscope.app")
+
         with st.expander("🛠️ Detected Column Names"):
             st.code(", ".join(df.columns.tolist()))
+            report = load_compaction_report(CSV_PATH)
+            if report:
+                saved = sum(r["before"] - r["after"] for r in report.values())
+                total = sum(r["after"] for r in report.values())
+                st.caption(f"In memory: {total/1e6:,.1f} MB after compaction ({saved/1e6:,.1f} MB saved)")
+                st.dataframe(format_report(report), use_container_width=True, hide_index=True)
+
+
+
+# ── Verification Panel: typed result display ─────────────────────────────────
+def show_result_value(res):
+    """Render the typed result already computed by execute_code — no re-execution."""
+    raw = res.value
+    if isinstance(raw, pd.DataFrame):
+        st.dataframe(raw, use_container_width=True)
+    elif isinstance(raw, dict):
+        # Flatten nested dicts for display
+        flat_items = []
+        for k, v in raw.items():
+            if isinstance(v, dict):
+                for k2, v2 in v.items():
+                    flat_items.append({
+                        "Category": str(k),
+                        "Sub-category": str(k2),
+                        "Value": round(v2, 4) if isinstance(v2, float) else v2
+                    })
+            else:
+                flat_items.append({
+                    "Category": str(k),
+                    "Sub-category": "—",
+                    "Value": round(v, 4) if isinstance(v, float) else v
+                })
+        if flat_items:
+            try:
+                st.dataframe(pd.DataFrame(flat_items), use_container_width=True)
+            except Exception:
+                st.text(res.text[:3000])
+    else:
+        st.code(str(raw))
+
+# ── Tracing ──────────────────────────────────────────────────────────────────
+# Every question is traced (tracing.py): the sidebar's 🧭 Trace panel shows the
+# last one and a per-stage summary of the session, both downloadable as
+# Chrome trace JSON. INSIGHTX_TRACE_DIR also writes each trace to that folder.
+TRACE_DIR = os.environ.get("INSIGHTX_TRACE_DIR")
+TRACE_KEEP = 50   # traces kept per session
+
+# ── Metrics ──────────────────────────────────────────────────────────────────
+# Each finished trace also feeds the process-wide Prometheus metrics
+# (metrics.py): INSIGHTX_METRICS_PORT serves them at /metrics,
+# INSIGHTX_METRICS_FILE rewrites that file after every question.
+METRICS_PORT = int(os.environ.get("INSIGHTX_METRICS_PORT", 0))
+METRICS_FILE = os.environ.get("INSIGHTX_METRICS_FILE")
+BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
 
-
+@st.cache_resource
+def init_metrics():
+    """Register the scrape-time collector and start the /metrics endpoint (once per process)."""
+    client, result_cache, llm_cache = get_client(), get_result_cache(), get_llm_cache()
+
+    @REGISTRY.collector
+    def runtime_metrics():
+        health = client.health()
+        breaker = Gauge("insightx_llm_breaker_state", "LLM circuit breaker: 0 closed, 1 half-open, 2 open")
+        breaker.set(BREAKER_STATES[health["state"]])
+        events = Counter("insightx_llm_client_events_total", "LLM client calls, failures, retries, timeouts "
+                         "and calls refused while the breaker was open", ("event",))
+        for event, key in [("call", "calls"), ("failure", "failures"), ("retry", "retries"),
+                           ("timeout", "timeouts"), ("refused", "short_circuited")]:
+            events.inc(health[key], event=event)
+        sizes = Gauge("insightx_cache_entries", "Entries held by each cache", ("cache",))
+        size_bytes = Gauge("insightx_cache_bytes", "Bytes held by each cache", ("cache",))
+        for name, stats in [("result", result_cache.stats()), ("llm", llm_cache.stats())]:
+            sizes.set(stats["entries"], cache=name)
+            size_bytes.set(stats["bytes"], cache=name)
+        return [breaker, events, sizes, size_bytes]
+
+    return serve(REGISTRY, METRICS_PORT) if METRICS_PORT else None
+
+@contextmanager
+def traced_question(question):
+    """trace() one question's pipeline; keep it in the session (and TRACE_DIR) and count it in the metrics."""
+    root = None
+    try:
+        with trace("question", question=question) as root:
+            yield root
+    finally:
+        if root is not None:
+            traces = st.session_state.setdefault("traces", [])
+            traces.append(root)
+            del traces[:-TRACE_KEEP]
+            if TRACE_DIR:
+                write_chrome(root, TRACE_DIR)
+            observe_trace(root)
+            if METRICS_FILE:
+                write_file(REGISTRY, METRICS_FILE)
 
 # ── Main ──────────────────────────────────────────────────────────────────────
+# ── Chat rendering ───────────────────────────────────────────────────────────
+STREAM_REFRESH_S = 0.05   # minimum gap between re-renders of a streaming answer
+
+def assistant_html(content):
+    return f'<div class="assistant-msg">🤖 <strong>InsightX:</strong><br><br>{content}</div>'
+
+def render_stream(chunks, placeholder, prefix=""):
+    """Show text deltas in placeholder as they arrive (after prefix, with a cursor); returns the text."""
+    text, shown = "", 0.0
+    for delta in chunks:
+        text += delta
+        now = time.perf_counter()
+        if now - shown >= STREAM_REFRESH_S:
+            placeholder.markdown(assistant_html(prefix + text + " ▌"), unsafe_allow_html=True)
+            shown = now
+    return text.strip()
+
+# ── Multi-part questions ─────────────────────────────────────────────────────
+@dataclass
+class PartAnswer:
+    """One part of a multi-part question, answered end to end."""
+    question: str
+    code: str = None
+    result: ExecResult = None
+    insight: str = ""
+    timing: InsightTiming = field(default_factory=InsightTiming)
+    usage: PromptUsage = None     # code-generation prompt, when the LLM wrote the code
+
+# One limit for the whole process: it protects the LLM backend, not a session
+@st.cache_resource
+def get_llm_slots():
+    """Semaphore capping concurrent LLM requests (INSIGHTX_LLM_CONCURRENCY, default 2)."""
+    return threading.BoundedSemaphore(int(os.environ.get("INSIGHTX_LLM_CONCURRENCY", 2)))
+
+@traced()
+def answer_part(question, df, df_summary, history, client, on_delta=None):
+    """
+    Code → result → insight for one part; each LLM call holds a get_llm_slots()
+    slot. Routed and planned parts are rendered without an insight call, and
+    answered with degraded_insight while the LLM is unavailable.
+    """
+    annotate(question=question)
+    answer = PartAnswer(question)
+    local = answer_without_llm(question, df)
+    if local:
+        answer.code, answer.result = local
+        answer.insight = rendered_insight(question, answer.result, answer.timing) or ""
+        if not answer.insight and not llm_available(client):
+            answer.insight = degraded_insight(question, answer.result) or ""
+    else:
+        answer.usage = PromptUsage()
+        with get_llm_slots():
+            answer.code = generate_pandas_code(question, df_summary, history, client, cache=get_llm_cache(),
+                                               usage=answer.usage)
+        answer.result = run_code(answer.code, df)
+    if answer.insight:
+        if RENDER_CONTEXT_LLM and llm_available(client):
+            with get_llm_slots():
+                answer.insight = add_llm_context(answer.insight, client, answer.timing, cache=insight_cache())
+        if on_delta:
+            on_delta(answer.insight)
+        return answer
+    try:
+        with get_llm_slots():
+            for delta in stream_insight(question, answer.result, [], client, answer.timing, cache=insight_cache()):
+                answer.insight += delta
+                if on_delta:
+                    on_delta(delta)
+    except LLMUnavailable:
+        fallback = degraded_insight(question, answer.result) if local else None
+        if fallback is None:
+            raise
+        fallback = ("\n\n" if answer.insight else "") + fallback
+        answer.insight += fallback
+        if on_delta:
+            on_delta(fallback)
+    answer.insight = answer.insight.strip()
+    return answer
+
+def answer_parts(parts, df, df_summary, history, client, boxes=None):
+    """
+    answer_part for every part at once on a thread pool. Insight tokens are
+    queued back to this (script) thread, which streams each part into its own
+    placeholder in boxes as they arrive. Returns the PartAnswers in order; a
+    part's exception is re-raised here.
+    """
+    events = queue.SimpleQueue()
+    ctx = get_script_run_ctx()
+
+    def work(i, part):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            return answer_part(part, df, df_summary, history, client,
+                               on_delta=lambda delta: events.put((i, delta)))
+        finally:
+            events.put((i, None))
+
+    texts = [""] * len(parts)
+    shown = [0.0] * len(parts)
+    pending = len(parts)
+    with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="insightx-part") as pool:
+        # Each part in a copy of this context: its spans nest under the question's trace
+        futures = [pool.submit(contextvars.copy_context().run, work, i, part) for i, part in enumerate(parts)]
+        while pending:
+            i, delta = events.get()
+            done = delta is None
+            if done:
+                pending -= 1
+            else:
+                texts[i] += delta
+            now = time.perf_counter()
+            if boxes and (done or now - shown[i] >= STREAM_REFRESH_S):
+                cursor = "" if done else " ▌"
+                boxes[i].markdown(assistant_html(f"**Q{i+1}: {parts[i]}**\n{texts[i]}{cursor}"),
+                                  unsafe_allow_html=True)
+                shown[i] = now
+        return [f.result() for f in futures]
+
 def main():
     try:
         df = load_data()
@@ -2074,7 +3147,9 @@ def main():
         st.stop()
 
     client     = get_client()
-    df_summary = get_data_summary(df)
+    init_metrics()
+    profile    = get_profile()
+    df_summary = get_data_summary(profile)
 
     if "messages" not in st.session_state:
         st.session_state["messages"] = []
@@ -2085,7 +3160,7 @@ def main():
     if "prefill_query" not in st.session_state:
         st.session_state["prefill_query"] = ""
 
-    show_sidebar_stats(df)
+    show_sidebar_stats(df, profile)
 
     st.markdown('<h1 style="font-family:Space Mono,monospace;font-size:2rem;margin-bottom:0;">InsightX 🔍</h1>', unsafe_allow_html=True)
     st.markdown('<p style="color:#6b7280;margin-top:4px;">Ask any business question about your UPI transaction data</p>', unsafe_allow_html=True)
@@ -2104,7 +3179,7 @@ def main():
         if msg["role"] == "user":
             st.markdown(f'<div class="user-msg">🧑‍💼 <strong>You:</strong> {msg["content"]}</div>', unsafe_allow_html=True)
         else:
-            st.markdown(f'<div class="assistant-msg">🤖 <strong>InsightX:</strong><br><br>{msg["content"]}</div>', unsafe_allow_html=True)
+            st.markdown(assistant_html(msg["content"]), unsafe_allow_html=True)
 
     prefill    = st.session_state.pop("prefill_query", "")
     user_input = st.chat_input("Ask a question about your transaction data...")
@@ -2113,6 +3188,12 @@ def main():
 
     if user_input:
         st.session_state["messages"].append({"role": "user", "content": user_input})
+        # Turn records + rolling summary instead of the previous answers verbatim
+        conversation = conversation_context(st.session_state["messages"])
+        history = conversation.messages(CONTEXT_TOKENS)
+        st.session_state["context_tokens"] = sum(estimate_tokens(m["content"]) for m in history)
+        # Shown now so the streamed answer appears under its question
+        st.markdown(f'<div class="user-msg">🧑‍💼 <strong>You:</strong> {user_input}</div>', unsafe_allow_html=True)
 
         # Store context for follow-up queries
         if "last_topic" not in st.session_state:
@@ -2128,11 +3209,13 @@ def main():
             '</div>',
             unsafe_allow_html=True
         )
-        with st.spinner("🔍 Crunching 250,000 transactions..."):
+        with traced_question(user_input), st.spinner("🔍 Crunching 250,000 transactions..."):
             try:
                 # ── Step 0: Intent detection & ambiguity handling ──────────
                 clarification = detect_ambiguity(user_input)
+                annotate(question_type=question_type(user_input))
                 if clarification:
+                    annotate(outcome="clarification")
                     st.session_state["messages"].append({"role": "assistant", "content": clarification})
                     st.rerun()
 
@@ -2148,118 +3231,178 @@ def main():
                     "focus on","interesting","elaborate","dig deeper","compare that","can you compare"]
                 if any(p in user_input.lower() for p in no_split_check):
                     parts = [expanded_query]
+                annotate(question_type=question_type(expanded_query), parts=len(parts))
+                results = []  # (label, ExecResult) — each question's code runs exactly once
+                local = None
+                prompts = []  # PromptUsage of each code-generation call for this answer
                 if len(parts) > 1:
-                    combined_results = []
-                    combined_codes = []
-                    for i, part in enumerate(parts):
-                        routed = route_query(part, df)
-                        c = routed if routed else generate_pandas_code(part, df_summary, st.session_state["messages"][:-1], client)
-                        r, e = execute_code(c, df)
-                        label = f"QUESTION {i+1}: {part}"
-                        result_text = r if r else f"Could not compute: {str(e)}"
+                    # Every part runs its whole pipeline concurrently and streams into its own box
+                    boxes = [st.empty() for _ in parts]
+                    started = time.perf_counter()
+                    answers = answer_parts(parts, df, df_summary, history, client, boxes)
+                    combined_results, combined_codes, individual_insights = [], [], []
+                    for i, answer in enumerate(answers):
+                        res = answer.result
+                        results.append((f"Q{i+1}: {answer.question}", res))
+                        label = f"QUESTION {i+1}: {answer.question}"
+                        result_text = res.text if res.ok else f"Could not compute: {res.error}"
                         combined_results.append(f"{label}\nANSWER {i+1}: {result_text}")
-                        combined_codes.append(f"# Q{i+1}: {part}\n{c}")
+                        combined_codes.append(f"# Q{i+1}: {answer.question}\n{answer.code}")
+                        individual_insights.append(f"**Q{i+1}: {answer.question}**\n{answer.insight}")
                     data_result = "\n\n---\n\n".join(combined_results)
-                    error = None
                     code = "\n\n".join(combined_codes)
-                    # Generate one insight per question and combine
-                    individual_insights = []
-                    for i, (part, res) in enumerate(zip(parts, combined_results)):
-                        part_result = res.split(f"ANSWER {i+1}: ")[-1] if f"ANSWER {i+1}:" in res else res
-                        part_insight = generate_insight(part, part_result, None, [], client)
-                        individual_insights.append(f"**Q{i+1}: {part}**\n{part_insight}")
                     combined_insight = "\n\n---\n\n".join(individual_insights)
-                    recs = get_recommendations(" ".join(parts), data_result)
+                    recs = get_recommendations(" ".join(parts), ExecResult(text=data_result))
                     if recs:
                         combined_insight += "\n\n" + recs
-                    st.session_state["messages"].append({"role": "assistant", "content": combined_insight})
+                    for box in boxes[1:]:
+                        box.empty()
+                    boxes[0].markdown(assistant_html(combined_insight), unsafe_allow_html=True)
+                    prompts = [a.usage for a in answers if a.usage]
+                    ttfts = [a.timing.ttft_ms for a in answers if a.timing.ttft_ms is not None]
+                    rendered = sum(a.timing.rendered for a in answers)
+                    st.session_state["rendered_answers"] = st.session_state.get("rendered_answers", 0) + rendered
+                    st.session_state["messages"].append({
+                        "role": "assistant", "content": combined_insight,
+                        "ttft_ms": min(ttfts) if ttfts else None,
+                        "total_ms": (time.perf_counter() - started) * 1000,
+                    })
+                    streamed = [a.timing.ttft_ms for a in answers if a.timing.ttft_ms is not None and not a.timing.rendered]
+                    if streamed:
+                        st.session_state.setdefault("ttft_ms", []).append(min(streamed))
                     st.session_state["last_topic"] = user_input
                     st.session_state["last_result"] = data_result
                 else:
-                    # Try smart router first, fall back to LLM if no match
-                    routed_code = route_query(expanded_query, df)
-                    if routed_code:
-                        code = routed_code
-                        data_result, error = execute_code(code, df)
+                    # Router template or query plan first, LLM only if neither answers
+                    local = answer_without_llm(expanded_query, df)
+                    if local:
+                        code, res = local
+                        results.append(("", res))
                     elif expanded_query.lower().startswith("explain why:") or expanded_query.lower().startswith("explain why "):
                         # Pure reasoning question — no pandas needed, LLM explains directly
-                        data_result, error, code = None, None, "# No code — LLM reasoning question"
+                        code = "# No code — LLM reasoning question"
                     else:
-                        code = generate_pandas_code(expanded_query, df_summary, st.session_state["messages"][:-1], client)
-                        data_result, error = execute_code(code, df)
+                        prompts.append(PromptUsage())
+                        code = generate_pandas_code(expanded_query, df_summary, history, client,
+                                                    cache=get_llm_cache(), usage=prompts[-1])
+                        results.append(("", run_code(code, df)))
 
                 if not st.session_state["messages"] or st.session_state["messages"][-1]["role"] != "assistant":
-                    insight = generate_insight(user_input, data_result, error, st.session_state["messages"][:-1], client)
-                    recommendations = get_recommendations(user_input, data_result or "")
+                    result = results[0][1] if results else None
+                    answer_box = st.empty()
+                    timing = InsightTiming()
+                    insight = rendered_insight(expanded_query, result, timing, asked=user_input) if local else None
+                    if insight is None and local and not llm_available(client):
+                        insight = degraded_insight(expanded_query, result)
+                    if insight is not None and RENDER_CONTEXT_LLM and llm_available(client):
+                        answer_box.markdown(assistant_html(insight), unsafe_allow_html=True)
+                        insight = add_llm_context(insight, client, timing, cache=insight_cache())
+                    elif insight is None:
+                        try:
+                            insight = render_stream(
+                                stream_insight(user_input, result, history, client, timing, cache=insight_cache(),
+                                               recap=conversation.recap(RECAP_TOKENS)),
+                                answer_box)
+                        except LLMUnavailable:
+                            # The model failed mid-answer: routed results are still answered
+                            insight = degraded_insight(expanded_query, result) if local else None
+                            if insight is None:
+                                raise
+                    recommendations = get_recommendations(user_input, result)
                     if recommendations:
                         insight = insight + "\n\n" + recommendations
-                    st.session_state["messages"].append({"role": "assistant", "content": insight})
+                    answer_box.markdown(assistant_html(insight), unsafe_allow_html=True)
+                    st.session_state["messages"].append({
+                        "role": "assistant", "content": insight,
+                        "ttft_ms": timing.ttft_ms, "total_ms": timing.total_ms, "cached": timing.cached,
+                        "rendered": timing.rendered,
+                    })
+                    if timing.rendered:
+                        st.session_state["rendered_answers"] = st.session_state.get("rendered_answers", 0) + 1
+                    else:
+                        st.session_state.setdefault("ttft_ms", []).append(timing.ttft_ms)
                     st.session_state["last_topic"] = expanded_query  # store expanded for better context
-                    st.session_state["last_result"] = data_result or ""
+                    st.session_state["last_result"] = result.text if result and result.text else ""
+                st.session_state.setdefault("code_prompts", []).extend(u for u in prompts if u.sent)
                 # Auto-save after every message
                 save_chat("autosave_current_session", st.session_state["messages"])
 
                 # ── Verification Panel ──────────────────────────────────
-                with st.expander("📊 How did InsightX compute this? Click to verify →", expanded=False):
-                    tab1, tab2 = st.tabs(["📋 Raw Result Table", "🧑‍💻 Generated Code"])
+                with span("verification_panel"), st.expander("📊 How did InsightX compute this? Click to verify →", expanded=False):
+                    tab1, tab2 = st.tabs(["📋 Raw Result Table", "🧑‍💻 Code"])
 
                     with tab1:
-                        if error:
-                            st.error(f"❌ Execution error: {error}")
-                            st.info("The insight above was generated from context, not live data.")
-                        else:
+                        mutations = [m for _, res in results for m in res.mutations]
+                        if mutations:
+                            st.warning("⚠️ The generated code modified its working copy of the data ("
+                                       + ", ".join(mutations) + "). Only those columns were copied — "
+                                       "the shared dataset is unchanged.")
+                        if not results:
+                            st.info("No data was computed for this answer — it is a reasoning question.")
+                        for label, res in results:
+                            if label:
+                                st.markdown(f"**{label}**")
+                            if res.error:
+                                st.error(f"❌ Execution error: {res.error}")
+                                st.info("The insight above was generated from context, not live data.")
+                                continue
                             st.markdown("**📊 Exact data used to generate this answer:**")
-                            try:
-                                local_vars2 = {"df": df.copy(), "pd": pd}
-                                exec(code, {}, local_vars2)
-                                raw = local_vars2.get("result")
-                                if isinstance(raw, pd.DataFrame):
-                                    st.dataframe(raw, use_container_width=True)
-                                elif isinstance(raw, dict):
-                                    # Flatten nested dicts for display
-                                    flat_items = []
-                                    for k, v in raw.items():
-                                        if isinstance(v, dict):
-                                            for k2, v2 in v.items():
-                                                flat_items.append({
-                                                    "Category": str(k),
-                                                    "Sub-category": str(k2),
-                                                    "Value": round(v2, 4) if isinstance(v2, float) else v2
-                                                })
-                                        else:
-                                            flat_items.append({
-                                                "Category": str(k),
-                                                "Sub-category": "—",
-                                                "Value": round(v, 4) if isinstance(v, float) else v
-                                            })
-                                    if flat_items:
-                                        st.dataframe(pd.DataFrame(flat_items), use_container_width=True)
-                                else:
-                                    st.code(str(raw))
-                            except Exception:
-                                st.text(data_result[:3000] if data_result else "No result")
+                            show_result_value(res)
+                            if res.cached:
+                                st.caption(f"⚡ Served from the result cache in {res.elapsed_ms:,.2f} ms · result holds {res.result_bytes/1024:,.1f} KB")
+                            else:
+                                st.caption(f"⏱️ Computed in {res.elapsed_ms:,.1f} ms · result holds {res.result_bytes/1024:,.1f} KB")
 
+                        if any(res.ok for _, res in results):
                             st.markdown("---")
                             col_a, col_b, col_c = st.columns(3)
                             with col_a:
                                 st.metric("📦 Total Rows Analysed", f"{len(df):,}")
                             with col_b:
-                                success_pct = round((df['transaction_status']=='SUCCESS').mean()*100, 1)
+                                success_pct = round(profile.get("success_rate", 0), 1)
                                 st.metric("✅ Overall Success Rate", f"{success_pct}%")
                             with col_c:
                                 st.metric("📅 Data Period", "Jan–Dec 2024")
                             st.success("✅ Numbers computed directly from 250,000 row CSV using Pandas — zero AI hallucination.")
 
+                        answer = st.session_state["messages"][-1]
+                        if answer.get("rendered"):
+                            st.caption(f"📐 Answer written from the result in {answer['total_ms']:,.1f} ms — "
+                                       "no insight call, every number is the table's own")
+                        elif answer.get("cached"):
+                            st.caption(f"💬 Answer text served from the LLM cache in {answer['ttft_ms']:,.1f} ms")
+                        elif answer.get("ttft_ms") is not None:
+                            st.caption(f"💬 First words after {answer['ttft_ms']/1000:,.2f} s · "
+                                       f"full answer in {answer['total_ms']/1000:,.1f} s")
+
                     with tab2:
-                        st.markdown("**LLM-generated Pandas code (executed live on your data):**")
+                        templated = TEMPLATE_HEADER in code
+                        if prompts:
+                            st.markdown("**LLM-generated Pandas code (executed live on your data):**")
+                        elif PLAN_HEADER in code or templated:
+                            st.markdown("**Answered without the LLM, by the router's templates and query plans:**")
                         st.code(code, language="python")
-                        st.info("💡 Copy this code into a Jupyter notebook or Python script to independently verify the answer.")
+                        for usage in prompts:
+                            st.caption(prompt_caption(usage))
+                        if templated:
+                            st.info("💡 Router templates call InsightX's pre-aggregated helpers (`cube`, `group_stats`, "
+                                    "`idx`), so they only run inside the app — the Raw Result Table shows exactly what "
+                                    "they returned. Plain pandas code here can be copied into a notebook to verify it.")
+                        else:
+                            st.info("💡 Copy this code into a Jupyter notebook or Python script to independently verify the answer.")
 
             except Exception as e:
                 err_str = str(e)
-                if "connection" in err_str.lower() or "refused" in err_str.lower():
+                annotate(outcome="error", error=type(e).__name__)
+                if isinstance(e, LLMUnavailable):
+                    msg = ("⚠️ **The AI model is not responding** — this question needs it, and it has failed or timed out "
+                           "on recent requests.\n\n"
+                           "Questions answered from the data directly (the sidebar suggestions) still work. Please make sure "
+                           f"**LM Studio** is running at `{LLM_URL}` with a model loaded, then try again.\n\n"
+                           f"*Technical detail: {err_str[:160]}*")
+                elif "connection" in err_str.lower() or "refused" in err_str.lower():
                     msg = ("⚠️ **Connection issue** — I can't reach the AI model right now.\n\n"
-                           "Please make sure **LM Studio** is running at `http://127.0.0.1:1234` with a model loaded, then try again.")
+                           f"Please make sure **LM Studio** is running at `{LLM_URL}` with a model loaded, then try again.")
                 else:
                     msg = (f"⚠️ **Something went wrong** — I hit an unexpected error.\n\n"
                            f"Try rephrasing your question, or pick one from the sidebar suggestions.\n\n"
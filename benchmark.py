@@ -0,0 +1,1356 @@
+"""
+InsightX – Performance Benchmarks
+===================================
+Measures our own pipeline code (no LLM involved).
+
+Usage:  python benchmark.py sandbox     [--rows N] [--repeat R]
+        python benchmark.py resultcache [--rows N]
+        python benchmark.py cube        [--rows N] [--repeat R]
+        python benchmark.py kernel      [--rows N] [--repeat R]
+        python benchmark.py index       [--rows N] [--repeat R]
+        python benchmark.py router      [--repeat R] [--record]
+        python benchmark.py plan        [--rows N] [--repeat R]
+        python benchmark.py compile     [--rows N] [--repeat R]
+        python benchmark.py multipart   [--llm-ms MS] [--concurrency C]
+        python benchmark.py llmcache    [--llm-ms MS]
+        python benchmark.py render      [--llm-ms MS] [--tokens N] [--token-ms MS] [--repeat R]
+        python benchmark.py prompt      [--rows N] [--repeat R]
+        python benchmark.py serialize   [--rows N] [--repeat R] [--prefill-tps T]
+        python benchmark.py context     [--turns N]
+        python benchmark.py resilience  [--calls N] [--timeout-ms MS] [--deadline-ms MS] [--stall-ms MS]
+        python benchmark.py stub        [--latency-ms MS] [--tps T] [--fail-rate R] [--questions N]
+        python benchmark.py trace       [--questions N] [--out FILE] [--repeat R]
+        python benchmark.py metrics     [--questions N] [--max-fallback R] [--max-p95-ms MS] [--out FILE]
+        python benchmark.py dtypes      [--rows N]
+Data:   upi_transactions_2024.csv if present, otherwise a synthetic frame
+        with the same schema (--rows forces synthetic data of that size)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from openai import APIConnectionError, APITimeoutError
+
+logging.disable(logging.WARNING)  # importing app.py outside `streamlit run` is noisy
+
+import app
+from analytics import CUBE_DIMENSIONS, Cube, PredicateIndex, group_stats
+from conversation import ConversationContext
+from datastore import (CSV_PATH, SharedDataset, build_profile, compact_frame, normalise_columns, open_dataset,
+                       plain_columns)
+from llmcache import CompletionCache
+from llmclient import LLMUnavailable, ResilientClient
+from metrics import QUESTION_SECONDS, QUESTIONS, REGISTRY, ROUTES, observe_trace, write_file
+from queryplan import MONTH, QueryParser, execute_plan
+from stubllm import StubConfig, StubServer
+from tracing import stage_summary, to_chrome, trace
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Data
+# ─────────────────────────────────────────────────────────────────────────────
+def make_synthetic(rows, seed=42, compact=True):
+    """Random transactions with the real CSV's headers and value sets."""
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 366 * 24 * 3600, rows), unit="s")
+    types = rng.choice(["P2P", "P2M", "Bill Payment", "Recharge"], rows, p=[.45, .30, .15, .10])
+    merchants = rng.choice(["Food", "Grocery", "Fuel", "Entertainment", "Shopping", "Healthcare",
+                            "Education", "Transport", "Utilities", "Other"], rows)
+    banks  = ["SBI", "HDFC", "ICICI", "Axis", "PNB", "Kotak", "IndusInd", "Yes Bank"]
+    states = ["Maharashtra", "Uttar Pradesh", "Karnataka", "Tamil Nadu", "Delhi",
+              "Telangana", "Gujarat", "Rajasthan", "West Bengal", "Andhra Pradesh"]
+    ages   = ["18-25", "26-35", "36-45", "46-55", "56+"]
+    df = pd.DataFrame({
+        "transaction id":     [f"TXN{i:010d}" for i in range(rows)],
+        "timestamp":          ts,
+        "transaction type":   types,
+        "merchant_category":  np.where(types == "P2P", None, merchants),
+        "amount (INR)":       np.round(rng.lognormal(6.5, 1.1, rows), 2),
+        "transaction_status": np.where(rng.random(rows) < 0.0495, "FAILED", "SUCCESS"),
+        "sender_age_group":   rng.choice(ages, rows),
+        "receiver_age_group": rng.choice(ages, rows),
+        "sender_state":       rng.choice(states, rows),
+        "sender_bank":        rng.choice(banks, rows),
+        "receiver_bank":      rng.choice(banks, rows),
+        "device_type":        rng.choice(["Android", "iOS", "Web"], rows, p=[.75, .20, .05]),
+        "network_type":       rng.choice(["4G", "5G", "WiFi", "3G"], rows, p=[.60, .25, .10, .05]),
+        "fraud_flag":         (rng.random(rows) < 0.0019).astype(int),
+        "hour_of_day":        ts.hour,
+        "day_of_week":        ts.day_name(),
+        "is_weekend":         (ts.dayofweek >= 5).astype(int),
+    })
+    df = normalise_columns(df)
+    if compact:
+        compact_frame(df)
+    return df
+
+
+def load_dataset(rows=None):
+    if rows is None and os.path.exists(CSV_PATH):
+        return open_dataset(CSV_PATH)
+    rows = rows or 250_000
+    return SharedDataset(make_synthetic(rows), f"synthetic-{rows}")
+
+
+# Representative router questions (docs/sample_queries.md)
+ROUTED_QUESTIONS = [
+    "Which bank has the highest failure rate?",
+    "Compare failure rates between Android and iOS for P2P",
+    "Which state has the most flagged transactions?",
+    "Compare failure rates across all transaction types",
+    "Which combination of bank and transaction type has the highest failure rate?",
+    "Compare fraud flag rates by bank",
+    "What are the peak hours for failed transactions?",
+    "Show monthly transaction volume for 2024",
+    "Give me a complete diagnosis of our payment system",
+]
+
+# Typical LLM-generated snippet that adds a column to df
+MUTATING_CODE = (
+    "df['month'] = df['timestamp'].dt.month\n"
+    "result = df.groupby('month')['amount_inr'].mean().round(2).to_dict()"
+)
+
+
+def routed_context(df):
+    """Names routed code expects besides df and pd (as app.exec_context builds them)."""
+    return {"cube": Cube.build(df), "group_stats": group_stats, "idx": PredicateIndex.build(df)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def measure(fn, repeat):
+    """Median wall time (ms) and traced allocation peak (MB) of fn()."""
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak / 1e6
+
+
+def print_table(title, rows, columns):
+    print("\n" + title)
+    print(pd.DataFrame(rows, columns=columns).to_string(index=False))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# dtypes — generated-code idioms on the compact frame vs the parsed CSV
+# ─────────────────────────────────────────────────────────────────────────────
+# Idioms LLM-generated code uses that int8 or categorical storage would break:
+# wrap-around arithmetic, new string values, ordering, and missing values
+# (merchant_category is empty on every P2P row of the real CSV).
+DTYPE_IDIOMS = {
+    "int8 arithmetic":   "result = int((df['hour_of_day'] * 60).max())",
+    "int8 power":        "result = int((df['hour_of_day'] ** 2).max())",
+    "flag cumsum":       "result = int(df['fraud_flag'].cumsum().max())",
+    "string concat":     "result = (df['sender_bank'] + '-' + df['transaction_type']).value_counts().head(5).to_dict()",
+    "fillna new value":  "result = df['merchant_category'].fillna('Unknown').value_counts().to_dict()",
+    "replace new value": "result = df['network_type'].replace({'4G': 'Mobile'}).value_counts().to_dict()",
+    "where new value":   "result = df['merchant_category'].where(df['fraud_flag'] == 1, 'none').value_counts().to_dict()",
+    "string ordering":   "result = int((df['sender_age_group'] >= '36-45').sum())",
+    "max of strings":    "result = df['sender_age_group'].max()",
+    "map":               "result = int(df['device_type'].map({'Android': 1, 'iOS': 2, 'Web': 3}).sum())",
+    "isna / notna":      "result = [int(df['merchant_category'].isna().sum()), int(df['merchant_category'].notna().sum())]",
+    "astype(str)":       "result = df['merchant_category'].astype(str).value_counts().to_dict()",
+    "groupby mean":      "result = df.groupby('merchant_category')['amount_inr'].mean().round(2).to_dict()",
+    "failure rate":      ("result = (df[df['transaction_status'] == 'FAILED'].groupby('merchant_category').size()"
+                          " / df.groupby('merchant_category').size() * 100).round(2).to_dict()"),
+}
+
+
+def bench_dtypes(args):
+    if args.rows is None and os.path.exists(CSV_PATH):
+        raw = normalise_columns(pd.read_csv(CSV_PATH))
+        compact = open_dataset(CSV_PATH).view()
+    else:
+        raw = make_synthetic(args.rows or 250_000, compact=False)
+        raw.loc[raw["transaction_type"] == "P2P", "merchant_category"] = np.nan   # as in the real CSV
+        compact = raw.copy()
+        compact_frame(compact)
+
+    def canonical(value):
+        return json.dumps(value, sort_keys=True, default=str)
+
+    rows, diffs = [], 0
+    for name, code in DTYPE_IDIOMS.items():
+        expected = app.execute_code(code, raw)
+        got = app.execute_code(code, compact)
+        peak = app.execute_code(code, compact, track_memory=True).peak_bytes
+        same = got.ok and expected.ok and canonical(got.value) == canonical(expected.value)
+        diffs += not same
+        rows.append([name, "same" if same else "DIFF", round(expected.elapsed_ms, 1), round(got.elapsed_ms, 1),
+                     round(peak / 1e6, 1), (got.error or canonical(got.value))[:50]])
+    print_table(f"Generated-code idioms on the compact frame vs the parsed CSV — {len(raw):,} rows",
+                rows, ["idiom", "result", "csv_ms", "compact_ms", "peak_MB", "value"])
+    full = compact.copy(deep=False)
+    plain_columns(full, full.columns, categories=True)
+    print(f"\nCompact frame {compact.memory_usage(deep=True).sum() / 1e6:,.1f} MB; a fully de-compacted copy "
+          f"would add {full.memory_usage(deep=True).sum() / 1e6:,.1f} MB (only the columns an idiom names are converted, per run)")
+    if diffs:
+        sys.exit(f"{diffs} idiom(s) differ from the parsed CSV")
+    print(f"All {len(DTYPE_IDIOMS)} idioms match the parsed CSV")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# sandbox — execute_code with a deep copy vs a copy-on-write view
+# ─────────────────────────────────────────────────────────────────────────────
+def _sandbox_worker(mode, rows, repeat):
+    """Runs in a fresh interpreter so peak RSS belongs to one sandbox mode only."""
+    df = load_dataset(rows).view()
+    context = routed_context(df)
+    base_rss = peak_rss_mb()
+    cases = [(q, app.route_query(q, df)) for q in ROUTED_QUESTIONS]
+    cases.append(("(LLM code adding a column)", MUTATING_CODE))
+    out = []
+    for label, code in cases:
+        ms, mb = measure(lambda: app.execute_code(code, df, sandbox=mode, context=context), repeat)
+        out.append({"query": label, "ms": round(ms, 2), "peak_mb": round(mb, 2)})
+    return {"rows": len(df), "base_rss_mb": round(base_rss, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1), "queries": out}
+
+
+def bench_sandbox(args):
+    results = {}
+    for mode in ("copy", "view"):
+        cmd = [sys.executable, __file__, "sandbox", "--worker", mode, "--repeat", str(args.repeat)]
+        if args.rows:
+            cmd += ["--rows", str(args.rows)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        results[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    copy, view = results["copy"], results["view"]
+    rows = []
+    for c, v in zip(copy["queries"], view["queries"]):
+        rows.append([c["query"][:55], c["ms"], v["ms"], c["peak_mb"], v["peak_mb"]])
+    print_table(f"execute_code sandbox — {copy['rows']:,} rows, median of {args.repeat}",
+                rows, ["Query", "copy_ms", "view_ms", "copy_peak_MB", "view_peak_MB"])
+    print(f"\nProcess peak RSS (MB): copy={copy['peak_rss_mb']}  view={view['peak_rss_mb']}  "
+          f"(after load: {copy['base_rss_mb']} / {view['base_rss_mb']})")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# resultcache — first run (miss) vs repeated question (hit)
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_resultcache(args):
+    dataset = load_dataset(args.rows)
+    df = dataset.view()
+    context = routed_context(df)
+    cache = app.ResultCache()
+    rows = []
+    for q in ROUTED_QUESTIONS:
+        code = app.route_query(q, df)
+        t = time.perf_counter()
+        if cache.get(code, dataset.fingerprint) is None:
+            cache.put(code, dataset.fingerprint, app.execute_code(code, df, context=context))
+        miss_ms = (time.perf_counter() - t) * 1000
+        t = time.perf_counter()
+        hit = cache.get(code, dataset.fingerprint)
+        hit_us = (time.perf_counter() - t) * 1e6
+        rows.append([q[:55], round(miss_ms, 2), round(hit_us, 1), hit is not None])
+    print_table(f"Result cache — {len(df):,} rows", rows, ["Query", "miss_ms", "hit_us", "hit"])
+    print("\n" + json.dumps(cache.stats(), indent=2))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# cube — per-dimension failure rate: two groupby scans vs a cube lookup
+# ─────────────────────────────────────────────────────────────────────────────
+PANDAS_FAILURE_RATE = (
+    "failed = df[df['transaction_status']=='FAILED'].groupby('{col}').size()\n"
+    "total  = df.groupby('{col}').size()\n"
+    "result = (failed / total * 100).round(2)"
+)
+
+
+def bench_cube(args):
+    df = load_dataset(args.rows).view()
+    t = time.perf_counter()
+    cube = Cube.build(df)
+    build_ms = (time.perf_counter() - t) * 1000
+    rows = []
+    for col in CUBE_DIMENSIONS:
+        scan_code = PANDAS_FAILURE_RATE.format(col=col)
+        cube_code = f"result = cube.stats('{col}')['failure_rate'].round(2)"
+        scan_ms, _ = measure(lambda: exec(scan_code, {"df": df, "pd": pd}), args.repeat)
+        cube_ms, _ = measure(lambda: exec(cube_code, {"cube": cube}), args.repeat)
+        rows.append([col, round(scan_ms, 2), round(cube_ms, 3), round(scan_ms / cube_ms, 1)])
+    print_table(f"Failure rate by dimension — {len(df):,} rows, median of {args.repeat}",
+                rows, ["Dimension", "scan_ms", "cube_ms", "speedup"])
+    info = cube.info()
+    print(f"\nCube build: {build_ms:.0f} ms · {info['cuboids']} cuboids, {info['cells']:,} cells, "
+          f"{info['bytes']/1024:.0f} KB")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# kernel — router templates as filter + groupby scans vs one group_stats pass
+# ─────────────────────────────────────────────────────────────────────────────
+# (question, template as it was written with pandas scans, same result via group_stats)
+KERNEL_CASES = [
+    ("Failure rate by bank (table)",
+     "failed = df[df['transaction_status']=='FAILED'].groupby('sender_bank').size()\n"
+     "total  = df.groupby('sender_bank').size()\n"
+     "rate   = (failed / total * 100).round(2)\n"
+     "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': [int(failed[b]) for b in rate.index], "
+     "'Total': [int(total[b]) for b in rate.index], 'Failure_Rate_%': rate.values.tolist()})",
+     "s      = group_stats(df, 'sender_bank')\n"
+     "rate   = s['failure_rate'].round(2)\n"
+     "result = pd.DataFrame({'Bank': rate.index.tolist(), 'Failed': s['failed'].tolist(), "
+     "'Total': s['count'].tolist(), 'Failure_Rate_%': rate.values.tolist()})"),
+    ("iOS failure rate by bank",
+     "ios = df[df['device_type']=='iOS']\n"
+     "failed = ios[ios['transaction_status']=='FAILED'].groupby('sender_bank').size()\n"
+     "total  = ios.groupby('sender_bank').size()\n"
+     "result = (failed / total * 100).round(2).to_dict()",
+     "result = group_stats(df, 'sender_bank', mask=df['device_type'] == 'iOS')['failure_rate'].round(2).to_dict()"),
+    ("Failure rate by age group (apply)",
+     "grp = df.groupby('sender_age_group')\n"
+     "failed = grp.apply(lambda x: (x['transaction_status']=='FAILED').sum())\n"
+     "total  = grp.size()\n"
+     "result = (failed / total * 100).round(4).to_dict()",
+     "result = group_stats(df, 'sender_age_group')['failure_rate'].round(4).to_dict()"),
+    ("Fraud rate by state",
+     "tmp = df.groupby('sender_state')['fraud_flag'].agg(['sum','count'])\n"
+     "result = (tmp['sum'] / tmp['count'] * 100).round(4).to_dict()",
+     "result = group_stats(df, 'sender_state')['fraud_rate'].round(4).to_dict()"),
+    ("Weekend vs weekday (rate + avg amount)",
+     "wkend = df[df['is_weekend']==1]\n"
+     "wkday = df[df['is_weekend']==0]\n"
+     "result = [round(wkend['transaction_status'].eq('FAILED').mean()*100,2), round(wkday['transaction_status'].eq('FAILED').mean()*100,2), "
+     "round(wkend['amount_inr'].mean(),2), round(wkday['amount_inr'].mean(),2)]",
+     "wk = group_stats(df, 'is_weekend')\n"
+     "result = [round(wk.loc[1, 'failure_rate'],2), round(wk.loc[0, 'failure_rate'],2), "
+     "round(wk.loc[1, 'amount_mean'],2), round(wk.loc[0, 'amount_mean'],2)]"),
+    ("Avg amount of failed txns by bank",
+     "result = df[df['transaction_status']=='FAILED'].groupby('sender_bank')['amount_inr'].mean().round(2).to_dict()",
+     "result = group_stats(df, 'sender_bank', mask=df['transaction_status'] == 'FAILED')['amount_mean'].round(2).to_dict()"),
+    ("Amount mean/median/min/max/std",
+     "a = df['amount_inr']\n"
+     "result = pd.Series([round(a.mean(), 2), round(a.median(), 2), round(a.min(), 2), round(a.max(), 2), round(a.std(), 2)])",
+     "s = group_stats(df, median=True)\n"
+     "result = pd.Series([round(s['amount_mean'], 2), round(s['amount_median'], 2), round(s['amount_min'], 2), "
+     "round(s['amount_max'], 2), round(s['amount_std'], 2)])"),
+    ("Monthly volume",
+     "month  = df['timestamp'].dt.to_period('M').astype(str)\n"
+     "result = {str(k): int(v) for k, v in df.groupby(month).size().items()}",
+     "result = {str(k): int(v) for k, v in group_stats(df, df['timestamp'].dt.to_period('M'))['count'].items()}"),
+]
+
+
+def bench_kernel(args):
+    df = load_dataset(args.rows).view()
+    rows = []
+    for label, scan_code, fused_code in KERNEL_CASES:
+        scan = app.execute_code(scan_code, df)
+        fused = app.execute_code(fused_code, df, context={"group_stats": group_stats})
+        scan_ms, _ = measure(lambda: exec(scan_code, {"df": df, "pd": pd}), args.repeat)
+        fused_ms, _ = measure(lambda: exec(fused_code, {"df": df, "pd": pd, "group_stats": group_stats}), args.repeat)
+        rows.append([label, round(scan_ms, 2), round(fused_ms, 2), round(scan_ms / fused_ms, 1),
+                     scan.ok and fused.ok and scan.text == fused.text])
+    print_table(f"Template scans vs group_stats — {len(df):,} rows, median of {args.repeat}",
+                rows, ["Template", "scan_ms", "kernel_ms", "speedup", "same_result"])
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# index — filter masks from string comparisons vs predicate bitmaps
+# ─────────────────────────────────────────────────────────────────────────────
+# (filter, boolean mask as generated code writes it, same rows via the index)
+INDEX_CASES = [
+    ("Failed only",
+     "(df['transaction_status'] == 'FAILED')",
+     "idx.eq('transaction_status', 'FAILED')"),
+    ("Weekend fraud",
+     "(df['is_weekend'] == 1) & (df['fraud_flag'] == 1)",
+     "idx.select(is_weekend=1, fraud_flag=1)"),
+    ("P2P, iOS, failed",
+     "(df['transaction_type'] == 'P2P') & (df['device_type'] == 'iOS') & (df['transaction_status'] == 'FAILED')",
+     "idx.select(transaction_type='P2P', device_type='iOS', transaction_status='FAILED')"),
+    ("Weekday, Android or iOS, 4G",
+     "(df['is_weekend'] == 0) & df['device_type'].isin(['Android', 'iOS']) & (df['network_type'] == '4G')",
+     "idx.select(is_weekend=0, device_type=['Android', 'iOS'], network_type='4G')"),
+    ("Not SBI, P2M",
+     "(df['sender_bank'] != 'SBI') & (df['transaction_type'] == 'P2M')",
+     "~idx.eq('sender_bank', 'SBI') & idx.eq('transaction_type', 'P2M')"),
+]
+
+
+def bench_index(args):
+    df = load_dataset(args.rows).view()
+    idx = PredicateIndex.build(df)
+    ns = {"df": df, "idx": idx}
+    rows = []
+    for label, mask_code, idx_code in INDEX_CASES:
+        mask = eval(mask_code, ns).to_numpy()
+        sel = eval(idx_code, ns)
+        mask_ms, _ = measure(lambda: eval(mask_code, ns), args.repeat)
+        idx_ms, _ = measure(lambda: eval(idx_code, ns).mask(), args.repeat)
+        rows.append([label, int(mask.sum()), round(mask_ms, 3), round(idx_ms, 3),
+                     round(mask_ms / idx_ms, 1), bool((sel.mask() == mask).all())])
+
+    # Filter-then-group end to end: "P2P only, Android vs iOS failure rate"
+    scan_code = ("df_filtered = df[df['transaction_type']=='P2P']\n"
+                 "failed = df_filtered[df_filtered['transaction_status']=='FAILED'].groupby('device_type').size()\n"
+                 "total  = df_filtered.groupby('device_type').size()\n"
+                 "result = (failed / total * 100).round(2)")
+    idx_code = ("stats = group_stats(df, 'device_type', mask=idx.eq('transaction_type', 'P2P'))\n"
+                "result = stats['failure_rate'].round(2)")
+    scan_ms, _ = measure(lambda: exec(scan_code, {"df": df, "pd": pd}), args.repeat)
+    idx_ms, _ = measure(lambda: exec(idx_code, {"df": df, "idx": idx, "group_stats": group_stats}), args.repeat)
+    rows.append(["P2P only → failure rate by device", "", round(scan_ms, 3), round(idx_ms, 3),
+                 round(scan_ms / idx_ms, 1), ""])
+
+    print_table(f"Filter masks vs predicate bitmaps — {len(df):,} rows, median of {args.repeat}",
+                rows, ["Filter", "rows", "compare_ms", "bitmap_ms", "speedup", "same_rows"])
+    info = idx.info()
+    print(f"\nIndex build: {info['build_ms']:.0f} ms · {info['columns']} columns, "
+          f"{info['bitmaps']} bitmaps, {info['bytes']/1e6:.1f} MB")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# router — keyword-indexed dispatch vs trying every rule in order
+# ─────────────────────────────────────────────────────────────────────────────
+SAMPLE_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs", "sample_queries.md")
+# What the if-chain route_query answered for each sample query before the
+# keyword index replaced it: template code and a digest of its result on the
+# dataset named in the file. Re-record only when a template change is intended.
+ROUTE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs", "route_baseline.json")
+
+
+def load_sample_queries(path=SAMPLE_QUERIES):
+    with open(path, encoding="utf-8") as f:
+        return re.findall(r"\*\*Q\d+: (.+?)\*\*", f.read())
+
+
+def result_digest(result):
+    if isinstance(result, pd.DataFrame):
+        text = result.to_string()
+    elif isinstance(result, dict):
+        text = json.dumps(result, indent=2, default=str)
+    else:
+        text = str(result)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def record_route_baseline(path=ROUTE_BASELINE):
+    """Write the current route_query decisions over the sample queries as the baseline."""
+    dataset = load_dataset()
+    df = dataset.view()
+    ctx = {"df": df, "pd": pd, **routed_context(df)}
+    questions = []
+    for q in load_sample_queries():
+        code = app.route_query(q, df)
+        result = None
+        if code:
+            ns = dict(ctx)
+            exec(code, ns)
+            result = result_digest(ns["result"])
+        questions.append({"question": q, "code": code, "result": result})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"dataset": dataset.fingerprint, "questions": questions}, f, indent=1, ensure_ascii=False)
+        f.write("\n")
+    print(f"Recorded {len(questions)} routing decisions to {path}")
+
+
+def bench_router(args, calls=1000):
+    if args.record:
+        record_route_baseline()
+        return
+    with open(ROUTE_BASELINE, encoding="utf-8") as f:
+        baseline = json.load(f)
+    # Results are only comparable on the dataset the baseline was recorded on
+    dataset = load_dataset()
+    df = dataset.view()
+    check_results = dataset.fingerprint == baseline["dataset"]
+    ctx = {"df": df, "pd": pd, **routed_context(df)} if check_results else None
+    rows, differ = [], []
+    for entry in baseline["questions"]:
+        q = entry["question"]
+        rule, code = app.match_route(q)
+        ref_rule, ref_code = app.match_route(q, indexed=False)
+        lower = q.lower()
+        tried = bin(app.candidate_routes(lower, lower.split())).count("1")
+        # ms for `calls` routings == µs per routing
+        idx_us, _ = measure(lambda: [app.match_route(q) for _ in range(calls)], args.repeat)
+        lin_us, _ = measure(lambda: [app.match_route(q, indexed=False) for _ in range(calls)], args.repeat)
+        same = rule is ref_rule and code == ref_code and code == entry["code"]
+        if same and code and check_results:
+            ns = dict(ctx)
+            exec(code, ns)
+            same = result_digest(ns["result"]) == entry["result"]
+        if not same:
+            differ.append(q)
+        rows.append([q[:60], rule.__name__ if rule else "(LLM)", tried,
+                     round(lin_us, 2), round(idx_us, 2), round(lin_us / idx_us, 1), same])
+    print_table(f"Routing latency per question (µs) — {len(rows)} sample queries, {len(app.ROUTES)} rules, "
+                f"median of {args.repeat}",
+                rows, ["Question", "Rule", "tried", "linear_us", "indexed_us", "speedup", "same"])
+    lin_total = sum(r[3] for r in rows)
+    idx_total = sum(r[4] for r in rows)
+    print(f"\nMean: {lin_total/len(rows):.2f} µs linear → {idx_total/len(rows):.2f} µs indexed "
+          f"({lin_total/idx_total:.1f}x)")
+    missing = set(load_sample_queries()) - {entry["question"] for entry in baseline["questions"]}
+    if missing:
+        print(f"{len(missing)} sample queries have no recorded baseline (re-run with --record): {sorted(missing)}")
+    if differ:
+        print(f"{len(differ)} routing decisions differ from {os.path.basename(ROUTE_BASELINE)}: {differ}")
+        sys.exit(1)
+    compared = "template code and results" if check_results else \
+        f"template code only — results need dataset {baseline['dataset']}"
+    print(f"All {len(rows)} routing decisions match the recorded if-chain baseline ({compared})")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# plan — questions answered by template / query plan / LLM, and plan accuracy
+# ─────────────────────────────────────────────────────────────────────────────
+# Metric × dimension × filter combinations no single template covers
+PLAN_QUESTIONS = [
+    "Fraud rate by network on weekends for P2M",
+    "Average amount of failed iOS transactions by bank, top 3",
+    "Failure rate for Android vs iOS between 9am and 5pm",
+    "Median amount by merchant category for transactions above ₹5,000",
+    "How many flagged transactions by state on weekends?",
+    "Success rate by hour for HDFC",
+    "Total amount by month for Recharge",
+    "Failure rate by bank and device for P2P",
+    "Which state has the lowest fraud rate?",
+    "Fraud rate weekends vs weekdays by age group",
+    "Bottom 5 banks by success rate",
+    "Number of 5G transactions at night",
+    "Failure rate of flagged transactions by network",
+    "Failure rate after 8pm for Bill Payment by network",
+    "Average spend of 18-25 on weekends by merchant",
+    "Top 3 merchant categories by total spend",
+    "What is the failure rate for Yes Bank on 4G?",
+    "Kotak failure rate on Sundays",
+    "Failure rate by city",                          # unknown dimension → LLM
+    "Why is the fraud rate high for P2M?",           # reasoning → LLM
+]
+
+PLAN_METRICS = {
+    "failure_rate":  lambda g, s: (s[g.index] == "FAILED").mean() * 100,
+    "success_rate":  lambda g, s: (s[g.index] == "SUCCESS").mean() * 100,
+    "fraud_rate":    lambda g, s: g["fraud_flag"].mean() * 100,
+    "amount_mean":   lambda g, s: g["amount_inr"].astype(float).mean(),
+    "amount_median": lambda g, s: g["amount_inr"].astype(float).median(),
+    "amount_sum":    lambda g, s: g["amount_inr"].astype(float).sum(),
+    "count":         lambda g, s: len(g),
+    "failed":        lambda g, s: (s[g.index] == "FAILED").sum(),
+    "fraud":         lambda g, s: g["fraud_flag"].sum(),
+}
+
+
+def reference_plan(plan, df):
+    """The plan's metric per group with plain boolean masks and groupby (sorted like the plan)."""
+    keep = pd.Series(True, index=df.index)
+    for col, values in plan.filters:
+        keep &= df[col].isin(values)
+    if plan.hours:
+        start, end = plan.hours
+        h = df["hour_of_day"]
+        keep &= ((h >= start) & (h < end)) if start < end else ((h >= start) | (h < end))
+    if plan.amount:
+        above, below = plan.amount
+        if above is not None:
+            keep &= df["amount_inr"] > above
+        if below is not None:
+            keep &= df["amount_inr"] < below
+    sub = df[keep]
+    status = sub["transaction_status"].astype(str)
+    fn = PLAN_METRICS[plan.metric]
+    if not plan.group_by:
+        return pd.Series([fn(sub, status)])
+    keys = [sub["timestamp"].dt.to_period("M").rename(MONTH) if d == MONTH else d for d in plan.group_by]
+    out = sub.groupby(keys, observed=True).apply(lambda g: fn(g, status))
+    if plan.order:
+        out = out.sort_values(ascending=plan.order == "asc", kind="stable")
+    return out.head(plan.top_n) if plan.top_n else out
+
+
+def bench_plan(args, calls=200):
+    df = load_dataset(args.rows).view()
+    parser = QueryParser(build_profile(df))
+    ctx = routed_context(df)
+    rows, wrong = [], []
+    before = after = 0
+    questions = PLAN_QUESTIONS + load_sample_queries()
+    for q in questions:
+        rule, code = app.match_route(q)
+        plan = parser.parse(q) if rule is None or code is not None else None
+        if plan is not None and code is not None and not plan.narrows():
+            plan = None
+        before += code is None
+        after += code is None and plan is None
+        was = "template" if code else "LLM"
+        if plan is None:
+            rows.append([q[:60], was, was, "", "", "", ""])
+            continue
+        parse_us = measure(lambda: [parser.parse(q) for _ in range(calls)], args.repeat)[0] * 1000 / calls
+        exec_ms, _ = measure(lambda: execute_plan(plan, df, cube=ctx["cube"], idx=ctx["idx"]), args.repeat)
+        got = execute_plan(plan, df, cube=ctx["cube"], idx=ctx["idx"]).iloc[:, -1].to_numpy(dtype=float)
+        ref = reference_plan(plan, df).to_numpy(dtype=float)
+        same = len(got) == len(ref) and np.allclose(np.sort(got), np.sort(ref), atol=0.01)
+        if not same:
+            wrong.append(q)
+        rows.append([q[:60], was, "plan", plan.describe()[:60], round(parse_us, 1), round(exec_ms, 3), same])
+    print_table(f"Who answers each question — {len(df):,} rows, median of {args.repeat}",
+                rows, ["Question", "before", "after", "Plan", "parse_us", "exec_ms", "same"])
+    print(f"\nLLM fallbacks: {before}/{len(questions)} with templates only → "
+          f"{after}/{len(questions)} with query plans")
+    if wrong:
+        print(f"{len(wrong)} plans disagree with the groupby reference: {wrong}")
+        sys.exit(1)
+    print("Every plan matches the groupby reference")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# compile — routed templates: exec of the source vs the compiled function
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_compile(args, calls=20):
+    df = load_dataset(args.rows).view()
+    ctx = {"df": df, "pd": pd, **routed_context(df)}
+    kwargs = {name: ctx.get(name) for name in app.ROUTE_ARGS}
+    rows, differ = [], []
+    for q in load_sample_queries():
+        code = app.route_query(q, df)
+        if not code:
+            continue
+        fn = app.compile_route(code)
+        exec_ms = measure(lambda: [exec(code, dict(ctx)) for _ in range(calls)], args.repeat)[0] / calls
+        call_ms = measure(lambda: [fn(**kwargs) for _ in range(calls)], args.repeat)[0] / calls
+        compile_ms = measure(lambda: compile(code, "<route>", "exec"), args.repeat)[0]
+        ns = dict(ctx)
+        exec(code, ns)
+        same = app.result_to_text(ns["result"]) == app.result_to_text(fn(**kwargs))
+        if not same:
+            differ.append(q)
+        rows.append([q[:60], round(compile_ms, 3), round(exec_ms, 3), round(call_ms, 3),
+                     round(exec_ms / call_ms, 1), same])
+    print_table(f"Routed templates: exec(source) vs compiled function (ms) — {len(df):,} rows, "
+                f"median of {args.repeat}",
+                rows, ["Question", "compile_ms", "exec_ms", "call_ms", "speedup", "same"])
+    exec_total = sum(r[2] for r in rows)
+    call_total = sum(r[3] for r in rows)
+    print(f"\nMean: {exec_total/len(rows):.3f} ms exec → {call_total/len(rows):.3f} ms call "
+          f"({exec_total/call_total:.1f}x) · compile_route cache: {app.compile_route.cache_info().currsize} functions")
+    if differ:
+        print(f"{len(differ)} results differ: {differ}")
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# multipart — sequential vs concurrent part pipelines (simulated LLM)
+# ─────────────────────────────────────────────────────────────────────────────
+MULTIPART_QUESTIONS = [
+    "Which bank has the highest failure rate?",                 # template
+    "Fraud rate by network on weekends for P2M",                # query plan
+    "What is the median amount per sender state for Recharge?", # LLM code
+]
+
+
+class SimulatedLLM:
+    """OpenAI-style client that answers after a fixed delay (code) or streams tokens (insights)."""
+
+    def __init__(self, latency_ms, tokens=60, token_ms=5):
+        self.latency_ms, self.tokens, self.token_ms = latency_ms, tokens, token_ms
+        self.chat = self
+        self.completions = self
+
+    def create(self, stream=False, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        if not stream:
+            code = "result = df.groupby('sender_state')['amount_inr'].median().round(2)"
+            return type("R", (), {"choices": [type("C", (), {"message": type("M", (), {"content": code})})]})
+        return self._stream()
+
+    def _stream(self):
+        for _ in range(self.tokens):
+            time.sleep(self.token_ms / 1000)
+            delta = type("D", (), {"content": "word "})
+            yield type("K", (), {"choices": [type("C", (), {"delta": delta})]})
+
+
+def bench_multipart(args):
+    if not os.path.exists(CSV_PATH):
+        sys.exit(f"multipart runs the app pipeline and needs {CSV_PATH}")
+    os.environ["INSIGHTX_LLM_CONCURRENCY"] = str(args.concurrency)
+    app.RENDER_ANSWERS = False   # every part streams an insight; `render` measures rendered answers
+    df = app.load_data()
+    summary = app.get_data_summary(app.get_profile())
+    llm = SimulatedLLM(args.llm_ms)
+    parts = MULTIPART_QUESTIONS
+    app.answer_parts(parts, df, summary, [], llm)   # warm caches (dataset, cube, index, result cache)
+
+    start = time.perf_counter()
+    sequential = []
+    for part in parts:
+        t = time.perf_counter()
+        app.answer_part(part, df, summary, [], llm)
+        sequential.append((time.perf_counter() - t) * 1000)
+    sequential_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    answers = app.answer_parts(parts, df, summary, [], llm)
+    concurrent_ms = (time.perf_counter() - start) * 1000
+
+    rows = [[p[:60], round(ms), round(a.timing.ttft_ms), a.result.ok] for p, ms, a in zip(parts, sequential, answers)]
+    print_table(f"Multi-part question, simulated LLM ({args.llm_ms} ms per call, "
+                f"{llm.tokens} tokens) — concurrency limit {args.concurrency}",
+                rows, ["Part", "alone_ms", "ttft_ms", "ok"])
+    print(f"\nSequential: {sequential_ms:,.0f} ms · concurrent: {concurrent_ms:,.0f} ms "
+          f"({sequential_ms/concurrent_ms:.1f}x) · slowest part alone: {max(sequential):,.0f} ms")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# llmcache — code generation and insights: uncached vs completion-cache hits
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_llmcache(args):
+    if not os.path.exists(CSV_PATH):
+        sys.exit(f"llmcache keys completions by the app's dataset and needs {CSV_PATH}")
+    df = app.load_data()
+    summary = app.get_data_summary(app.get_profile())
+    llm = SimulatedLLM(args.llm_ms)
+    questions = [q for q in load_sample_queries() if app.route_query(q, df) is None][:5]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CompletionCache(os.path.join(tmp, "llm_cache.sqlite"))
+        for q in questions:
+            timings = []
+            for _ in range(2):   # first call misses, second hits
+                t = time.perf_counter()
+                code = app.generate_pandas_code(q, summary, [], llm, cache=cache)
+                timings.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                app.generate_insight(q, app.ExecResult(text=code), [], llm, cache=cache)
+                timings.append((time.perf_counter() - t) * 1000)
+            rows.append([q[:60], round(timings[0]), round(timings[2], 2), round(timings[1]), round(timings[3], 2)])
+        stats = cache.stats()
+        size_kb = os.path.getsize(cache.path) / 1024
+    print_table(f"LLM calls (ms) — simulated model, {args.llm_ms} ms per call + {llm.tokens} streamed tokens",
+                rows, ["Question", "codegen_miss", "codegen_hit", "insight_miss", "insight_hit"])
+    print(f"\nHits {stats['hits']} / misses {stats['misses']} ({stats['hit_rate']*100:.0f}%) · "
+          f"{stats['saved_ms']/1000:.1f} s of generation saved · {stats['entries']} entries, "
+          f"{size_kb:.0f} KB on disk")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# render — routed answers: rendered from the result vs an insight call
+# ─────────────────────────────────────────────────────────────────────────────
+def quoted_numbers(text):
+    return {float(n.replace(",", "")) for n in re.findall(r"\d[\d,]*(?:\.\d+)?", text)}
+
+
+def bench_render(args, calls=100):
+    if not os.path.exists(CSV_PATH):
+        sys.exit(f"render runs the app pipeline and needs {CSV_PATH}")
+    df = app.load_data()
+    llm = SimulatedLLM(args.llm_ms, tokens=args.tokens, token_ms=args.token_ms)
+    questions = load_sample_queries()
+    rows, misquoted, local = [], [], 0
+    insight_ms = None
+    for q in questions:
+        answered = app.answer_without_llm(q, df)
+        if not answered:
+            continue
+        local += 1
+        code, res = answered
+        text = app.rendered_insight(q, res)
+        if text is None:
+            rows.append([q[:60], "plan" if code.startswith(app.PLAN_HEADER) else "template", "LLM", "", ""])
+            continue
+        render_ms = measure(lambda: [app.rendered_insight(q, res) for _ in range(calls)], args.repeat)[0] / calls
+        if insight_ms is None:   # the simulated call takes the same time for every question
+            t = time.perf_counter()
+            app.generate_insight(q, res, [], llm)
+            insight_ms = (time.perf_counter() - t) * 1000
+        # every number in the breakdown (value, count, total) must be in the result itself
+        breakdown = [line.rsplit(": ", 1)[-1] for line in text.split("\n") if line[:1] in "🥇🥈🥉•" or line[:1].isdigit()]
+        exact = all(quoted_numbers(part) <= quoted_numbers(res.text) for part in breakdown)
+        if not exact:
+            misquoted.append(q)
+        rows.append([q[:60], "plan" if code.startswith(app.PLAN_HEADER) else "template", "rendered",
+                     round(render_ms, 3), exact])
+    print_table(f"Routed / planned answers — insight text rendered vs simulated LLM "
+                f"({args.llm_ms} ms + {args.tokens} tokens × {args.token_ms} ms), median of {args.repeat}",
+                rows, ["Question", "data", "insight", "render_ms", "numbers_exact"])
+    done = [r for r in rows if r[2] == "rendered"]
+    if done:
+        mean_ms = sum(r[3] for r in done) / len(done)
+        print(f"\nRendered {len(done)}/{local} routed or planned answers ({len(questions)} sample questions) · "
+              f"{mean_ms:.2f} ms each vs {insight_ms:,.0f} ms for an insight call")
+    if misquoted:
+        print(f"{len(misquoted)} rendered answers quote numbers that are not in the result: {misquoted}")
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# context — conversation history per LLM call over a long session
+# ─────────────────────────────────────────────────────────────────────────────
+# A full TYPE A answer with its recommendations, as sessions store them
+VERBOSE_ANSWER = """📊 Interestingly, {top} leads on {q} at **5.06%** (1,581 failed of 31,250 transactions).
+
+📋 **Full breakdown**
+🥇 {top}: **5.06%** (1,581 failed of 31,250)
+🥈 Axis: **5.03%** (1,574 failed of 31,266)
+🥉 Yes Bank: **5.00%** (1,563 failed of 31,267)
+• HDFC: **5.00%** (1,558 failed of 31,183)
+• IndusInd: **4.85%** (1,513 failed of 31,165)
+• SBI: **4.84%** (1,514 failed of 31,269)
+• PNB: **4.83%** (1,522 failed of 31,542)
+• ICICI: **4.76%** (1,478 failed of 31,058)
+
+🔍 Computed as failed ÷ total transactions per group across all 250,000 transactions.
+
+💼 The spread between the best and worst group is 0.30 percentage points, small in absolute terms but
+worth roughly 900 failed payments a year at current volumes; the leader is the natural first target.
+
+💡 Follow-up: how does this change on weekends?
+
+**🎯 Recommended Actions**
+💡 **Retry logic** — Add automatic retries with exponential backoff for transient gateway failures.
+💡 **Bank SLAs** — Review uptime commitments with the worst-performing partner banks every quarter.
+💡 **Monitoring** — Alert operations when any group's failure rate moves 0.5 points above its baseline."""
+
+
+def legacy_history(messages):
+    """History as code generation and insights sent it before conversation.py."""
+    return messages[-4:]
+
+
+def legacy_recap(messages):
+    """The old "summarise everything" text: last 20 messages, cut at 80 / 200 characters."""
+    pairs, msgs = [], messages[-20:]
+    for i in range(0, len(msgs) - 1, 2):
+        if msgs[i]["role"] == "user" and msgs[i + 1]["role"] == "assistant":
+            pairs.append(f"Q: {msgs[i]['content'][:80]}\nA: {msgs[i + 1]['content'][:200].replace(chr(10), ' ')}...")
+    return "\n---\n".join(pairs)
+
+
+def bench_context(args):
+    questions = load_sample_queries()
+    tokens = lambda messages: sum(app.estimate_tokens(m["content"]) for m in messages)
+    messages, context, rows = [], ConversationContext(), []
+    for turn in range(args.turns):
+        q = questions[turn % len(questions)]
+        context.sync(messages)
+        history = context.messages(app.CONTEXT_TOKENS)
+        if turn + 1 in (1, 2, 5, 10, 20, 40, 80, args.turns):
+            recap = context.recap(app.RECAP_TOKENS)
+            rows.append([turn + 1, tokens(legacy_history(messages)), tokens(history),
+                         app.estimate_tokens(legacy_recap(messages) or "x"), app.estimate_tokens(recap or "x"),
+                         len(context.topics)])
+        banks = ["Kotak", "Axis", "SBI", "HDFC"]
+        messages += [{"role": "user", "content": q},
+                     {"role": "assistant", "content": VERBOSE_ANSWER.format(q=q.lower().rstrip("?"), top=banks[turn % 4])}]
+    print_table(f"History per LLM call over a {args.turns}-turn session (≈ tokens; budget {app.CONTEXT_TOKENS}, "
+                f"recap budget {app.RECAP_TOKENS})",
+                rows, ["turn", "legacy_history", "history", "legacy_recap", "recap", "topics_in_recap"])
+    worst = max(r[2] for r in rows)
+    print(f"\nLargest history: ≈{max(r[1] for r in rows):,} tokens (last 4 messages verbatim) → ≈{worst:,} "
+          f"(turn records + rolling summary)")
+    if worst > app.CONTEXT_TOKENS:
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# serialize — result text for insight prompts: to_string / indented JSON vs serialize_result
+# ─────────────────────────────────────────────────────────────────────────────
+def legacy_text(value):
+    """Result text as insight prompts got it before serializer.py."""
+    if isinstance(value, pd.DataFrame):
+        return value.to_string()
+    if isinstance(value, dict):
+        return json.dumps(value, indent=2, default=str)
+    return str(value)
+
+
+# Results generated code can return, far larger than any template's
+LARGE_RESULTS = {
+    "fraud-flagged rows (df[df.fraud_flag == 1])": lambda df: df[df["fraud_flag"] == 1],
+    "failure rate by state × bank × type": lambda df: (
+        group_stats(df, ["sender_state", "sender_bank", "transaction_type"])
+        .sort_values("failure_rate", ascending=False).reset_index()),
+    "amount per transaction id, 20,000 rows (dict)": lambda df: dict(
+        zip(df["transaction_id"].iloc[:20000].astype(str), df["amount_inr"].iloc[:20000])),
+}
+
+
+def bench_serialize(args, calls=20):
+    df = load_dataset(args.rows).view()
+    context = {**routed_context(df), "execute_plan": execute_plan, "QueryPlan": app.QueryPlan}
+    results = []
+    for q in load_sample_queries():
+        code = app.route_query(q, df)
+        if code:
+            res = app.execute_code(code, df, context=context, trusted=True)
+            if res.ok:
+                results.append((q[:60], res.value))
+    results += [(name, build(df)) for name, build in LARGE_RESULTS.items()]
+
+    rows, before, after = [], 0, 0
+    for name, value in results:
+        old = app.estimate_tokens(legacy_text(value))
+        new = app.estimate_tokens(app.result_to_text(value))
+        ser_ms = measure(lambda: [app.result_to_text(value) for _ in range(calls)], args.repeat)[0] / calls
+        before, after = before + old, after + new
+        rows.append([name, old, new, round(ser_ms, 3),
+                     round(old / args.prefill_tps * 1000), round(new / args.prefill_tps * 1000)])
+    print_table(f"Result text in insight prompts (≈ tokens, budget {app.RESULT_TOKENS}; "
+                f"prefill at {args.prefill_tps} tokens/s), median of {args.repeat}",
+                rows, ["Result", "legacy_tokens", "tokens", "serialize_ms", "legacy_prefill_ms", "prefill_ms"])
+    print(f"\n{len(results)} results: ≈{before:,} → ≈{after:,} prompt tokens ({after / before - 1:+.0%}); "
+          f"largest now ≈{max(r[2] for r in rows):,} tokens")
+    if max(r[2] for r in rows) > app.RESULT_TOKENS * 1.1:
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# prompt — code-generation prompt size and the prefix shared between calls
+# ─────────────────────────────────────────────────────────────────────────────
+class CapturingLLM:
+    """OpenAI-style client that records each request and answers with trivial code."""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        return type("R", (), {"choices": [type("C", (), {"message": type("M", (), {"content": "result = 1"})})]})
+
+
+def full_summary(profile):
+    """The dataset summary as the prompt used to carry it: every value list, ASCII-escaped JSON."""
+    cols = profile["columns"]
+    return json.dumps({
+        "total_transactions": profile["rows"], "columns": list(cols),
+        "date_range": " to ".join(profile["date_range"]),
+        "transaction_types": cols["transaction_type"]["counts"],
+        "overall_success_rate": f"{profile['success_rate']:.1f}%",
+        "overall_failure_rate": f"{profile['failure_rate']:.1f}%",
+        "avg_amount_inr": f"₹{profile['avg_amount']:.2f}", "fraud_flag_rate": f"{profile['fraud_rate']:.2f}%",
+        **{key: cols[col]["values"] for key, col in [
+            ("merchant_categories", "merchant_category"), ("sender_states", "sender_state"),
+            ("banks", "sender_bank"), ("age_groups", "sender_age_group"),
+            ("device_types", "device_type"), ("network_types", "network_type")]},
+    }, default=str)
+
+
+def flatten(messages):
+    return "".join(f"<{m['role']}>{m['content']}" for m in messages)
+
+
+def bench_prompt(args, calls=1000):
+    df = load_dataset(args.rows).view()
+    profile = build_profile(df)
+    summary = app.get_data_summary(profile)
+    llm = CapturingLLM()
+    context, rows = ConversationContext(), []
+    questions = [q for q in load_sample_queries() if app.route_query(q, df) is None]
+    for turn, q in enumerate(questions):
+        usage = app.PromptUsage()
+        app.generate_pandas_code(q, summary, context.messages(app.CONTEXT_TOKENS), llm, usage=usage)
+        messages = llm.requests[-1]["messages"]
+        shared = 0
+        if len(llm.requests) > 1:
+            prev, cur = flatten(llm.requests[-2]["messages"]), flatten(messages)
+            shared = len(os.path.commonprefix([prev, cur]))
+        rows.append([q[:60], usage.prompt_tokens, usage.prefix_tokens,
+                     app.estimate_tokens("x" * shared) if shared else 0, usage.patterns, turn])
+        context.add(q, f"📊 Answer to: {q}")
+    print_table("Code-generation prompts over a simulated conversation (≈ tokens, 4 characters each)",
+                rows, ["Question", "prompt", "static_prefix", "shared_with_prev", "patterns", "turns_before"])
+
+    build_us = measure(lambda: [app.codegen_system_prompt.__wrapped__(summary) for _ in range(calls)],
+                       args.repeat)[0] * 1000 / calls
+    cached_us = measure(lambda: [app.codegen_system_prompt(summary) for _ in range(calls)],
+                        args.repeat)[0] * 1000 / calls
+    identical = len({r["messages"][0]["content"] for r in llm.requests}) == 1
+    system_prompt = app.codegen_system_prompt(summary, all_patterns=app.FEWSHOT_K <= 0)
+    print(f"\nDataset summary: ≈{app.estimate_tokens(full_summary(profile))} → ≈{app.estimate_tokens(summary)} tokens · "
+          f"system prompt ≈{app.estimate_tokens(system_prompt)} tokens, "
+          f"byte-identical across all {len(llm.requests)} calls: {identical}")
+    mean = {}
+    for k in (0, app.FEWSHOT_K):
+        usages = [app.PromptUsage() for _ in questions]
+        for q, usage in zip(questions, usages):
+            app.generate_pandas_code(q, summary, [], llm, usage=usage, k=k)
+        mean[k] = statistics.mean(u.prompt_tokens for u in usages)
+    print(f"Few-shot examples (no history): all {len(app.PATTERN_INDEX)} ≈{mean[0]:.0f} tokens/call → "
+          f"top {app.FEWSHOT_K} retrieved ≈{mean[app.FEWSHOT_K]:.0f} tokens/call")
+    print(f"System prompt assembly: {build_us:.2f} µs built → {cached_us:.2f} µs cached")
+    if not identical:
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Main
+# ─────────────────────────────────────────────────────────────────────────────
+# ─────────────────────────────────────────────────────────────────────────────
+# resilience — a struggling model: bare client vs ResilientClient
+# ─────────────────────────────────────────────────────────────────────────────
+class StrugglingLLM(SimulatedLLM):
+    """SimulatedLLM that stalls for stall_ms or fails to connect; honours a `timeout` kwarg like OpenAI's."""
+
+    def __init__(self, latency_ms, stall_ms=0, fail_rate=0.0, seed=7):
+        super().__init__(latency_ms, tokens=5, token_ms=1)
+        self.stall_ms, self.fail_rate = stall_ms, fail_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def create(self, stream=False, timeout=None, **kwargs):
+        self.requests += 1
+        if self.random.random() < self.fail_rate:
+            raise APIConnectionError(request=None)
+        if self.stall_ms:
+            stall_s = self.stall_ms / 1000
+            time.sleep(stall_s if timeout is None else min(stall_s, timeout))
+            if timeout is not None and timeout < stall_s:
+                raise APITimeoutError(request=None)
+        return super().create(stream=stream, **kwargs)
+
+
+def call_times(client, calls):
+    """(ms per call, answered, failed) for `calls` code-generation sized requests."""
+    times, answered = [], 0
+    for _ in range(calls):
+        t = time.perf_counter()
+        try:
+            client.chat.completions.create(model="local-model", messages=[{"role": "user", "content": "q"}])
+            answered += 1
+        except (LLMUnavailable, APIConnectionError):
+            pass
+        times.append((time.perf_counter() - t) * 1000)
+    return times, answered, calls - answered
+
+
+def bench_resilience(args):
+    def resilient(llm):
+        return ResilientClient(llm, timeout_s=args.timeout_ms / 1000, deadline_s=args.deadline_ms / 1000,
+                               retries=2, backoff_s=0.05, failures=3, cooldown_s=600)
+
+    scenarios = [
+        ("healthy", dict(latency_ms=50)),
+        ("30% connection errors", dict(latency_ms=50, fail_rate=0.3)),
+        (f"stalls {args.stall_ms / 1000:.0f} s", dict(latency_ms=50, stall_ms=args.stall_ms)),
+        ("down", dict(latency_ms=50, fail_rate=1.0)),
+    ]
+    rows = []
+    for name, kwargs in scenarios:
+        # A stalled bare client takes the whole stall per call, so it gets two calls, not --calls
+        for label, calls, wrap in (("bare", 2 if "stall_ms" in kwargs else args.calls, lambda llm: llm),
+                                   ("resilient", args.calls, resilient)):
+            llm = StrugglingLLM(**kwargs)
+            client = wrap(llm)
+            times, answered, failed = call_times(client, calls)
+            state = client.health()["state"] if label == "resilient" else ""
+            rows.append([name, label, calls, answered, failed, round(statistics.median(times)),
+                         round(max(times)), llm.requests, state])
+    print_table(f"LLM calls against a struggling server — timeout {args.timeout_ms} ms, deadline "
+                f"{args.deadline_ms} ms, 2 retries, breaker opens after 3 failed calls",
+                rows, ["server", "client", "calls", "answered", "failed", "p50_ms", "max_ms", "requests", "breaker"])
+    bounded = max(r[6] for r in rows if r[1] == "resilient")
+    print(f"\nSlowest resilient call: {bounded:,} ms (deadline {args.deadline_ms} ms) · slowest bare call: "
+          f"{max(r[6] for r in rows if r[1] == 'bare'):,} ms")
+
+    if not os.path.exists(CSV_PATH):
+        print(f"\n(degraded answers need {CSV_PATH} — skipped)")
+        return
+    app.RENDER_ANSWERS = False   # every routed answer would need the insight call
+    df = app.load_data()
+    summary = app.get_data_summary(app.get_profile())
+    questions = [q for q in load_sample_queries() if app.answer_without_llm(q, df)][:args.calls]
+    client = resilient(StrugglingLLM(50, fail_rate=1.0))
+    rows = []
+    for q in questions:
+        t = time.perf_counter()
+        answer = app.answer_part(q, df, summary, [], client)
+        rows.append([q[:60], round((time.perf_counter() - t) * 1000, 1), client.health()["state"],
+                     answer.insight.split("\n")[0][:50]])
+    print_table("Routed questions while the model is down — degraded answers", rows,
+                ["Question", "ms", "breaker", "answer"])
+    if not all(r[3] for r in rows):
+        sys.exit(1)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# stub — the whole pipeline over HTTP against the offline stub server
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_stub(args):
+    if not os.path.exists(CSV_PATH):
+        sys.exit(f"stub runs the app pipeline and needs {CSV_PATH}")
+    df = app.load_data()
+    summary = app.get_data_summary(app.get_profile())
+    questions = load_sample_queries()[:args.questions]
+    config = StubConfig(latency_ms=args.latency_ms, tps=args.tps, fail_rate=args.fail_rate)
+    rows, ours = [], []
+    server = StubServer(config)
+    with tempfile.TemporaryDirectory() as tmp, server as url:
+        cache = CompletionCache(os.path.join(tmp, "llm_cache.sqlite"))
+        app.get_llm_cache = lambda: cache   # keep stub completions out of the real cache
+        client = app.get_client(url)
+        for q in questions:
+            since = len(server.log)
+            t = time.perf_counter()
+            try:
+                answer = app.answer_part(q, df, summary, [], client)
+                path, ok = "LLM" if answer.usage else "local", answer.result.ok
+            except LLMUnavailable:
+                path, ok = "LLM", "unavailable"
+            wall_ms = (time.perf_counter() - t) * 1000
+            model_ms = server.model_ms(since)
+            calls = len(server.log) - since
+            if calls:
+                ours.append(wall_ms - model_ms)
+            rows.append([q[:60], path, calls, round(wall_ms, 1), round(model_ms, 1), round(wall_ms - model_ms, 1), ok])
+        health = client.health()
+    print_table(f"Pipeline over HTTP against the stub — {args.latency_ms:.0f} ms to first token, {args.tps:g} tokens/s, "
+                f"{args.fail_rate:.0%} injected failures", rows,
+                ["Question", "code", "requests", "wall_ms", "model_ms", "ours_ms", "ok"])
+    print(f"\n{len(ours)} questions called the stub · our own time per question (wall − model): "
+          f"median {statistics.median(ours) if ours else 0:,.1f} ms, max {max(ours, default=0):,.1f} ms · "
+          f"client: {health['retries']} retries, {health['failures']} failed calls, breaker {health['state']}")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# trace — per-stage latency of sample questions, and what tracing costs
+# ─────────────────────────────────────────────────────────────────────────────
+def traced_pipeline(name, questions, config):
+    """Trace each question through the app pipeline against the stub server; returns (df, root spans)."""
+    if not os.path.exists(CSV_PATH):
+        sys.exit(f"{name} runs the app pipeline and needs {CSV_PATH}")
+    df = app.load_data()
+    summary = app.get_data_summary(app.get_profile())
+    roots = []
+    with tempfile.TemporaryDirectory() as tmp, StubServer(config) as url:
+        cache = CompletionCache(os.path.join(tmp, "llm_cache.sqlite"))
+        app.get_llm_cache = lambda: cache
+        client = app.get_client(url)
+        for q in questions:
+            with trace("question", question=q) as root:
+                app.detect_ambiguity(q)
+                expanded = app.expand_query(q, [])
+                root.set(question_type=app.question_type(expanded))
+                for part in app.split_multipart(expanded):
+                    answer = app.answer_part(part, df, summary, [], client)
+                    app.get_recommendations(q, answer.result)
+            roots.append(root)
+    return df, roots
+
+
+def bench_trace(args, calls=50):
+    questions = load_sample_queries()[:args.questions]
+    df, roots = traced_pipeline("trace", questions, StubConfig(latency_ms=200, tps=40))
+    print_table(f"Stages over {len(roots)} sample questions (stub model: 200 ms to first token, 40 tokens/s)",
+                [list(r.values()) for r in stage_summary(roots)], ["Stage", "calls", "median_ms", "total_ms", "self_ms"])
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(to_chrome(roots), f)
+        print(f"\nChrome trace of all {len(roots)} questions: {args.out} (chrome://tracing, ui.perfetto.dev)")
+
+    # Cost of tracing on the fastest path: routed questions answered from the result cache
+    routed = [q for q in questions if app.answer_without_llm(q, df)]
+
+    def untraced():
+        for q in routed:
+            app.answer_without_llm(q, df)
+
+    def traced_run():
+        for q in routed:
+            with trace("question"):
+                app.answer_without_llm(q, df)
+
+    plain = measure(lambda: [untraced() for _ in range(calls)], args.repeat)[0] / calls / len(routed) * 1000
+    spans = measure(lambda: [traced_run() for _ in range(calls)], args.repeat)[0] / calls / len(routed) * 1000
+    print(f"\nTracing overhead on {len(routed)} cached routed questions: {plain:,.1f} µs → {spans:,.1f} µs per question "
+          f"(+{spans - plain:,.1f} µs)")
+
+
+def bench_metrics(args):
+    questions = load_sample_queries()[:args.questions]
+    _, roots = traced_pipeline("metrics", questions, StubConfig(latency_ms=args.latency_ms, tps=args.tps))
+    for root in roots:
+        observe_trace(root)
+
+    routes = sorted(ROUTES.samples().items(), key=lambda kv: -kv[1])
+    print_table(f"Router rules over {len(roots)} sample questions (parts)", [[r, p, n] for (r, p), n in routes],
+                ["route", "path", "parts"])
+    parts = sum(n for _, n in routes)
+    fallback = sum(n for (_, path), n in routes if path == "llm") / parts if parts else 0.0
+    rows = []
+    for question_type, path in sorted({k[:2] for k in QUESTIONS.samples()}):
+        count = sum(n for k, n in QUESTIONS.samples().items() if k[:2] == (question_type, path))
+        p95 = QUESTION_SECONDS.quantile(0.95, question_type=question_type, path=path)
+        rows.append([question_type, path, count, f"≤ {p95 * 1000:,.0f}"])
+    print_table(f"Questions by type and path (stub model: {args.latency_ms:.0f} ms to first token, {args.tps:.0f} tokens/s)",
+                rows, ["question_type", "path", "questions", "p95_ms"])
+    p95 = QUESTION_SECONDS.quantile(0.95) * 1000
+    print(f"\nLLM fallback rate: {fallback:.1%} of {parts} parts   p95 question latency: ≤ {p95:,.0f} ms")
+
+    if args.out:
+        write_file(REGISTRY, args.out)
+        print(f"Prometheus exposition: {args.out}")
+    regressions = []
+    if args.max_fallback is not None and fallback > args.max_fallback:
+        regressions.append(f"fallback rate {fallback:.1%} > {args.max_fallback:.1%}")
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        regressions.append(f"p95 ≤ {p95:,.0f} ms > {args.max_p95_ms:,.0f} ms")
+    if regressions:
+        sys.exit("REGRESSION: " + "; ".join(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="InsightX performance benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("dtypes", help="generated-code idioms on the compact frame vs the parsed CSV (exits 1 on a difference)")
+    p.add_argument("--rows", type=int, default=None)
+
+    p = sub.add_parser("sandbox", help="execute_code: deep copy vs copy-on-write view")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--worker", choices=["copy", "view"], help=argparse.SUPPRESS)
+
+    p = sub.add_parser("resultcache", help="ResultCache miss vs hit latency")
+    p.add_argument("--rows", type=int, default=None)
+
+    p = sub.add_parser("cube", help="groupby scans vs pre-aggregated cube")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("kernel", help="router templates: groupby scans vs group_stats")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("index", help="filter masks: string comparisons vs predicate bitmaps")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("router", help="route_query: keyword-indexed dispatch vs every rule in order")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--record", action="store_true", help="rewrite docs/route_baseline.json from the current router")
+
+    p = sub.add_parser("plan", help="questions answered by template / query plan / LLM")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("compile", help="routed templates: exec of the source vs compiled function")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("multipart", help="multi-part question: sequential vs concurrent parts (simulated LLM)")
+    p.add_argument("--llm-ms", type=int, default=400)
+    p.add_argument("--concurrency", type=int, default=3)
+
+    p = sub.add_parser("llmcache", help="LLM completion cache: miss vs hit (simulated LLM)")
+    p.add_argument("--llm-ms", type=int, default=400)
+
+    p = sub.add_parser("prompt", help="code-generation prompts: size, static prefix, prefix shared between calls")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("render", help="routed answers: rendered from the result vs an insight call (simulated LLM)")
+    p.add_argument("--llm-ms", type=int, default=400)
+    p.add_argument("--tokens", type=int, default=300)
+    p.add_argument("--token-ms", type=int, default=20)
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("context", help="conversation history per LLM call: last 4 messages vs turn records + summary")
+    p.add_argument("--turns", type=int, default=40)
+
+    p = sub.add_parser("serialize", help="result text in insight prompts: to_string / JSON vs serialize_result")
+    p.add_argument("--rows", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--prefill-tps", type=int, default=500)
+
+    p = sub.add_parser("resilience", help="LLM calls against a slow / failing server: bare vs resilient client")
+    p.add_argument("--calls", type=int, default=8)
+    p.add_argument("--timeout-ms", type=int, default=500)
+    p.add_argument("--deadline-ms", type=int, default=1500)
+    p.add_argument("--stall-ms", type=int, default=3000)
+
+    p = sub.add_parser("stub", help="whole pipeline over HTTP against the offline stub server (model time subtracted)")
+    p.add_argument("--latency-ms", type=float, default=200.0)
+    p.add_argument("--tps", type=float, default=40.0)
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    p.add_argument("--questions", type=int, default=20)
+
+    p = sub.add_parser("trace", help="per-stage latency of sample questions (stub model) and tracing overhead")
+    p.add_argument("--questions", type=int, default=25)
+    p.add_argument("--out", default=None, help="write the traces as Chrome trace JSON")
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("metrics", help="router hit / LLM fallback rate and p95 latency (stub model), as Prometheus metrics")
+    p.add_argument("--questions", type=int, default=25)
+    p.add_argument("--latency-ms", type=float, default=200)
+    p.add_argument("--tps", type=float, default=40)
+    p.add_argument("--max-fallback", type=float, default=None, help="exit 1 if the LLM fallback rate is higher")
+    p.add_argument("--max-p95-ms", type=float, default=None, help="exit 1 if the p95 question latency is higher")
+    p.add_argument("--out", default=None, help="write the Prometheus exposition to this file")
+
+    args = parser.parse_args()
+    if args.bench == "sandbox":
+        if args.worker:
+            print(json.dumps(_sandbox_worker(args.worker, args.rows, args.repeat)))
+        else:
+            bench_sandbox(args)
+    elif args.bench == "resultcache":
+        bench_resultcache(args)
+    elif args.bench == "cube":
+        bench_cube(args)
+    elif args.bench == "kernel":
+        bench_kernel(args)
+    elif args.bench == "index":
+        bench_index(args)
+    elif args.bench == "router":
+        bench_router(args)
+    elif args.bench == "plan":
+        bench_plan(args)
+    elif args.bench == "compile":
+        bench_compile(args)
+    elif args.bench == "multipart":
+        bench_multipart(args)
+    elif args.bench == "llmcache":
+        bench_llmcache(args)
+    elif args.bench == "render":
+        bench_render(args)
+    elif args.bench == "prompt":
+        bench_prompt(args)
+    elif args.bench == "context":
+        bench_context(args)
+    elif args.bench == "serialize":
+        bench_serialize(args)
+    elif args.bench == "resilience":
+        bench_resilience(args)
+    elif args.bench == "stub":
+        bench_stub(args)
+    elif args.bench == "trace":
+        bench_trace(args)
+    elif args.bench == "metrics":
+        bench_metrics(args)
+    elif args.bench == "dtypes":
+        bench_dtypes(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+InsightX – bounded conversation context
+========================================
+Code generation and insight calls used to carry the last four chat messages
+verbatim.  Assistant messages are whole multi-paragraph answers with a
+"Recommended Actions" block, so every call paid for the previous answers'
+verbosity, and the "summarise everything" path re-sliced the last twenty
+messages and cut them at a character count.
+
+`ConversationContext` keeps one small `Turn` record per question — the
+question, the dimension and metric it was about, the answer's first sentence
+and the key figures of its breakdown — and folds turns that leave the recent
+window into a rolling summary, updated incrementally: one line per topic
+(metric × dimension), a newer turn on the same topic replacing the older
+line, oldest topics dropped when the summary outgrows its budget.
+
+`messages(max_tokens)` is the history for one LLM call: the summary, then
+the recent turns as compact user / assistant pairs, newest kept first, never
+more than max_tokens.  `recap(max_tokens)` gives the latest question and
+answer on every topic for summary questions, within its own budget.  Prompt
+size therefore stays flat however long the session or the answers get.
+"""
+
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from queryplan import DIMENSION_LABELS, DIMENSION_PATTERNS, METRIC_PATTERNS
+from serializer import estimate_tokens
+
+# queryplan metric → how it reads in a record
+METRIC_NAMES = {
+    "failure_rate": "failure rate", "success_rate": "success rate", "fraud_rate": "fraud rate",
+    "amount_median": "median amount", "amount_mean": "average amount", "amount_sum": "total amount",
+    "failed": "failed transactions", "fraud": "flagged transactions", "count": "transactions",
+}
+
+# Breakdown lines of an answer: "🥇 Kotak: **5.06%** (1,581 failed of 31,250)"
+FIGURE = re.compile(r"^\s*(?:🥇|🥈|🥉|•|-|\d+\.)\s*\**([^:*\n]{1,40}?)\**\s*:\s*\**(₹?[\d,]+(?:\.\d+)?%?)")
+MAX_FIGURES = 3
+MAX_SENTENCE = 200   # characters of the answer kept in a record
+MAX_TOPICS = 50      # topics remembered for recap()
+
+
+def _first_sentence(answer):
+    for line in answer.splitlines():
+        text = re.sub(r"[*_#`>]", "", line).strip()
+        text = re.sub(r"^[^\w₹(]+", "", text)   # leading emoji / bullets
+        if text:
+            text = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+            return text if len(text) <= MAX_SENTENCE else text[:MAX_SENTENCE - 1] + "…"
+    return ""
+
+
+@dataclass
+class Turn:
+    """What one question and its answer leave behind for later calls."""
+    question: str
+    dimension: str = None                          # "Bank" (DIMENSION_LABELS)
+    metric: str = None                             # "failure rate"
+    answer: str = ""                               # the answer's first sentence
+    figures: list = field(default_factory=list)    # ["Kotak 5.06%", "Axis 5.03%"]
+
+    @classmethod
+    def record(cls, question, answer):
+        q = question.lower()
+        dimension = next((DIMENSION_LABELS.get(col, col) for col, pattern in DIMENSION_PATTERNS
+                          if re.search(pattern, q)), None)
+        metric = next((METRIC_NAMES[name] for name, pattern in METRIC_PATTERNS if re.search(pattern, q)), None)
+        figures = []
+        for line in answer.split("Recommended Actions")[0].splitlines():
+            match = FIGURE.match(line)
+            if match and len(figures) < MAX_FIGURES:
+                figures.append(f"{match.group(1).strip()} {match.group(2)}")
+        return cls(question.strip(), dimension, metric, _first_sentence(answer), figures)
+
+    @property
+    def topic(self):
+        if self.metric and self.dimension:
+            return f"{self.metric} by {self.dimension}"
+        return self.metric or self.dimension or self.question[:60]
+
+    def text(self):
+        """The answer as later calls see it."""
+        figures = f" [{', '.join(self.figures)}]" if self.figures else ""
+        return f"{self.answer}{figures}"
+
+
+class ConversationContext:
+    """Turn records plus a rolling summary; history for LLM calls within a token budget."""
+
+    def __init__(self, recent=3, summary_tokens=150):
+        self.recent = recent
+        self.summary_tokens = summary_tokens
+        self.turns = []                 # the recent window, oldest first
+        self.seen = 0                   # messages of the chat already recorded (sync)
+        self._topics = OrderedDict()    # topic → summary line of folded turns, oldest first
+        self._latest = OrderedDict()    # topic → its latest Turn, for recap()
+
+    @classmethod
+    def from_messages(cls, messages, **kwargs):
+        context = cls(**kwargs)
+        context.sync(messages)
+        return context
+
+    def add(self, question, answer):
+        turn = Turn.record(question, answer)
+        self.turns.append(turn)
+        self._latest.pop(turn.topic, None)
+        self._latest[turn.topic] = turn
+        if len(self._latest) > MAX_TOPICS:
+            self._latest.popitem(last=False)
+        if len(self.turns) > self.recent:
+            self._fold(self.turns.pop(0))
+
+    def sync(self, messages):
+        """Record the user → assistant pairs of the chat added since the last sync."""
+        i = self.seen
+        while i + 1 < len(messages):
+            if messages[i]["role"] == "user" and messages[i + 1]["role"] == "assistant":
+                self.add(messages[i]["content"], messages[i + 1]["content"])
+                i += 2
+            else:
+                i += 1
+        self.seen = i
+        return self
+
+    def _fold(self, turn):
+        """Move a turn that left the recent window into the summary."""
+        self._topics.pop(turn.topic, None)
+        self._topics[turn.topic] = f"{turn.topic}: {turn.text()}"
+        while len(self._topics) > 1 and estimate_tokens(self.summary) > self.summary_tokens:
+            self._topics.popitem(last=False)
+
+    @property
+    def topics(self):
+        """Topics recap() can still report, oldest first."""
+        return list(self._latest)
+
+    @property
+    def summary(self):
+        return "; ".join(self._topics.values())
+
+    def messages(self, max_tokens):
+        """History messages for one LLM call, at most max_tokens (estimated)."""
+        pairs, used = [], 0
+        for turn in reversed(self.turns):
+            pair = [{"role": "user", "content": turn.question}, {"role": "assistant", "content": turn.text()}]
+            cost = sum(estimate_tokens(m["content"]) for m in pair)
+            if used + cost > max_tokens:
+                break
+            pairs[:0] = pair
+            used += cost
+        summary = self.summary
+        if summary and pairs and used + estimate_tokens(summary) + 5 <= max_tokens:
+            pairs[0] = {"role": "user", "content": f"(Earlier in this conversation: {summary})\n\n{pairs[0]['content']}"}
+        return pairs
+
+    def recap(self, max_tokens):
+        """The latest question and answer on every topic, oldest topics dropped to stay within max_tokens."""
+        lines = [f"Q: {t.question}\nA: {t.text()}" for t in self._latest.values()]
+        while len(lines) > 1 and estimate_tokens("\n---\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n---\n".join(lines)
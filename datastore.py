@@ -0,0 +1,381 @@
+"""
+InsightX – dataset loading with an on-disk columnar cache
+==========================================================
+The first start parses `upi_transactions_2024.csv`, normalises the column
+names and writes the typed frame to an uncompressed Arrow IPC file.  Later
+starts memory-map that file instead of re-parsing text, so numeric columns
+come back zero-copy and the dimension columns arrive already
+dictionary-encoded as pandas categoricals.
+
+The cache is keyed on the CSV's size, mtime and SHA-256.  Size + mtime is
+the fast path; the content hash is only recomputed when those change, so a
+`touch` on an unchanged file does not force a rebuild.
+
+Before caching, the frame goes through a compaction stage: dimensions become
+categoricals, 0/1 flags and the hour shrink to int8, `transaction_id` moves
+to Arrow-backed strings and `amount_inr` can be stored as float32.  The
+per-column byte savings are written to the cache's meta file.
+
+`open_dataset()` wraps the frame in a `SharedDataset`: one immutable copy
+per server process that hands out shallow, copy-on-write views, so sessions,
+the router and the executor never duplicate row data.  LLM-generated code
+runs on the same compact frame; `plain_columns()` undoes the compaction for
+just the columns a piece of code names, on its own view (see execute_code).
+
+`dataset_profile()` summarises the frame once per fingerprint — row count,
+date range, distinct values per column and the headline rates — and keeps
+the result as JSON next to the cache, so the LLM summary, the sidebar and
+the answer panels never scan rows to show them.
+
+Used by both app.py and test_accuracy.py.
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # no pyarrow → plain CSV parsing on every start
+    pa = None
+
+# Views handed out by SharedDataset rely on copy-on-write so that writes never
+# reach the shared frame (always on from pandas 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+CSV_PATH      = "upi_transactions_2024.csv"
+CACHE_DIR     = ".insightx_cache"
+CACHE_VERSION = 2
+
+# Storage precision for amount_inr: "" keeps the parsed dtype (float64/int64),
+# "float32" halves the column at ~7 significant digits
+AMOUNT_DTYPE = os.environ.get("INSIGHTX_AMOUNT_DTYPE", "")
+
+# Low-cardinality columns stored as categoricals (Arrow dictionary arrays)
+DIMENSION_COLUMNS = [
+    "transaction_type", "merchant_category", "transaction_status",
+    "sender_age_group", "receiver_age_group", "sender_state",
+    "sender_bank", "receiver_bank", "device_type", "network_type",
+    "day_of_week",
+]
+
+# Small integer columns that fit int8 (0/1 flags, hour 0-23)
+SMALL_INT_COLUMNS = ["fraud_flag", "is_weekend", "hour_of_day"]
+
+# Any other text column with at most this many distinct values is also encoded
+CATEGORY_MAX_UNIQUE = 1000
+
+# Dataset profile: bump when its fields change; columns with at most
+# PROFILE_MAX_VALUES distinct values also get their value list and counts
+PROFILE_VERSION    = 1
+PROFILE_MAX_VALUES = 50
+
+
+# ── Parsing & normalisation ───────────────────────────────────────────────────
+def normalise_columns(df):
+    """Strip, lowercase, spaces→underscore, remove brackets; unify amount column."""
+    df.columns = (
+        df.columns
+        .str.strip()
+        .str.lower()
+        .str.replace(" ", "_", regex=False)
+        .str.replace(r"[()]", "", regex=True)
+    )
+
+    # "amount (INR)" → "amount_inr" after normalisation, but rename any
+    # other column containing "amount" just in case
+    for col in df.columns:
+        if "amount" in col and col != "amount_inr":
+            df.rename(columns={col: "amount_inr"}, inplace=True)
+            break
+
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    return df
+
+
+def encode_dimensions(df):
+    """Convert the known dimension columns to categoricals (in place)."""
+    for col in DIMENSION_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def compact_frame(df, amount_dtype=AMOUNT_DTYPE):
+    """Shrink the frame in place; returns {column: {dtype, before, after}} in bytes."""
+    before = df.memory_usage(deep=True, index=False)
+
+    encode_dimensions(df)
+    for col in df.columns:
+        if col == "transaction_id" or col in DIMENSION_COLUMNS:
+            continue
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col].dtype):
+            n_unique = df[col].nunique(dropna=True)
+            if n_unique <= CATEGORY_MAX_UNIQUE and n_unique < len(df) // 2:
+                df[col] = df[col].astype("category")
+
+    for col in SMALL_INT_COLUMNS:
+        if col not in df.columns or not pd.api.types.is_numeric_dtype(df[col].dtype):
+            continue
+        s = df[col]
+        if s.isna().any() or not (s % 1 == 0).all():
+            continue
+        if s.min() >= -128 and s.max() <= 127:
+            df[col] = s.astype("int8")
+
+    if amount_dtype and "amount_inr" in df.columns:
+        df["amount_inr"] = df["amount_inr"].astype(amount_dtype)
+
+    # One contiguous Arrow buffer instead of a Python object per id
+    if "transaction_id" in df.columns and pa is not None:
+        df["transaction_id"] = df["transaction_id"].astype("string[pyarrow]")
+
+    after = df.memory_usage(deep=True, index=False)
+    return {
+        col: {"dtype": str(df[col].dtype), "before": int(before[col]), "after": int(after[col])}
+        for col in df.columns
+    }
+
+
+def plain_columns(df, columns, categories=False):
+    """
+    Undo the compaction for the named columns of a view, in place: int8 → int64
+    and float32 → float64 (arithmetic on int8 wraps around) and, with
+    categories=True, categoricals back to their categories' dtype — strings as
+    parsed, missing values still NaN.  Returns the columns converted.
+    """
+    changed = []
+    for col in columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            if not categories:
+                continue
+            df[col] = df[col].astype(dtype.categories.dtype)
+        elif dtype == "int8":
+            df[col] = df[col].astype("int64")
+        elif dtype == "float32":
+            df[col] = df[col].astype("float64")
+        else:
+            continue
+        changed.append(col)
+    return changed
+
+
+def parse_csv(path=CSV_PATH, amount_dtype=AMOUNT_DTYPE):
+    """Read, normalise and compact the raw CSV — the slow path. Returns (df, report)."""
+    df = normalise_columns(pd.read_csv(path))
+    report = compact_frame(df, amount_dtype)
+    return df, report
+
+
+def format_report(report):
+    """Compaction report as a table of MB before/after per column, biggest saving first."""
+    rows = pd.DataFrame([
+        {"Column": col, "Dtype": r["dtype"],
+         "Before_MB": round(r["before"] / 1e6, 2), "After_MB": round(r["after"] / 1e6, 2),
+         "Saved_MB": round((r["before"] - r["after"]) / 1e6, 2)}
+        for col, r in report.items()
+    ])
+    return rows.sort_values("Saved_MB", ascending=False).reset_index(drop=True)
+
+
+# ── Cache key ─────────────────────────────────────────────────────────────────
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """Full content hash of the CSV."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_paths(path, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return (os.path.join(cache_dir, f"{stem}.arrow"),
+            os.path.join(cache_dir, f"{stem}.meta.json"))
+
+
+def _profile_path(path, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{stem}.profile.json")
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def cache_is_fresh(path, meta, stat, amount_dtype=AMOUNT_DTYPE):
+    """True when the cached table was built from the CSV as it is now on disk."""
+    if not meta or meta.get("version") != CACHE_VERSION:
+        return False
+    if meta.get("amount_dtype", "") != amount_dtype:
+        return False
+    if meta.get("csv_size") != stat.st_size:
+        return False
+    if meta.get("csv_mtime_ns") == stat.st_mtime_ns:
+        return True
+    # mtime moved but size didn't — only a content hash can tell
+    return meta.get("csv_sha256") == file_sha256(path)
+
+
+# ── Arrow IPC read / write ────────────────────────────────────────────────────
+def _read_cache(arrow_path):
+    # Keep the map open: the numeric columns are views into it
+    source = pa.memory_map(arrow_path, "r")
+    table  = pa.ipc.open_file(source).read_all()
+    # Keep plain string columns (transaction_id) Arrow-backed on the way out
+    strings = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+    return table.to_pandas(split_blocks=True, types_mapper=strings.get)
+
+
+def _write_cache(df, arrow_path):
+    tmp = arrow_path + ".tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Uncompressed so later starts can memory-map the buffers directly
+    feather.write_feather(table, tmp, compression="uncompressed")
+    os.replace(tmp, arrow_path)
+
+
+def load_transactions(path=CSV_PATH, cache_dir=CACHE_DIR, amount_dtype=AMOUNT_DTYPE):
+    """
+    Load the compact transaction frame, using the columnar cache when it is fresh.
+    Returns (df, sha256 of the CSV the rows came from) — from the data loaded,
+    not from whatever meta is on disk, so a failed cache write cannot pair new
+    rows with the old hash.
+    """
+    stat = os.stat(path)  # raises FileNotFoundError like pd.read_csv would
+    if pa is None:
+        sha = file_sha256(path)
+        return parse_csv(path, amount_dtype)[0], sha
+
+    arrow_path, meta_path = _cache_paths(path, cache_dir)
+    meta = _read_meta(meta_path)
+    if os.path.exists(arrow_path) and cache_is_fresh(path, meta, stat, amount_dtype):
+        try:
+            df = _read_cache(arrow_path)
+            if meta.get("csv_mtime_ns") != stat.st_mtime_ns:
+                meta["csv_mtime_ns"] = stat.st_mtime_ns
+                _write_json(meta_path, meta)
+            return df, meta.get("csv_sha256") or file_sha256(path)
+        except (OSError, pa.ArrowException):
+            pass  # unreadable cache — rebuild below
+
+    sha = file_sha256(path)   # before parsing: the hash must not be newer than the rows
+    df, report = parse_csv(path, amount_dtype)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cache(df, arrow_path)
+        _write_json(meta_path, {
+            "version":      CACHE_VERSION,
+            "csv_path":     os.path.abspath(path),
+            "csv_size":     stat.st_size,
+            "csv_mtime_ns": stat.st_mtime_ns,
+            "csv_sha256":   sha,
+            "rows":         len(df),
+            "amount_dtype": amount_dtype,
+            "compaction":   report,
+        })
+    except OSError:
+        pass  # read-only checkout etc. — still serve the parsed frame
+    return df, sha
+
+
+def load_compaction_report(path=CSV_PATH, cache_dir=CACHE_DIR):
+    """Bytes saved per column when the cache was built, or None if there is no cache."""
+    meta = _read_meta(_cache_paths(path, cache_dir)[1])
+    return meta.get("compaction") if meta else None
+
+
+# ── Shared, read-only dataset handle ──────────────────────────────────────────
+def csv_stamp(path=CSV_PATH):
+    """Cheap change detector for the CSV: (size, mtime_ns)."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class SharedDataset:
+    """The transaction frame, held once per process and only handed out as views."""
+
+    def __init__(self, df, fingerprint, path=CSV_PATH):
+        self._df = df
+        self.fingerprint = fingerprint
+        self.path = path
+        self.rows = len(df)
+
+    def view(self):
+        """Shallow copy-on-write view: O(columns), shares every row buffer."""
+        return self._df.copy(deep=False)
+
+    def __len__(self):
+        return self.rows
+
+
+def open_dataset(path=CSV_PATH, cache_dir=CACHE_DIR, amount_dtype=AMOUNT_DTYPE):
+    """Load (or memory-map) the frame and wrap it with its content fingerprint."""
+    df, sha = load_transactions(path, cache_dir, amount_dtype)
+    fingerprint = f"{sha[:16]}-v{CACHE_VERSION}-{amount_dtype or 'native'}"
+    return SharedDataset(df, fingerprint, path)
+
+
+# ── Dataset profile ───────────────────────────────────────────────────────────
+def _plain(value):
+    """numpy scalar → Python scalar, so the profile serialises as JSON."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def build_profile(df, max_values=PROFILE_MAX_VALUES):
+    """Row count, date range, per-column distinct values and headline rates."""
+    columns = {}
+    for col in df.columns:
+        s = df[col]
+        info = {"dtype": str(s.dtype), "distinct": int(s.nunique(dropna=True))}
+        if info["distinct"] <= max_values:
+            info["values"] = [_plain(v) for v in s.dropna().unique()]  # order of first appearance
+            info["counts"] = {str(_plain(k)): int(n) for k, n in s.value_counts().items()}
+        columns[col] = info
+
+    profile = {"version": PROFILE_VERSION, "rows": len(df), "columns": columns, "date_range": None}
+    if "timestamp" in df.columns:
+        profile["date_range"] = [str(df["timestamp"].min()), str(df["timestamp"].max())]
+    if "transaction_status" in df.columns:
+        profile["success_rate"] = float((df["transaction_status"] == "SUCCESS").mean() * 100)
+        profile["failure_rate"] = float((df["transaction_status"] == "FAILED").mean() * 100)
+    if "fraud_flag" in df.columns:
+        profile["fraud_rate"] = float(df["fraud_flag"].mean() * 100)
+    if "amount_inr" in df.columns:
+        profile["avg_amount"] = float(df["amount_inr"].mean())
+    return profile
+
+
+def dataset_profile(dataset, cache_dir=CACHE_DIR):
+    """Profile of a SharedDataset, read from disk when it matches the fingerprint."""
+    profile_path = _profile_path(dataset.path, cache_dir)
+    profile = _read_meta(profile_path)
+    if (profile and profile.get("version") == PROFILE_VERSION
+            and profile.get("fingerprint") == dataset.fingerprint):
+        return profile
+
+    profile = build_profile(dataset.view())
+    profile["fingerprint"] = dataset.fingerprint
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_json(profile_path, profile)
+    except OSError:
+        pass  # read-only checkout — recomputed on the next start
+    return profile
@@ -0,0 +1,111 @@
+"""
+InsightX – few-shot pattern retrieval
+======================================
+The code-generation prompt used to carry every SAFE PATTERN example on every
+call — failure rates, trends, peak hours, thresholds — whether or not the
+question needed them.  `PatternIndex` keeps a small TF-IDF index over the
+examples, built once at import, and `top(question, k)` returns the k
+examples closest to the question, in their original order.
+
+Words are normalised on both sides before indexing: column names are split
+on "_", plurals are dropped and synonyms are folded ("failed" / "failure" →
+"fail", "avg" / "mean" → "average", bank, device and network values → the
+column they belong to), so a question's wording meets the example's code.
+A pattern's comment title says what it is for and counts twice.  A question
+that shares no word with any example gets the first k, the general
+per-group patterns.
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+# Question / code words that mean the same thing to the retriever
+SYNONYMS = {
+    "failed": "fail", "failure": "fail", "failing": "fail", "decline": "fail", "declined": "fail",
+    "successful": "success", "succeed": "success", "succeeded": "success",
+    "avg": "average", "mean": "average",
+    "value": "amount", "spend": "amount", "spending": "amount", "spent": "amount", "inr": "amount",
+    "number": "count", "volume": "count", "many": "count",
+    "monthly": "month", "hourly": "hour", "busiest": "peak", "busy": "peak",
+    "saturday": "weekend", "sunday": "weekend",
+    "monday": "weekday", "tuesday": "weekday", "wednesday": "weekday", "thursday": "weekday", "friday": "weekday",
+    "fraudulent": "fraud", "flag": "fraud", "flagged": "fraud",
+    "android": "device", "ios": "device", "web": "device", "phone": "device", "mobile": "device",
+    "3g": "network", "4g": "network", "5g": "network", "wifi": "network",
+    "sbi": "bank", "hdfc": "bank", "icici": "bank", "axis": "bank", "pnb": "bank", "kotak": "bank",
+    "indusind": "bank",
+    "young": "age", "youth": "age", "senior": "age", "elderly": "age",
+    "versus": "compare", "vs": "compare", "comparison": "compare",
+    "large": "high", "big": "high", "expensive": "high",
+}
+
+STOPWORDS = {"a", "an", "the", "of", "by", "for", "in", "on", "to", "and", "or", "is", "are", "be",
+             "what", "which", "how", "me", "show", "with", "per", "then", "only", "e", "g", "do", "does",
+             # every example ranks its groups, so ranking words pick none of them
+             "highest", "lowest", "most", "least", "top", "best", "worst", "sorted", "descending"}
+
+
+def terms(text):
+    """Normalised words of a question or an example, plus each pair of neighbours ("fail rate")."""
+    out = []
+    for word in re.findall(r"[a-z0-9]+", text.lower().replace("_", " ")):
+        if word.isdigit():
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        word = SYNONYMS.get(word, word)
+        if word not in STOPWORDS:
+            out.append(word)
+    return out + [f"{a} {b}" for a, b in zip(out, out[1:])]
+
+
+@dataclass(frozen=True)
+class Pattern:
+    """One few-shot example: its comment title and the block as written in the prompt."""
+    title: str
+    text: str
+
+
+def split_patterns(block):
+    """Examples of a prompt block: blank-line separated, each opening with '# ' comment lines."""
+    patterns = []
+    for text in re.split(r"\n\s*\n", block.strip()):
+        lines = text.strip().splitlines()
+        title = " ".join(line.lstrip("# ").rstrip(":") for line in lines if line.startswith("#"))
+        patterns.append(Pattern(title=title, text=text.strip()))
+    return patterns
+
+
+class PatternIndex:
+    """TF-IDF index over few-shot examples; top() picks the ones a question needs."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        docs = [Counter(terms(p.title) * 2 + terms(p.text)) for p in self.patterns]
+        seen = Counter(t for doc in docs for t in doc)
+        n = len(docs)
+        self.idf = {t: math.log(n / df) for t, df in seen.items()}
+        self._vectors = [self._weigh(doc) for doc in docs]
+
+    def _weigh(self, counts):
+        vec = {t: (1 + math.log(tf)) * self.idf[t] for t, tf in counts.items() if self.idf.get(t)}
+        norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+        return {t: w / norm for t, w in vec.items()}
+
+    def scores(self, question):
+        """Cosine similarity of the question to each example."""
+        q = self._weigh(Counter(terms(question)))
+        return [sum(w * vec.get(t, 0.0) for t, w in q.items()) for vec in self._vectors]
+
+    def top(self, question, k):
+        """The k best-scoring examples (positive scores only), in prompt order."""
+        scores = self.scores(question)
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: -scores[i])[:k]
+        if not ranked:
+            ranked = range(min(k, len(self.patterns)))
+        return [self.patterns[i] for i in sorted(ranked)]
+
+    def __len__(self):
+        return len(self.patterns)
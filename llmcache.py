@@ -0,0 +1,130 @@
+"""
+InsightX – persistent LLM completion cache
+===========================================
+Repeated questions send the local model near-identical prompts, and every
+call pays the full generation latency.  `CompletionCache` keeps finished
+completions in a small SQLite file next to the dataset cache, so they
+survive restarts and are shared by every session of the server process.
+
+A key covers everything that can change the answer: the endpoint and model
+id, the message list (whitespace-normalised, so re-indented prompts still
+hit), the sampling parameters and the dataset fingerprint — numbers baked
+into a cached insight are never served for a different dataset.
+
+Entries expire after a TTL and the file is kept under a byte budget by
+evicting the least recently used completions.  Each entry remembers how
+long the original call took, so hits report the latency they saved.
+
+Caching is opt-in per call site: app.py always caches code generation and
+caches insights only when INSIGHTX_LLM_CACHE_INSIGHTS=1.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = "llm_cache.sqlite"
+
+# Request fields that are not sampling parameters
+_NOT_PARAMS = {"messages", "model", "stream"}
+
+
+def normalise_messages(messages):
+    """Role + whitespace-collapsed content of each message."""
+    return [{"role": m["role"], "content": re.sub(r"\s+", " ", str(m["content"])).strip()}
+            for m in messages]
+
+
+def completion_key(request, fingerprint, endpoint=""):
+    """
+    Hex digest for a chat.completions request: endpoint and model, normalised
+    messages, sampling parameters (temperature, max_tokens, ...) and the
+    dataset fingerprint.
+    """
+    payload = {
+        "model": f"{endpoint}|{request.get('model', '')}",
+        "messages": normalise_messages(request["messages"]),
+        "params": {k: v for k, v in sorted(request.items()) if k not in _NOT_PARAMS},
+        "dataset": fingerprint,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CompletionCache:
+    """Completion text by completion_key(), on disk, with a TTL and LRU size bound."""
+
+    def __init__(self, path, ttl_s=7 * 24 * 3600, max_bytes=32 * 1024 * 1024):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, bytes INTEGER NOT NULL,"
+            " latency_ms REAL NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_used ON completions (used)")
+        self.hits = self.misses = self.evictions = 0
+        self.saved_ms = 0.0
+
+    def get(self, key):
+        """Cached text, or None on a miss (expired entries count as misses and are dropped)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, latency_ms, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl_s:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE completions SET used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_ms += row[1]
+            return row[0]
+
+    def put(self, key, text, latency_ms):
+        """Store a completion that took latency_ms to generate, then enforce TTL and size."""
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text, size, latency_ms, now, now))
+            self._db.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl_s,))
+            total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM completions").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._db.execute("SELECT key, bytes FROM completions ORDER BY used").fetchall()
+                stale = []
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((old_key,))
+                    total -= old_size
+                self._db.executemany("DELETE FROM completions WHERE key = ?", stale)
+                self.evictions += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM completions")
+
+    def stats(self):
+        with self._lock:
+            entries, nbytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM completions").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries, "bytes": nbytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_ms": self.saved_ms,
+        }
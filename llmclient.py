@@ -0,0 +1,255 @@
+"""
+InsightX – resilient LLM client
+================================
+`OpenAI(base_url=...)` on its own has no deadline that suits a chat app: a
+stalled local server kept the Streamlit script thread inside
+`chat.completions.create` until the browser gave up.
+
+`ResilientClient` wraps the OpenAI client behind the same
+`client.chat.completions.create(...)` call:
+
+- every attempt gets a timeout (waiting for the response, or for the next
+  chunk of a stream) and the whole call — retries and streaming included —
+  a deadline;
+- connection errors, timeouts, 429s and 5xx answers are retried a bounded
+  number of times with exponential backoff and jitter, never past the
+  deadline and never once a stream has started yielding;
+- a circuit breaker opens after a run of failed calls.  While it is open,
+  calls fail at once with `LLMUnavailable` — app.py then answers routed
+  questions from templates — and after a cooldown one probe call is let
+  through (half-open); its outcome closes or re-opens the breaker;
+- `health()` reports the breaker state, call / failure / retry / timeout
+  counts and latency percentiles for the sidebar.
+
+The client is shared by every session of the server process, so the counters
+and the breaker are guarded by a lock.
+"""
+
+import math
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+# Latencies kept for the percentiles in health()
+LATENCY_WINDOW = 200
+
+
+class LLMUnavailable(RuntimeError):
+    """The model could not answer: breaker open, deadline passed or retries exhausted."""
+
+
+def _transient(error):
+    """Errors worth another attempt — the request itself was fine."""
+    if isinstance(error, (APIConnectionError, RateLimitError)):   # APITimeoutError included
+        return True
+    return isinstance(error, APIStatusError) and getattr(error, "status_code", 0) >= 500
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failed calls; lets one probe through after `cooldown_s`."""
+
+    def __init__(self, failures=3, cooldown_s=30.0, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.clock = clock
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = None
+        self._probing = False
+
+    def allow(self):
+        """True if a call may go to the model now (claims the probe when half-open)."""
+        if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown_s:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return self.state != OPEN
+
+    def success(self):
+        self.state, self.consecutive, self.opened_at, self._probing = CLOSED, 0, None, False
+
+    def failure(self):
+        self.consecutive += 1
+        if self.state == HALF_OPEN or self.consecutive >= self.failures:
+            self.state, self.opened_at = OPEN, self.clock()
+        self._probing = False
+
+    def release(self):
+        """The call failed for its own reasons (a bad request): free the probe, change nothing else."""
+        self._probing = False
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 unless open)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.cooldown_s - (self.clock() - self.opened_at))
+
+
+class _GuardedStream:
+    """
+    The chunks of a streamed call, failing it if the stream errors or runs past
+    the deadline.  Until the first chunk the call is unsettled: a non-transient
+    error, close() or dropping the stream releases the breaker's probe instead
+    of leaving it claimed (which would keep a half-open breaker shut for good).
+    """
+
+    def __init__(self, client, stream, start, deadline):
+        self._client = client
+        self._stream = stream
+        self._chunks = iter(stream)
+        self._start = start
+        self._deadline = deadline
+        self._settled = False
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        client = self._client
+        if self._done:
+            raise StopIteration
+        try:
+            if self._settled and client.clock() > self._deadline:
+                raise APITimeoutError(request=None)
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._done = True
+            if not self._settled:
+                self._settled = True
+                client._succeeded(self._start)
+            raise
+        except Exception as error:
+            self._done = True
+            self._close_stream()
+            first, self._settled = not self._settled, True
+            if not _transient(error):
+                if first:
+                    client._release()
+                raise
+            client._failed(error)
+            raise LLMUnavailable(f"language model stream interrupted: {error}") from error
+        if not self._settled:
+            self._settled = True
+            client._succeeded(self._start)   # latency = time to first chunk
+        return chunk
+
+    def _close_stream(self):
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+    def close(self):
+        self._close_stream()
+        if not self._settled:
+            self._settled = True
+            self._client._release()
+
+    def __del__(self):
+        if not self._settled:
+            self.close()
+
+
+class ResilientClient:
+    """OpenAI-compatible client with per-call deadlines, retries and a circuit breaker."""
+
+    def __init__(self, client, timeout_s=20.0, deadline_s=60.0, retries=2, backoff_s=0.5,
+                 failures=3, cooldown_s=30.0, clock=time.monotonic, sleep=time.sleep):
+        self._client = client
+        self.base_url = getattr(client, "base_url", "")
+        self.timeout_s = timeout_s
+        self.deadline_s = deadline_s
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.clock = clock
+        self.sleep = sleep
+        self.breaker = CircuitBreaker(failures, cooldown_s, clock)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = self.failures = self.retried = self.timeouts = self.short_circuited = 0
+        self.last_error = None
+
+    def available(self):
+        """False while the breaker is open — callers can skip the model instead of failing."""
+        with self._lock:
+            return self.breaker.state != OPEN or self.breaker.retry_in() == 0
+
+    def create(self, stream=False, **request):
+        """chat.completions.create with deadlines, retries and the breaker; raises LLMUnavailable."""
+        with self._lock:
+            self.calls += 1
+            if not self.breaker.allow():
+                self.short_circuited += 1
+                raise LLMUnavailable(f"language model unavailable (circuit open, retry in "
+                                     f"{self.breaker.retry_in():.0f} s; last error: {self.last_error})")
+        start = self.clock()
+        deadline = start + self.deadline_s
+        attempt = 0
+        while True:
+            remaining = deadline - self.clock()
+            try:
+                if remaining <= 0:
+                    raise APITimeoutError(request=None)
+                response = self._client.chat.completions.create(
+                    **request, stream=stream, timeout=min(self.timeout_s, remaining))
+                break
+            except Exception as error:
+                pause = self.backoff_s * 2 ** attempt * (0.5 + random.random())
+                if not _transient(error) or attempt >= self.retries or self.clock() + pause >= deadline:
+                    if _transient(error):
+                        self._failed(error)
+                        raise LLMUnavailable(f"language model unavailable after {attempt + 1} "
+                                             f"attempt(s): {error}") from error
+                    self._release()
+                    raise
+                with self._lock:
+                    self.retried += 1
+                attempt += 1
+                self.sleep(pause)
+        if not stream:
+            self._succeeded(start)
+            return response
+        return _GuardedStream(self, response, start, deadline)
+
+    def _succeeded(self, start):
+        with self._lock:
+            self._latencies.append((self.clock() - start) * 1000)
+            self.breaker.success()
+
+    def _failed(self, error):
+        with self._lock:
+            self.failures += 1
+            self.timeouts += isinstance(error, APITimeoutError)
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.breaker.failure()
+
+    def _release(self):
+        with self._lock:
+            self.breaker.release()
+
+    def health(self):
+        """Breaker state, counters and latency percentiles (ms, of successful calls)."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            state = self.breaker.state
+            if state == OPEN and self.breaker.retry_in() == 0:
+                state = HALF_OPEN    # the next call is the probe
+            return {
+                "state": state,
+                "consecutive_failures": self.breaker.consecutive,
+                "retry_in_s": self.breaker.retry_in(),
+                "calls": self.calls, "failures": self.failures, "retries": self.retried,
+                "timeouts": self.timeouts, "short_circuited": self.short_circuited,
+                "p50_ms": statistics.median(latencies) if latencies else None,
+                "p95_ms": latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else None,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,299 @@
+"""
+InsightX – Prometheus metrics
+==============================
+Traces (tracing.py) say where one question's time went; operations need the
+aggregate: how often the router answers versus the LLM fallback, how often
+executed code fails, latency percentiles per stage and end to end, LLM tokens
+over time, cache hit ratios and the autosave write time — and alerts when
+they regress.
+
+`Registry` holds counters, gauges and histograms with labels and renders the
+Prometheus text exposition format (0.0.4) with no client library.
+`observe_trace(root)` turns one finished question trace into samples, so the
+metrics and the 🧭 Trace panel always agree:
+
+  insightx_questions_total{question_type, path, outcome}
+  insightx_question_seconds{question_type, path}        histogram
+  insightx_route_total{route, path}                      per (part of a) question
+  insightx_stage_seconds{stage}                          histogram
+  insightx_execute_total{kind, status}                   template / plan / generated code
+  insightx_result_cache_total{outcome}
+  insightx_llm_cache_total{call, outcome}
+  insightx_llm_tokens_total{call, direction}             rate() → tokens per minute
+  insightx_llm_ttft_seconds{call}                        histogram
+  insightx_autosave_seconds                              histogram
+
+`path` is how a part was answered: template (router rule), plan (query
+plan), llm (generated code), reasoning (no code) — several parts make a
+"multi" question.  Collectors registered by app.py add gauges read at scrape
+time (LLM breaker state and client counters, cache sizes).
+
+`serve(registry, port)` answers GET /metrics on a background thread;
+`write_file(registry, path)` replaces a file atomically for the node-exporter
+textfile collector or any scraper that reads files.
+"""
+
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: rendered answers take ~1 ms, an LLM answer tens of seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+WRITE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(v):
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """{label values tuple: value} — a snapshot."""
+        with self._lock:
+            return dict(self._values)
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield from self._sample_lines(list(zip(self.labels, key)), value)
+
+    def _sample_lines(self, labels, value):
+        yield f"{_series(self.name, labels)} {_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _sample_lines(self, labels, value):
+        counts, total = value
+        for bound, count in zip(self.buckets, counts):
+            yield f"{_series(self.name + '_bucket', labels + [('le', _value(float(bound)))])} {count}"
+        yield f"{_series(self.name + '_sum', labels)} {_value(total)}"
+        yield f"{_series(self.name + '_count', labels)} {counts[-1]}"
+
+    def quantile(self, q, **labels):
+        """
+        Upper bucket bound holding the q-quantile, as histogram_quantile() would
+        bound it, over the series matching labels (all of them if none given);
+        None if empty.
+        """
+        unknown = set(labels) - set(self.labels)
+        if unknown:
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        counts = [0] * len(self.buckets)
+        for key, (series, _) in self.samples().items():
+            if all(dict(zip(self.labels, key))[k] == str(v) for k, v in labels.items()):
+                counts = [a + b for a, b in zip(counts, series)]
+        if not counts[-1]:
+            return None
+        rank = q * counts[-1]
+        return next(bound for bound, count in zip(self.buckets, counts) if count >= rank)
+
+
+class Registry:
+    """Metrics of one process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        """fn() → iterable of Gauge / Counter objects built at scrape time (e.g. from a client's health())."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.lines()
+        for fn in self._collectors:
+            try:
+                for metric in fn():
+                    lines += metric.lines()
+            except Exception as e:   # a failing collector must not break the scrape
+                lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# ── InsightX metrics ─────────────────────────────────────────────────────────
+REGISTRY = Registry()
+QUESTIONS = REGISTRY.counter("insightx_questions_total", "Questions asked, by type, how they were answered and outcome",
+                             ("question_type", "path", "outcome"))
+QUESTION_SECONDS = REGISTRY.histogram("insightx_question_seconds", "End-to-end time of a question",
+                                      ("question_type", "path"))
+ROUTES = REGISTRY.counter("insightx_route_total", "Questions (or parts) by router rule and how they were answered",
+                          ("route", "path"))
+STAGE_SECONDS = REGISTRY.histogram("insightx_stage_seconds", "Time per pipeline stage (span)", ("stage",))
+EXECUTIONS = REGISTRY.counter("insightx_execute_total", "Result computations by kind and status",
+                              ("kind", "status"))
+RESULT_CACHE = REGISTRY.counter("insightx_result_cache_total", "Result cache lookups", ("outcome",))
+LLM_CACHE = REGISTRY.counter("insightx_llm_cache_total", "LLM completion cache lookups", ("call", "outcome"))
+LLM_TOKENS = REGISTRY.counter("insightx_llm_tokens_total", "LLM tokens (server counts, else estimated)",
+                              ("call", "direction"))
+LLM_TTFT = REGISTRY.histogram("insightx_llm_ttft_seconds", "Time to the first streamed token", ("call",))
+AUTOSAVE_SECONDS = REGISTRY.histogram("insightx_autosave_seconds", "Chat autosave write time", (),
+                                      buckets=WRITE_BUCKETS)
+
+# span name → the LLM call it makes
+LLM_CALLS = {"generate_pandas_code": "codegen", "stream_insight": "insight", "add_llm_context": "context"}
+
+
+def _part_path(part):
+    """How one answer_part (or the single-question root) got its result."""
+    names = {s.name: s for _, s in part.walk()}
+    if "generate_pandas_code" in names:
+        return "llm"
+    if "run_plan" in names:
+        return "plan"
+    if "run_code" in names:
+        return "template"
+    return "reasoning"
+
+
+def observe_trace(root):
+    """Record one finished question trace (tracing.trace root) in the metrics."""
+    parts = [s for s in root.children if s.name == "answer_part"] or [root]
+    paths = []
+    for part in parts:
+        path = _part_path(part)
+        paths.append(path)
+        route = next((s.attrs.get("rule") for _, s in part.walk() if s.name == "route_query"), None)
+        if root.attrs.get("outcome") != "clarification":
+            ROUTES.inc(route=route or "none", path=path)
+    question_type = root.attrs.get("question_type", "unknown")
+    path = "multi" if len(parts) > 1 else paths[0]
+    outcome = root.attrs.get("outcome") or ("error" if "error" in root.attrs else "answered")
+    QUESTIONS.inc(question_type=question_type, path=path, outcome=outcome)
+    QUESTION_SECONDS.observe(root.ms / 1000, question_type=question_type, path=path)
+
+    for _, s in root.walk():
+        if s is not root:
+            STAGE_SECONDS.observe(s.ms / 1000, stage=s.name)
+        attrs = s.attrs
+        if s.name in ("run_code", "run_plan"):
+            kind = "plan" if s.name == "run_plan" else "template" if attrs.get("trusted") else "generated"
+            EXECUTIONS.inc(kind=kind, status="ok" if attrs.get("ok", True) else "error")
+            if attrs.get("result_cache"):
+                RESULT_CACHE.inc(outcome=attrs["result_cache"])
+        call = LLM_CALLS.get(s.name)
+        if call:
+            if attrs.get("llm_cache"):
+                LLM_CACHE.inc(call=call, outcome=attrs["llm_cache"])
+            for direction in ("prompt", "completion"):
+                if attrs.get(f"{direction}_tokens") and attrs.get("llm_cache") != "hit":
+                    LLM_TOKENS.inc(attrs[f"{direction}_tokens"], call=call, direction=direction)
+            if attrs.get("ttft_ms") is not None:
+                LLM_TTFT.observe(attrs["ttft_ms"] / 1000, call=call)
+        if s.name == "save_chat":
+            AUTOSAVE_SECONDS.observe(s.ms / 1000)
+
+
+# ── Export ───────────────────────────────────────────────────────────────────
+def write_file(registry, path):
+    """Replace path with the current exposition (atomic, for textfile collectors)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+def serve(registry, port, host="0.0.0.0"):
+    """GET /metrics on a daemon thread; returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") not in ("/metrics", ""):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="insightx-metrics", daemon=True).start()
+    return httpd
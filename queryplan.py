@@ -0,0 +1,585 @@
+"""
+InsightX – query plans
+=======================
+Most questions the router has no template for are still one metric over a
+few dimensions with a few filters — "fraud rate by network on weekends for
+P2M", "average amount of failed iOS transactions by bank, top 3".
+`QueryParser` reads those into a `QueryPlan`: metric, group-by dimensions,
+value filters, an hour-of-day range, an amount range, order and top-N.  The
+filter values come from the dataset profile, so any bank, state or category
+in the data is understood without a template.  `execute_plan()` answers the
+plan from the cube when it can and otherwise with one `group_stats()` pass
+over a predicate-index selection — no generated code, no LLM.
+
+The grammar is strict on purpose: every word of the question has to be
+understood (a metric, a dimension, a filter value, a range, an ordering word
+or filler such as "which" / "transactions").  Anything else — reasoning
+questions, follow-ups, columns the plan cannot express — returns None and
+goes to the LLM exactly as before.
+
+Used by app.py (after the router, before the LLM) and benchmark.py.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from analytics import Selection, group_stats
+
+MONTH = "month"  # derived dimension: timestamp by calendar month
+
+# Metric → (result column, decimals)
+METRICS = {
+    "failure_rate":  ("Failure_Rate_%", 2),
+    "success_rate":  ("Success_Rate_%", 2),
+    "fraud_rate":    ("Fraud_Rate_%", 4),
+    "amount_mean":   ("Avg_Amount_INR", 2),
+    "amount_median": ("Median_Amount_INR", 2),
+    "amount_sum":    ("Total_Amount_INR", 2),
+    "count":         ("Transactions", 0),
+    "failed":        ("Failed", 0),
+    "fraud":         ("Flagged", 0),
+}
+
+# Metric → (per-row value, aggregation, scale) in the plain pandas of QueryPlan.to_pandas()
+PANDAS_METRICS = {
+    "failure_rate":  ("rows['transaction_status'].eq('FAILED')", "mean", 100),
+    "success_rate":  ("rows['transaction_status'].eq('SUCCESS')", "mean", 100),
+    "fraud_rate":    ("rows['fraud_flag']", "mean", 100),
+    "amount_mean":   ("rows['amount_inr']", "mean", 1),
+    "amount_median": ("rows['amount_inr']", "median", 1),
+    "amount_sum":    ("rows['amount_inr']", "sum", 1),
+    "count":         ("rows['transaction_id']", "size", 1),
+    "failed":        ("rows['transaction_status'].eq('FAILED')", "sum", 1),
+    "fraud":         ("rows['fraud_flag']", "sum", 1),
+}
+
+# Count shown next to a rate: (group_stats column, result column)
+RATE_BASE = {
+    "failure_rate": ("failed", "Failed"),
+    "success_rate": ("success", "Successful"),
+    "fraud_rate":   ("fraud", "Flagged"),
+}
+
+DIMENSION_LABELS = {
+    "sender_bank": "Bank", "sender_state": "State", "device_type": "Device",
+    "network_type": "Network", "transaction_type": "Transaction_Type",
+    "merchant_category": "Merchant_Category", "sender_age_group": "Age_Group",
+    "hour_of_day": "Hour", "day_of_week": "Day", "is_weekend": "Period", MONTH: "Month",
+}
+
+# Dimensions shown in their own order unless the question asks for a ranking
+NATURAL_ORDER = {"hour_of_day", "day_of_week", "is_weekend", MONTH}
+DAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Columns whose values (from the dataset profile) can be used as filters
+FILTER_COLUMNS = [
+    "transaction_type", "device_type", "network_type", "sender_bank",
+    "sender_state", "sender_age_group", "merchant_category", "day_of_week",
+]
+
+# Values that are also ordinary English words — never read as filters
+AMBIGUOUS_VALUES = {"other"}
+
+# How non-profile filters read in describe()
+FILTER_NAMES = {
+    "is_weekend": {0: "weekdays", 1: "weekends"},
+    "transaction_status": {"FAILED": "failed", "SUCCESS": "successful"},
+    "fraud_flag": {1: "flagged"},
+}
+
+# Extra spellings → (column, value)
+VALUE_ALIASES = {
+    "bill": ("transaction_type", "Bill Payment"),
+    "bill payments": ("transaction_type", "Bill Payment"),
+    "recharges": ("transaction_type", "Recharge"),
+    "wi-fi": ("network_type", "WiFi"),
+    "weekend": ("is_weekend", 1), "weekends": ("is_weekend", 1),
+    "weekday": ("is_weekend", 0), "weekdays": ("is_weekend", 0),
+}
+
+# "high value" without an explicit threshold (same cut-off as the router)
+HIGH_VALUE_INR = 5000
+
+RATE_WORDS = r"(?:rates?|ratios?|%|percent(?:age)?|share|proportion)"
+FAIL  = r"(?:fail(?:ure|ed|ing|s)?|unsuccessful)"
+SUCC  = r"(?:success(?:ful)?|succeeded)"
+FRAUD = r"(?:fraud(?:ulent)?|flag(?:ged|s)?)"
+
+AMOUNT_NOUN = r"(?:\s+(?:transaction|payment|txn))?(?:\s+(?:amount|value|spend(?:ing)?|ticket size|size|ticket))?"
+COUNT_WORDS = r"(?:how many|number of|count of|count)"
+
+# (metric, pattern) — the first pattern found decides the metric.  A bare
+# "failure" / "fraud" is a rate (as in "bank failure for iOS"); "failed",
+# "failures", "flagged" or an explicit count ("number of failed", "failure
+# count") are counts.
+METRIC_PATTERNS = [
+    ("failure_rate",  rf"\b{FAIL}\s+{RATE_WORDS}"),
+    ("success_rate",  rf"\b{SUCC}\s+{RATE_WORDS}"),
+    ("fraud_rate",    rf"\b{FRAUD}(?:\s+flag)?\s+{RATE_WORDS}"),
+    ("failure_rate",  rf"{RATE_WORDS}\s+(?:of\s+)?(?:\S+\s+){{0,4}}?{FAIL}\b"),
+    ("success_rate",  rf"{RATE_WORDS}\s+(?:of\s+)?(?:\S+\s+){{0,4}}?{SUCC}\b"),
+    ("fraud_rate",    rf"{RATE_WORDS}\s+(?:of\s+)?(?:\S+\s+){{0,4}}?{FRAUD}\b"),
+    ("amount_median", rf"\bmedian{AMOUNT_NOUN}\b"),
+    ("amount_mean",   rf"\b(?:average|avg|mean){AMOUNT_NOUN}\b"),
+    ("amount_sum",    r"\b(?:total|sum of)\s+(?:transaction\s+|payment\s+)?(?:amount|value|spend(?:ing)?)\b"),
+    ("failed",        rf"\b{COUNT_WORDS}\s+(?:\S+\s+){{0,4}}?{FAIL}\b"),
+    ("fraud",         rf"\b{COUNT_WORDS}\s+(?:\S+\s+){{0,4}}?{FRAUD}\b"),
+    ("failed",        rf"\b{FAIL}\s+(?:counts?|numbers?)\b"),
+    ("fraud",         rf"\b{FRAUD}(?:\s+flag)?\s+(?:counts?|numbers?)\b"),
+    ("failure_rate",  r"\bfailure\b"),
+    ("fraud_rate",    r"\bfraud\b"),
+    ("failed",        rf"\b{FAIL}\b"),
+    ("fraud",         rf"\b{FRAUD}\b"),
+    ("count",         rf"\b(?:{COUNT_WORDS}|volume|busiest)\b"),
+]
+
+# Dimension phrases, longest first within each column; bare "type" last so
+# "network type" / "device type" are not read as transaction type
+DIMENSION_PATTERNS = [
+    ("sender_age_group",  r"\bage (?:groups?|brackets?)\b|\bages?\b"),
+    ("merchant_category", r"\bmerchant categor(?:y|ies)\b|\bmerchants?\b|\bcategor(?:y|ies)\b"),
+    ("sender_bank",       r"\bbanks?\b"),
+    ("sender_state",      r"\bstates?\b|\bregions?\b"),
+    ("device_type",       r"\bdevice types?\b|\bdevices?\b|\bplatforms?\b"),
+    ("network_type",      r"\bnetwork types?\b|\bnetworks?\b"),
+    ("hour_of_day",       r"\bhours? of (?:the )?day\b|\btime of day\b|\bhourly\b|\bhours?\b"),
+    ("day_of_week",       r"\bdays? of (?:the )?week\b"),
+    (MONTH,               r"\bmonthly\b|\bmonths?\b"),
+    ("transaction_type",  r"\b(?:transaction|payment) types?\b|\btypes? of (?:transactions?|payments?)\b|\btypes?\b"),
+]
+
+# Named parts of the day → [start, end) hours
+DAY_PARTS = {
+    "business hours": (9, 17), "office hours": (9, 17),
+    "morning": (6, 12), "mornings": (6, 12),
+    "afternoon": (12, 17), "afternoons": (12, 17),
+    "evening": (17, 21), "evenings": (17, 21),
+    "late night": (22, 6), "night": (22, 6), "nights": (22, 6), "overnight": (22, 6),
+}
+
+DESC_WORDS = {"highest", "most", "top", "maximum", "max", "largest", "biggest", "greatest", "peak", "busiest"}
+ASC_WORDS  = {"lowest", "least", "fewest", "minimum", "min", "smallest", "bottom"}
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+
+# Words that carry no meaning for the plan.  Not "rate": a rate word the
+# metric patterns did not consume ("rate by bank") names no metric → LLM.
+FILLER = set("""
+what whats which who is are was were be been the a an of for in on at by per each every across
+among and or vs versus compared compare comparison comparing against to with from during
+show me give list tell get find display see view all our my overall only just please can could
+you i want need know has have had do does did there value values amount amounts
+transactions transaction txns txn payments payment upi inr rs ₹ rupees
+split breakdown broken down grouped group wise rank ranked ranking ranks sorted sort order ordered
+descending ascending made happen happened occur occurred sent how many much number count counts
+volume
+""".split())
+
+# Questions that need reasoning, not a number
+REFUSE = re.compile(
+    r"\b(?:why|explain|should|recommend|suggest|predict|forecast|improve|reduce|prevent|"
+    r"strategy|insight|trend|correlat\w*|distribution|percentile|quantile|std|deviation|"
+    r"variance|growth|change|increase|decrease|compare that|same|previous|it|that|those|this|"
+    r"receiver|user|users|customer|customers|best|worst)\b|\bhow (?!many\b|much\b)"
+)
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """One metric over optional group-by dimensions, after filtering rows."""
+    metric: str                  # key of METRICS
+    group_by: tuple = ()         # dimension columns (or MONTH)
+    filters: tuple = ()          # ((column, (value, ...)), ...) — rows matching any value, per column
+    hours: tuple = None          # (start, end) hour_of_day range, end exclusive; start > end wraps midnight
+    amount: tuple = None         # (above, below) amount_inr bounds, exclusive; either may be None
+    order: str = "desc"          # "desc" / "asc" by metric, or None for the dimensions' own order
+    top_n: int = None
+
+    def narrows(self):
+        """True if the plan keeps only some rows (not just values compared side by side)."""
+        return bool(self.hours or self.amount
+                    or any(col not in self.group_by for col, _ in self.filters))
+
+    def describe(self):
+        parts = [self.metric.replace("_", " ")]
+        if self.group_by:
+            parts.append("by " + " × ".join(DIMENSION_LABELS.get(d, d) for d in self.group_by))
+        for col, values in self.filters:
+            names = FILTER_NAMES.get(col, {})
+            parts.append(" / ".join(names.get(v, str(v)) for v in values))
+        if self.hours:
+            parts.append(f"hours {self.hours[0]:02d}:00–{self.hours[1] or 24:02d}:00")
+        if self.amount:
+            above, below = self.amount
+            if above is not None:
+                parts.append(f"amount > ₹{above:,.0f}")
+            if below is not None:
+                parts.append(f"amount < ₹{below:,.0f}")
+        if self.top_n:
+            parts.append(f"{'top' if self.order != 'asc' else 'bottom'} {self.top_n}")
+        return " · ".join(parts)
+
+    def to_code(self):
+        """Source that reproduces the answer in the executor's namespace (also the result-cache key)."""
+        return f"result = execute_plan({self!r}, df, cube=cube, idx=idx)"
+
+    def to_pandas(self):
+        """
+        Plain pandas that computes the plan's metric on the CSV — what the
+        verification panel shows, so the numbers can be checked without the
+        cube or the predicate index.
+        """
+        conditions = []
+        for col, values in self.filters:
+            conditions.append(f"(df[{col!r}] == {values[0]!r})" if len(values) == 1
+                              else f"df[{col!r}].isin({list(values)!r})")
+        if self.hours:
+            start, end = self.hours[0], self.hours[1] or 24
+            conditions.append(f"df['hour_of_day'].between({start}, {end - 1})" if start < end
+                              else f"((df['hour_of_day'] >= {start}) | (df['hour_of_day'] < {end}))")
+        if self.amount:
+            above, below = self.amount
+            if above is not None:
+                conditions.append(f"(df['amount_inr'] > {above:g})")
+            if below is not None:
+                conditions.append(f"(df['amount_inr'] < {below:g})")
+        lines = [f"rows = df[{' & '.join(conditions)}]" if conditions else "rows = df"]
+
+        value, agg, scale = PANDAS_METRICS[self.metric]
+        label, decimals = METRICS[self.metric]
+        times = f" * {scale}" if scale != 1 else ""
+        if not self.group_by:
+            lines.append("result = len(rows)" if agg == "size"
+                         else f"result = round(float({value}.{agg}()){times}, {decimals})")
+            return "\n".join(lines)
+
+        keys = ", ".join("rows['timestamp'].dt.to_period('M').rename('month')" if d == MONTH else f"rows[{d!r}]"
+                         for d in self.group_by)
+        grouped = f"{value}.groupby([{keys}], observed=True).{agg}()"
+        lines.append(f"values = ({grouped}{times}).round({decimals})" if times
+                     else f"values = {grouped}.round({decimals})")
+        if self.order is None and self.group_by == ("day_of_week",):
+            lines.append(f"values = values.reindex({DAY_ORDER!r}).dropna()")
+        elif self.order is None:
+            lines.append("values = values.sort_index()")
+        else:
+            lines.append(f"values = values.sort_values(ascending={self.order == 'asc'})")
+        if self.top_n:
+            lines.append(f"values = values.head({self.top_n})")
+        lines.append(f"result = values.rename({label!r}).reset_index()")
+        return "\n".join(lines)
+
+
+# ── Parser ────────────────────────────────────────────────────────────────────
+def _hour(value, meridiem):
+    h = int(value)
+    if meridiem == "pm" and h < 12:
+        h += 12
+    elif meridiem == "am" and h == 12:
+        h = 0
+    return h if 0 <= h <= 24 else None
+
+
+def _amount(value, unit):
+    x = float(value)
+    return x * {"k": 1_000, "lakh": 100_000, "l": 100_000}.get(unit or "", 1)
+
+
+HOUR = r"(\d{1,2})(?::00)?\s*(am|pm)?"
+CURRENCY = r"(?:₹|rs\.?|inr)"
+AMOUNT = rf"{CURRENCY}?\s*(\d+(?:\.\d+)?)\s*(k|lakh|l)?\b(?:\s*(?:rupees|inr|rs))?"
+
+
+class QueryParser:
+    """Turns a question into a QueryPlan using the value lists in the dataset profile."""
+
+    def __init__(self, profile):
+        values = {}
+        for col in FILTER_COLUMNS:
+            for v in profile["columns"].get(col, {}).get("values", []):
+                if isinstance(v, str) and v.lower() not in AMBIGUOUS_VALUES:
+                    values[v.lower()] = (col, v)
+        values.update(VALUE_ALIASES)
+        # Longest first, so "bill payment" wins over "bill" and "yes bank" over "bank"
+        names = sorted(values, key=len, reverse=True)
+        self._values = values
+        self._value_re = re.compile(
+            r"(?<![\w+])(" + "|".join(re.escape(n) for n in names) + r")s?(?![\w+])")
+        start, end = (profile.get("date_range") or [None, None])
+        self._years = set(range(int(start[:4]), int(end[:4]) + 1)) if start and end else set()
+
+    def parse(self, question):
+        """QueryPlan for the question, or None if any part of it is not understood."""
+        text = self._normalise(question)
+        if not text or REFUSE.search(text):
+            return None
+        text, amount = self._take_amount(text)
+        text, hours = self._take_hours(text)
+        if amount is False or hours is False:
+            return None
+        text, top_n, top_dir = self._take_top_n(text)
+        text = self._take_years(text)
+        if text is None:
+            return None
+
+        filters, positions = {}, {}
+        def take_value(m):
+            col, value = self._values[m.group(1)]
+            if value not in filters.setdefault(col, []):
+                filters[col].append(value)
+            positions.setdefault(col, m.start())
+            return " " * len(m.group(0))
+        text = self._value_re.sub(take_value, text)
+
+        dims = {}  # column → first position in the question
+        for col, pattern in DIMENSION_PATTERNS:
+            for m in re.finditer(pattern, text):
+                dims.setdefault(col, m.start())
+            text = re.sub(pattern, lambda m: " " * len(m.group(0)), text)
+
+        metric = None
+        for name, pattern in METRIC_PATTERNS:
+            m = re.search(pattern, text)
+            if m:
+                metric = name
+                if "busiest" in m.group(0):   # the metric and the order in one word
+                    top_dir = top_dir or "desc"
+                text = text[:m.start()] + " " * (m.end() - m.start()) + text[m.end():]
+                break
+
+        # Status / fraud words left over are row filters ("average amount of failed ...")
+        if metric not in ("failure_rate", "success_rate", "failed"):
+            text, n_fail = re.subn(rf"\b{FAIL}\b", " ", text)
+            text, n_succ = re.subn(rf"\b{SUCC}\b", " ", text)
+            if n_fail and n_succ:
+                return None
+            if n_fail or n_succ:
+                filters["transaction_status"] = ["FAILED" if n_fail else "SUCCESS"]
+        if metric not in ("fraud_rate", "fraud"):
+            text, n_fraud = re.subn(rf"\b{FRAUD}\b", " ", text)
+            if n_fraud:
+                filters["fraud_flag"] = [1]
+
+        words = re.findall(r"[^\s]+", text)
+        order = top_dir
+        for w in words:
+            if w in DESC_WORDS:
+                order = order or "desc"
+            elif w in ASC_WORDS:
+                order = order or "asc"
+        unknown = [w for w in words if w not in FILLER and w not in DESC_WORDS and w not in ASC_WORDS]
+        if unknown:
+            return None
+
+        # Several values of one column → compare them side by side
+        for col, vals in filters.items():
+            if len(vals) > 1 and col not in dims:
+                dims[col] = positions.get(col, 0)
+        group_by = tuple(sorted(dims, key=dims.get))
+        if metric is None:
+            if not group_by:
+                return None
+            metric = "count"
+        if len(group_by) > 3:
+            return None
+        if order is None and not (set(group_by) & NATURAL_ORDER):
+            order = "desc"
+
+        return QueryPlan(
+            metric=metric,
+            group_by=group_by,
+            filters=tuple((col, tuple(vals)) for col, vals in filters.items()),
+            hours=hours,
+            amount=amount,
+            order=order,
+            top_n=top_n,
+        )
+
+    @staticmethod
+    def _normalise(question):
+        q = question.lower().replace("’", "'")
+        q = re.sub(r"(?<=\d),(?=\d{3})", "", q)          # 5,000 → 5000
+        q = re.sub(r"'s\b", "", q)
+        q = q.replace("high-value", "high value")
+        q = re.sub(r"[?!.,;()\"]|(?<!\d):|:(?!\d)", " ", q)
+        return " ".join(q.split())
+
+    @staticmethod
+    def _take_amount(text):
+        above = below = None
+        m = re.search(rf"\bbetween\s+{CURRENCY}\s*(\d+(?:\.\d+)?)\s*(k|lakh|l)?\s+and\s+{AMOUNT}", text)
+        if m:
+            above, below = _amount(m.group(1), m.group(2)), _amount(m.group(3), m.group(4))
+            text = text[:m.start()] + " " + text[m.end():]
+        for pattern, is_lower in [
+            (rf"(?:\babove|\bover|\bmore than|\bgreater than|\bexceeding|\blarger than|>)\s*{AMOUNT}", True),
+            (rf"(?:\bbelow|\bunder|\bless than|\bsmaller than|<)\s*{AMOUNT}", False),
+        ]:
+            m = re.search(pattern, text)
+            if m:
+                value = _amount(m.group(1), m.group(2))
+                if is_lower:
+                    above = value
+                else:
+                    below = value
+                text = text[:m.start()] + " " + text[m.end():]
+        if re.search(r"\bhigh value\b", text):
+            text = re.sub(r"\bhigh value\b", " ", text)
+            above = HIGH_VALUE_INR if above is None else above
+        if above is None and below is None:
+            return text, None
+        if above is not None and below is not None and above >= below:
+            return text, False
+        return text, (above, below)
+
+    @staticmethod
+    def _take_hours(text):
+        hours = None
+        for pattern in [
+            rf"\bbetween\s+{HOUR}\s+and\s+{HOUR}",
+            rf"\bfrom\s+{HOUR}\s+(?:to|till|until|-)\s+{HOUR}",
+            r"\b(\d{1,2})(?::00)?\s*(am|pm)?\s*(?:-|to)\s*(\d{1,2})(?::00)?\s*(am|pm)\b",
+        ]:
+            m = re.search(pattern, text)
+            if m:
+                start = _hour(m.group(1), m.group(2) or m.group(4))
+                end = _hour(m.group(3), m.group(4))
+                if start is None or end is None or start == end:
+                    return text, False
+                hours = (start, end % 24)
+                text = text[:m.start()] + " " + text[m.end():]
+                break
+        if hours is None:
+            m = re.search(rf"\b(?:after|since)\s+{HOUR}", text)
+            n = re.search(rf"\b(?:before|until|till)\s+{HOUR}", text)
+            if m or n:
+                start = _hour(m.group(1), m.group(2)) if m else 0
+                end = _hour(n.group(1), n.group(2)) if n else 24
+                if start is None or end is None or start == end % 24:
+                    return text, False
+                hours = (start, end % 24)
+                for match in sorted(filter(None, [m, n]), key=lambda x: x.start(), reverse=True):
+                    text = text[:match.start()] + " " + text[match.end():]
+        if hours is None:
+            for name in sorted(DAY_PARTS, key=len, reverse=True):
+                if re.search(rf"\b{name}\b", text):
+                    hours = DAY_PARTS[name]
+                    text = re.sub(rf"\b(?:in the |at )?{name}\b", " ", text)
+                    break
+        return text, hours
+
+    @staticmethod
+    def _take_top_n(text):
+        m = re.search(r"\b(top|bottom|highest|lowest|first|last)\s+(\d{1,3}|" + "|".join(NUMBER_WORDS) + r")\b", text)
+        if not m:
+            return text, None, None
+        n = int(m.group(2)) if m.group(2).isdigit() else NUMBER_WORDS[m.group(2)]
+        direction = "asc" if m.group(1) in ("bottom", "lowest", "last") else "desc"
+        return text[:m.start()] + " " + text[m.end():], n or None, direction
+
+    def _take_years(self, text):
+        for year in re.findall(r"\b(20\d\d)\b", text):
+            if int(year) not in self._years:
+                return None   # the data does not cover that year
+        return re.sub(r"\b20\d\d\b", " ", text)
+
+
+# ── Engine ────────────────────────────────────────────────────────────────────
+def _selection(plan, df, idx):
+    """Rows the plan's filters keep: a Selection, a boolean array, or None for all rows."""
+    sel = None
+    for col, values in plan.filters:
+        if idx is not None and col in idx.columns:
+            part = idx.isin(col, values)
+        else:
+            part = df[col].isin(values).to_numpy()
+        sel = part if sel is None else _and(sel, part)
+    if plan.hours:
+        start, end = plan.hours
+        hours = range(start, end) if start < end else [*range(start, 24), *range(0, end)]
+        if idx is not None and "hour_of_day" in idx.columns:
+            part = idx.isin("hour_of_day", list(hours))
+        else:
+            part = df["hour_of_day"].isin(list(hours)).to_numpy()
+        sel = part if sel is None else _and(sel, part)
+    if plan.amount:
+        above, below = plan.amount
+        amount = df["amount_inr"].to_numpy()
+        part = np.ones(len(df), dtype=bool)
+        if above is not None:
+            part &= amount > above
+        if below is not None:
+            part &= amount < below
+        sel = part if sel is None else _and(sel, part)
+    return sel
+
+
+def _and(a, b):
+    if isinstance(a, Selection) and isinstance(b, Selection):
+        return a & b
+    a = a.mask() if isinstance(a, Selection) else a
+    b = b.mask() if isinstance(b, Selection) else b
+    return a & b
+
+
+def plan_stats(plan, df, cube=None, idx=None):
+    """group_stats-style metrics for the plan (a frame per group, or a Series without group_by)."""
+    by = list(plan.group_by)
+    filters = dict(plan.filters)
+    multi = {col: vals for col, vals in filters.items() if len(vals) > 1}
+    needs_rows = (plan.hours or plan.amount or plan.metric == "amount_median" or MONTH in by
+                  or "transaction_status" in filters or "fraud_flag" in filters)
+    if cube is not None and not needs_rows and by and all(col in by for col in multi):
+        where = {col: vals[0] for col, vals in filters.items() if len(vals) == 1}
+        frame = cube.stats(by, where=where)
+        for col, vals in multi.items():
+            frame = frame[frame.index.get_level_values(col).isin(vals)]
+        return frame
+    if cube is not None and not needs_rows and not filters and not by:
+        return cube.totals()
+
+    keys = [df["timestamp"].dt.to_period("M").rename(MONTH) if d == MONTH else d for d in by]
+    return group_stats(df, keys or None, mask=_selection(plan, df, idx),
+                       median=plan.metric == "amount_median")
+
+
+def execute_plan(plan, df, cube=None, idx=None):
+    """Answer a QueryPlan as a DataFrame: one row per group (or one row overall)."""
+    stats = plan_stats(plan, df, cube, idx)
+    label, decimals = METRICS[plan.metric]
+    if isinstance(stats, pd.Series):
+        stats = stats.to_frame().T
+
+    out = pd.DataFrame(index=stats.index)
+    if plan.metric in RATE_BASE:
+        base, base_label = RATE_BASE[plan.metric]
+        out[base_label] = stats[base].astype("int64")
+        out["Total"] = stats["count"].astype("int64")
+    elif plan.metric.startswith("amount_"):
+        out["Transactions"] = stats["count"].astype("int64")
+    value = stats[plan.metric]
+    out[label] = value.astype("int64") if decimals == 0 else value.astype(float).round(decimals)
+
+    if plan.group_by:
+        if plan.order is None:
+            if "day_of_week" in plan.group_by and len(plan.group_by) == 1:
+                out = out.reindex([d for d in DAY_ORDER if d in out.index])
+            else:
+                out = out.sort_index()
+        else:
+            out = out.sort_values(label, ascending=plan.order == "asc", kind="stable")
+        if plan.top_n:
+            out = out.head(plan.top_n)
+        out = out.reset_index()
+        out.columns = [DIMENSION_LABELS.get(c, c) if c in plan.group_by else c for c in out.columns]
+        if "is_weekend" in plan.group_by:
+            out["Period"] = out["Period"].map({0: "Weekday", 1: "Weekend"})
+        if MONTH in plan.group_by:
+            out["Month"] = out["Month"].astype(str)
+    else:
+        out = out.reset_index(drop=True)
+        out.insert(0, "Scope", plan.describe())
+    return out
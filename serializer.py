@@ -0,0 +1,192 @@
+"""
+InsightX – result serializer for LLM prompts
+=============================================
+Results used to reach the insight prompt as `DataFrame.to_string()` or
+indented JSON: whitespace-padded columns, and no upper bound — a state × bank
+breakdown or a frame returned whole by generated code could cost thousands of
+prompt tokens, and prefill time with them.
+
+`serialize_result(value, max_tokens)` writes the same data compactly: one
+"|"-delimited line per row under a header line, frames with a meaningful
+index get it as their first column, nested dicts become "outer / inner|value"
+lines and floats keep up to six decimals without padding.  When the text
+would exceed the budget, the first and last rows that fit are kept (results
+are sorted, so these are the top and bottom of the ranking), the gap is
+marked with the number of rows left out, and "#" notes give the row count,
+totals of count columns and the range of every other numeric column over the
+whole result.  Only the rows that can be shown are ever formatted, so the
+cost of serializing — and of the insight call — is bounded by the budget,
+not by the size of the result.
+"""
+
+import json
+import math
+import numbers
+import re
+
+import numpy as np
+import pandas as pd
+
+CHARS_PER_TOKEN = 4
+SEP = "|"
+MAX_COLUMNS = 24     # wider frames keep their first columns
+MAX_CELL = 48        # longer cells are cut
+
+# Integer columns that are labels, not counts — never totalled
+LABEL_WORDS = {"hour", "day", "week", "month", "year", "rank", "id", "age", "index", "is"}
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for servers that report no usage."""
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+
+def _number(v):
+    if isinstance(v, (bool, np.bool_)):
+        return str(bool(v))
+    if isinstance(v, numbers.Integral):
+        return str(int(v))
+    v = float(v)
+    if math.isnan(v):
+        return ""
+    if math.isinf(v) or abs(v) >= 1e15:
+        return repr(v)
+    return f"{v:.6f}".rstrip("0").rstrip(".")
+
+
+def _cell(v):
+    if isinstance(v, numbers.Number) or isinstance(v, np.bool_):
+        text = _number(v)
+    elif v is None or v is pd.NaT:
+        text = ""
+    elif isinstance(v, (list, tuple)):
+        text = json.dumps(v, default=str, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = str(v)
+    text = " ".join(text.split()).replace(SEP, "/")
+    return text if len(text) <= MAX_CELL else text[:MAX_CELL - 1] + "…"
+
+
+def _line(values):
+    return SEP.join(_cell(v) for v in values)
+
+
+def _whole(header, count, line_at, budget):
+    """header + all `count` rows line_at(i), or None if that exceeds budget characters."""
+    if count > budget // 2:     # a row costs at least 2 characters
+        return None
+    lines = list(header)
+    size = sum(len(line) + 1 for line in lines)
+    for i in range(count):
+        lines.append(line_at(i))
+        size += len(lines[-1]) + 1
+        if size > budget + 1 and count > 2:
+            return None
+    return "\n".join(lines)
+
+
+def _elide(header, count, line_at, budget, notes, unit="rows"):
+    """header, the first and last rows that fit in budget characters, the gap marked, then notes."""
+    room = budget - sum(len(line) + 1 for line in header + notes) - 40   # 40: the gap marker
+    head, tail, size = [], [], 0
+    while 2 * (len(head) + 1) < count:
+        first, last = line_at(len(head)), line_at(count - len(head) - 1)
+        if head and size + len(first) + len(last) + 2 > room:
+            break
+        head.append(first)
+        tail.insert(0, last)
+        size += len(first) + len(last) + 2
+    gap = f"… {count - len(head) - len(tail):,} {unit} not shown …"
+    return "\n".join(header + head + [gap] + tail + notes)
+
+
+def _frame(frame, budget):
+    if isinstance(frame.columns, pd.MultiIndex):
+        frame = frame.copy(deep=False)
+        frame.columns = [" / ".join(str(p) for p in col) for col in frame.columns]
+    if not isinstance(frame.index, pd.RangeIndex) or frame.index.name is not None:
+        frame = frame.reset_index()
+    notes = []
+    if frame.shape[1] > MAX_COLUMNS:
+        notes.append(f"# {frame.shape[1] - MAX_COLUMNS} more columns not shown")
+        frame = frame.iloc[:, :MAX_COLUMNS]
+    header = [_line(frame.columns)]
+    count = len(frame)
+    line_at = lambda i: _line(frame.iloc[i])
+    text = _whole(header, count, line_at, budget)
+    if text is not None:
+        return "\n".join([text] + notes)
+
+    numeric = frame.select_dtypes("number")
+    totals, ranges = [], []
+    for col in numeric.columns:
+        values = numeric[col]
+        if pd.api.types.is_integer_dtype(values) and not LABEL_WORDS & set(re.split(r"[\W_]+", str(col).lower())):
+            totals.append(f"{col}={_number(values.sum())}")
+        elif pd.api.types.is_float_dtype(values):
+            ranges.append(f"{col} {_number(values.min())} to {_number(values.max())}")
+    notes = [f"# {count:,} rows in all, in the result's own order"] + notes
+    if totals:
+        notes.append("# Totals over all rows: " + ", ".join(totals))
+    if ranges:
+        notes.append("# Range over all rows: " + ", ".join(ranges))
+    return _elide(header, count, line_at, budget, notes)
+
+
+def _scalar(v):
+    return not isinstance(v, (dict, list, tuple, pd.DataFrame, pd.Series))
+
+
+def _dict_lines(value, prefix=""):
+    """
+    Lines of a nested dict: "key|value" for scalars, a "key:" section of
+    "inner|value" lines for a dict of scalars, a "key:" section holding a
+    table for a dict of same-shaped dicts ({column: {row: value}}), and
+    "outer / inner" paths below that.
+    """
+    lines = []
+    for key, item in value.items():
+        path = f"{prefix} / {key}" if prefix else str(key)
+        if not isinstance(item, dict) or not item:
+            lines.append(_line([path, item]) if _scalar(item) else f"{_cell(path)}|{' '.join(str(item).split())}")
+        elif all(_scalar(v) for v in item.values()):
+            lines.append(f"{_cell(path)}:")
+            lines += [_line(pair) for pair in item.items()]
+        elif not prefix and all(isinstance(v, dict) and all(_scalar(x) for x in v.values()) for v in item.values()):
+            table = pd.DataFrame(item)
+            lines.append(f"{_cell(path)}:")
+            lines.append(_line([""] + list(table.columns)))
+            lines += [_line([label] + list(row)) for label, row in zip(table.index, table.itertuples(index=False))]
+        else:
+            lines += _dict_lines(item, path)
+    return lines
+
+
+def serialize_result(value, max_tokens=600):
+    """Compact text of a result (DataFrame / Series / dict / scalar / str) within max_tokens."""
+    budget = max_tokens * CHARS_PER_TOKEN
+    if isinstance(value, pd.Series):
+        value = value.to_frame(value.name if value.name is not None else "value")
+    if isinstance(value, pd.DataFrame):
+        return _frame(value, budget)
+    if isinstance(value, dict):
+        if all(_scalar(v) for v in value.values()):
+            # Flat (possibly huge) dicts: only the lines that are shown get formatted
+            keys, leaves = list(value), list(value.values())
+            line_at = lambda i: _line([keys[i], leaves[i]])
+        else:
+            lines = _dict_lines(value)
+            keys, leaves, line_at = lines, [], lines.__getitem__
+        text = _whole([], len(keys), line_at, budget)
+        if text is not None:
+            return text
+        notes = [f"# {len(keys):,} entries in all"]
+        if leaves and all(isinstance(v, numbers.Number) for v in leaves):
+            notes.append(f"# Range over all entries: {_number(min(leaves))} to {_number(max(leaves))}")
+        return _elide([], len(keys), line_at, budget, notes, unit="entries" if leaves else "lines")
+    if isinstance(value, str):
+        # Runs of 2+ spaces are to_string() column padding — they become separators
+        lines = [re.sub(r" {2,}", SEP, line.strip())[:budget] for line in value.strip().splitlines()]
+        text = _whole([], len(lines), lines.__getitem__, budget)
+        return text if text is not None else _elide([], len(lines), lines.__getitem__, budget, [], unit="lines")
+    return _cell(value) if isinstance(value, numbers.Number) else str(value)
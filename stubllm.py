@@ -0,0 +1,314 @@
+"""
+InsightX – offline OpenAI-compatible stub server
+=================================================
+Every LLM path — code generation, streamed insights, test_accuracy.py —
+needed a live LM Studio on port 1234, so nothing past the router could be
+timed without a GPU, and model latency drowned out our own.
+
+`StubServer` speaks the part of the `/v1/chat/completions` protocol the app
+uses (JSON responses with `usage`, and `stream: true` as server-sent events)
+and `/v1/models`.  Completions are canned (`--canned FILE`: a JSON list of
+{"match": regex on the last user message, "content": text}) or written by
+rules from the request itself:
+
+- code-generation prompts (they ask for `result`) get pandas code for the
+  metric and dimension the question names (queryplan's patterns), a scalar
+  when the prompt demands one;
+- insight prompts get a ranked answer read from their DATA block;
+- the one-sentence context call gets one sentence, anything else a short
+  paragraph.
+
+Model behaviour is configured, not sampled: a fixed latency before the first
+token, completion tokens streamed at `tps` per second, and failure injection
+— a share of requests answered with an HTTP error status, a share stalled
+for `stall_ms`.  The same request always gets the same text; failures are
+drawn from a seeded generator.  `log` keeps every request's kind, tokens,
+status and the time the simulated model took, so benchmarks can subtract it.
+
+Usage:  python stubllm.py [--port 1234] [--latency-ms 200] [--tps 40]
+                          [--fail-rate R] [--fail-status 503]
+                          [--stall-rate R] [--stall-ms MS] [--canned FILE] [--seed N]
+Then:   INSIGHTX_LLM_URL=http://127.0.0.1:1234/v1 streamlit run app.py
+        python test_accuracy.py --llm-url http://127.0.0.1:1234/v1
+        python benchmark.py stub      (starts its own server)
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from queryplan import DIMENSION_LABELS, DIMENSION_PATTERNS, METRIC_PATTERNS, MONTH
+from serializer import estimate_tokens
+
+MODEL = "insightx-stub"
+
+# queryplan metric → (per-row values, aggregation, result column)
+METRIC_CODE = {
+    "failure_rate":  ("(df['transaction_status'] == 'FAILED') * 100.0", "mean", "Failure_Rate_%"),
+    "success_rate":  ("(df['transaction_status'] == 'SUCCESS') * 100.0", "mean", "Success_Rate_%"),
+    "fraud_rate":    ("df['fraud_flag'] * 100.0", "mean", "Fraud_Rate_%"),
+    "amount_median": ("df['amount_inr']", "median", "Median_Amount"),
+    "amount_mean":   ("df['amount_inr']", "mean", "Avg_Amount"),
+    "amount_sum":    ("df['amount_inr']", "sum", "Total_Amount"),
+    "failed":        ("(df['transaction_status'] == 'FAILED')", "sum", "Failed"),
+    "fraud":         ("df['fraud_flag']", "sum", "Flagged"),
+    "count":         ("df['transaction_id']", "count", "Transactions"),
+}
+ASCENDING = re.compile(r"\b(?:lowest|least|fewest|minimum|smallest)\b")
+
+REASONING = ("Failure rates across the network, device and bank dimensions sit in a narrow band, so the "
+             "differences are operational rather than structural. The largest lever is usually the payer "
+             "bank's switch uptime during peak hours, followed by weaker networks on older devices. A "
+             "sensible next step is to compare the worst group's hourly failure profile with the dataset "
+             "average and review retry behaviour for timeouts.")
+
+
+@dataclass
+class StubConfig:
+    """How the simulated model behaves."""
+    latency_ms: float = 200.0     # request → first token
+    tps: float = 40.0             # completion tokens per second (0: all at once)
+    fail_rate: float = 0.0        # share of requests answered with fail_status
+    fail_status: int = 503
+    stall_rate: float = 0.0       # share of requests that hang for stall_ms first
+    stall_ms: float = 30000.0
+    canned: list = field(default_factory=list)   # [(compiled regex, content)]
+    seed: int = 7
+
+
+def load_canned(path):
+    with open(path, encoding="utf-8") as f:
+        return [(re.compile(item["match"], re.I), item["content"]) for item in json.load(f)]
+
+
+def _question(text):
+    """The question inside a code-generation message ("... answer: Q" / "Q: Q")."""
+    match = re.search(r"(?:answer:|Q:)\s*(.+)$", text, re.S)
+    return (match.group(1) if match else text).strip()
+
+
+def stub_code(question, scalar=False):
+    """Pandas code for the metric × dimension the question names."""
+    q = question.lower().replace("_", " ")
+    metric = next((name for name, pattern in METRIC_PATTERNS if re.search(pattern, q)), "count")
+    dimension = next((col for col, pattern in DIMENSION_PATTERNS if re.search(pattern, q)), None)
+    values, agg, name = METRIC_CODE[metric]
+    if dimension is None:
+        return f"result = round(float(({values}).{agg}()), 2)"
+    key = "df['timestamp'].dt.month" if dimension == MONTH else f"df['{dimension}']"
+    grouped = f"({values}).groupby({key}, observed=True).{agg}()"
+    ascending = bool(ASCENDING.search(q))
+    if scalar:
+        return f"result = {grouped}.{'idxmin' if ascending else 'idxmax'}()"
+    label = DIMENSION_LABELS.get(dimension, dimension)
+    return (f"stats = {grouped}.round(2)\n"
+            f"result = stats.sort_values(ascending={ascending}).rename_axis('{label}').reset_index(name='{name}')")
+
+
+def stub_insight(content):
+    """A ranked answer read from an insight prompt's DATA block."""
+    match = re.search(r"DATA \(computed[^\n]*\n(.*?)\n\s*\n", content, re.S)
+    lines = [line for line in (match.group(1).splitlines() if match else []) if line and not line.startswith("#")]
+    if len(lines) < 2 or "|" not in lines[0]:
+        value = lines[0] if lines else "the computed result"
+        return f"📊 The answer is **{value}**.\n\n🔍 Computed directly from the transactions.\n\n💼 {REASONING}"
+    header = lines[0].split("|")
+    rows = [line.split("|") for line in lines[1:] if "|" in line]
+    top = rows[0]
+    out = [f"📊 **{top[0]}** comes first on {header[-1].replace('_', ' ')} at **{top[-1]}**.", "",
+           "📋 **Full breakdown**"]
+    medals = ["🥇", "🥈", "🥉"]
+    out += [f"{medals[i] if i < 3 else '•'} {row[0]}: **{row[-1]}**" for i, row in enumerate(rows)]
+    out += ["", f"🔍 {len(rows)} groups, ranked as computed.", "", f"💼 {REASONING}"]
+    return "\n".join(out)
+
+
+def complete(messages, canned=()):
+    """(kind, content) for a chat request."""
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    for pattern, content in canned:
+        if pattern.search(last):
+            return "canned", content
+    if "`result`" in system + last:
+        scalar = bool(re.search(r"must be a scalar", system + last, re.I))
+        return "code", stub_code(_question(last), scalar)
+    if "ONE sentence" in system:
+        return "sentence", "The gap is small in absolute terms but worth acting on at this volume."
+    if "DATA (computed" in last:
+        return "insight", stub_insight(last)
+    return "text", REASONING
+
+
+def _pieces(text, max_tokens):
+    """Text as stream deltas (a word and its trailing space), cut after max_tokens."""
+    pieces, used = [], 0
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        used += estimate_tokens(piece)
+        if max_tokens and used > max_tokens:
+            return pieces, "length"
+        pieces.append(piece)
+    return pieces, "stop"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "InsightXStub/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": MODEL, "object": "model", "owned_by": "insightx"}]})
+        else:
+            self._json(404, {"error": {"message": f"no route {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": f"no route {self.path}", "type": "invalid_request_error"}})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            return self._json(400, {"error": {"message": f"bad request: {e}", "type": "invalid_request_error"}})
+        self.server.stub.handle(self, request, messages)
+
+
+class StubServer:
+    """The stub on a background thread: `with StubServer(StubConfig(...)) as url:` (port 0 = any free port)."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.random = random.Random(self.config.seed)
+        self.log = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="insightx-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start().url
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def model_ms(self, since=0):
+        """Time the simulated model spent on requests logged from index `since` on."""
+        with self._lock:
+            return sum(entry["model_ms"] for entry in self.log[since:])
+
+    def _record(self, **entry):
+        with self._lock:
+            self.log.append(entry)
+
+    def handle(self, handler, request, messages):
+        config = self.config
+        start = time.perf_counter()
+        with self._lock:
+            fail = self.random.random() < config.fail_rate
+            stall = self.random.random() < config.stall_rate
+        if stall:
+            time.sleep(config.stall_ms / 1000)
+        time.sleep(config.latency_ms / 1000)
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        if fail:
+            self._record(kind="error", status=config.fail_status, prompt_tokens=prompt_tokens,
+                         completion_tokens=0, model_ms=(time.perf_counter() - start) * 1000)
+            return handler._json(config.fail_status, {"error": {"message": "injected failure", "type": "server_error"}})
+
+        kind, content = complete(messages, config.canned)
+        pieces, finish = _pieces(content, request.get("max_tokens"))
+        completion_tokens = sum(estimate_tokens(p) for p in pieces)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        ident = f"chatcmpl-stub-{len(self.log)}"
+        base = {"id": ident, "created": int(time.time()), "model": request.get("model", MODEL)}
+        delay = (lambda piece: estimate_tokens(piece) / config.tps) if config.tps > 0 else (lambda piece: 0)
+        try:
+            if not request.get("stream"):
+                time.sleep(sum(delay(p) for p in pieces))
+                handler._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                    {"index": 0, "finish_reason": finish,
+                     "message": {"role": "assistant", "content": "".join(pieces)}}]})
+            else:
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/event-stream")
+                handler.send_header("Cache-Control", "no-cache")
+                handler.end_headers()
+
+                def event(delta, reason=None):
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": reason}]}
+                    handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    handler.wfile.flush()
+
+                event({"role": "assistant", "content": ""})
+                for piece in pieces:
+                    time.sleep(delay(piece))
+                    event({"content": piece})
+                event({}, finish)
+                handler.wfile.write(b"data: [DONE]\n\n")
+                handler.wfile.flush()
+            status = 200
+        except (BrokenPipeError, ConnectionResetError):
+            status = 499   # the client gave up (timeout / deadline)
+        self._record(kind=kind, status=status, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                     model_ms=(time.perf_counter() - start) * 1000)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="InsightX offline OpenAI-compatible stub server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1234)
+    ap.add_argument("--latency-ms", type=float, default=200.0, help="time to first token")
+    ap.add_argument("--tps", type=float, default=40.0, help="completion tokens per second (0 = instant)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="share of requests that get --fail-status")
+    ap.add_argument("--fail-status", type=int, default=503)
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="share of requests that hang --stall-ms first")
+    ap.add_argument("--stall-ms", type=float, default=30000.0)
+    ap.add_argument("--canned", help='JSON list of {"match": regex, "content": text}, tried before the rules')
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    config = StubConfig(args.latency_ms, args.tps, args.fail_rate, args.fail_status, args.stall_rate,
+                        args.stall_ms, load_canned(args.canned) if args.canned else [], args.seed)
+    server = StubServer(config, args.host, args.port)
+    print(f"InsightX stub LLM on {server.url} — {config.latency_ms:.0f} ms to first token, "
+          f"{config.tps:g} tokens/s, {config.fail_rate:.0%} failures, {config.stall_rate:.0%} stalls")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,35 +6,44 @@ Strategy:
   - LLM result   = LLM generates code → we execute it → smart extract scalar
   - Compare the two with tolerant matching
 
-Usage:  python test_accuracy.py
+Usage:  python test_accuracy.py              one-line prompt below
+        python test_accuracy.py --fewshot    the app's code-generation prompt,
+                                             every SAFE PATTERN vs the top-k
+                                             retrieved ones (--k, default
+                                             INSIGHTX_FEWSHOT_K)
+        --llm-url URL                another OpenAI-compatible server
+                                     (default INSIGHTX_LLM_URL, else LM Studio)
+        --stub                       an in-process offline stub (stubllm.py):
+                                     checks the pipeline, not model accuracy
 Needs:  upi_transactions_2024.csv + LM Studio at http://127.0.0.1:1234
+
+Each run reports accuracy and prompt tokens per call (the server's count,
+else ~4 characters per token).
 """
 
+import argparse
+import os
 import pandas as pd
 import numpy as np
 import re
 import time
 from openai import OpenAI
 
+import app
+from analytics import PredicateIndex, group_stats
+from datastore import build_profile, load_transactions
+from stubllm import StubConfig, StubServer
+
 CSV_PATH  = "upi_transactions_2024.csv"
-LM_STUDIO = "http://127.0.0.1:1234/v1"
+LM_STUDIO = os.environ.get("INSIGHTX_LLM_URL", "http://127.0.0.1:1234/v1")
 FLOAT_TOL = 1.5   # percentage point tolerance
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Load data
 # ─────────────────────────────────────────────────────────────────────────────
 def load_data():
-    df = pd.read_csv(CSV_PATH)
-    df.columns = (df.columns.str.strip().str.lower()
-                  .str.replace(" ", "_", regex=False)
-                  .str.replace(r"[()]", "", regex=True))
-    for col in df.columns:
-        if "amount" in col and col != "amount_inr":
-            df.rename(columns={col: "amount_inr"}, inplace=True)
-            break
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    return df
+    # Same normalisation + columnar cache as the app (see datastore.py)
+    return load_transactions(CSV_PATH)[0]
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Smart scalar extractor — handles Series, DataFrame, string, number
@@ -149,6 +158,7 @@ def compare(gt, llm_raw, kind):
 # LLM code generation
 # ─────────────────────────────────────────────────────────────────────────────
 def ask_llm(question, cols, client):
+    """One-line code for question and the prompt's token count."""
     sys = f"""You are a Pandas expert. DataFrame `df` columns: {cols}
 
 Key columns:
@@ -168,26 +178,32 @@ STRICT RULES:
 4. For failure/success rate use .mean() * 100 to get percentage
 5. No imports, no print(), no markdown fences
 """
+    messages = [
+        {"role": "system", "content": sys},
+        {"role": "user",   "content": f"Write ONE LINE of pandas code. result must be a scalar. Q: {question}"}
+    ]
     resp = client.chat.completions.create(
         model="local-model",
-        messages=[
-            {"role": "system", "content": sys},
-            {"role": "user",   "content": f"Write ONE LINE of pandas code. result must be a scalar. Q: {question}"}
-        ],
+        messages=messages,
         temperature=0.05,
         max_tokens=150,
     )
     code = resp.choices[0].message.content.strip()
     code = re.sub(r"```python\n?|```\n?", "", code)
-    return code.strip()
+    usage = app.PromptUsage()
+    app.record_prompt_usage(usage, messages, resp)
+    return code.strip(), usage.prompt_tokens
+
+def ask_app(question, summary, client, k):
+    """app.generate_pandas_code() with k retrieved patterns (0 = all) and the prompt's token count."""
+    usage = app.PromptUsage()
+    code = app.generate_pandas_code(question, summary, [], client, usage=usage, k=k)
+    return code, usage.prompt_tokens
 
-def run_code(code, df):
-    lv = {"df": df.copy(), "pd": pd, "np": np}
-    try:
-        exec(code, {}, lv)
-        return lv.get("result", None), None
-    except Exception as e:
-        return None, str(e)
+def run_code(code, df, context=None):
+    # app.execute_code: the same compact-frame handling generated code gets in the app
+    res = app.execute_code(code, df, context={"np": np, **(context or {})})
+    return (res.value, None) if res.ok else (None, res.error)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Test cases  (ground_truth computed purely in Python — always correct)
@@ -258,28 +274,19 @@ def build_tests(df):
 # ─────────────────────────────────────────────────────────────────────────────
 # Main
 # ─────────────────────────────────────────────────────────────────────────────
-def run():
-    print("\n" + "="*68)
-    print("  InsightX – Accuracy Test Suite v3")
-    print("="*68)
-
-    df = load_data()
-    print(f"\n✅ Loaded {len(df):,} rows  |  Columns: {list(df.columns)}\n")
-
-    client = OpenAI(base_url=LM_STUDIO, api_key="lm-studio")
-    tests  = build_tests(df)
-    cols   = list(df.columns)
-
+def run_suite(tests, df, ask, context=None):
+    """Ask every test through ask(question) -> (code, prompt_tokens); tally and print."""
     passed = failed = errors = 0
-    rows   = []
+    rows, tokens = [], []
 
     for t in tests:
         print(f"[Q{t['id']:02d}] {t['q']}")
         print(f"       Ground Truth  : {t['gt']}")
 
         try:
-            code = ask_llm(t["q"], cols, client)
-            raw, err = run_code(code, df)
+            code, prompt_tokens = ask(t["q"])
+            tokens.append(prompt_tokens)
+            raw, err = run_code(code, df, context)
 
             if err:
                 print(f"       Code          : {code}")
@@ -295,7 +302,7 @@ def run():
                 else:
                     status = "❌ FAIL"; failed += 1
 
-            print(f"       Status        : {status}  |  {detail}")
+            print(f"       Status        : {status}  |  {detail}  |  {prompt_tokens:,} prompt tokens")
 
         except Exception as e:
             print(f"       ⚠️  Exception  : {e}")
@@ -305,18 +312,67 @@ def run():
         print()
         time.sleep(0.3)
 
-    # Summary
-    total = len(tests)
-    acc   = passed / total * 100
+    return {"passed": passed, "failed": failed, "errors": errors, "rows": rows,
+            "tokens": sum(tokens) / len(tokens) if tokens else 0.0}
+
+def print_summary(label, total, s):
+    acc = s["passed"] / total * 100
     print("="*68)
-    print(f"  ✅ Passed  : {passed}/{total}")
-    print(f"  ❌ Failed  : {failed}/{total}")
-    print(f"  ⚠️  Errors  : {errors}/{total}")
-    print(f"\n  🎯 ACCURACY : {acc:.1f}%\n")
-    for r in rows:
+    print(f"  {label}")
+    print(f"  ✅ Passed  : {s['passed']}/{total}")
+    print(f"  ❌ Failed  : {s['failed']}/{total}")
+    print(f"  ⚠️  Errors  : {s['errors']}/{total}")
+    print(f"\n  🎯 ACCURACY : {acc:.1f}%   🧾 {s['tokens']:,.0f} prompt tokens/call\n")
+    for r in s["rows"]:
         icon = r["status"].split()[0]
         print(f"  Q{r['id']:02d} {icon}  {r['q'][:60]}")
     print("="*68 + "\n")
 
+def run(fewshot=False, k=None, llm_url=LM_STUDIO):
+    print("\n" + "="*68)
+    print("  InsightX – Accuracy Test Suite v3")
+    print("="*68)
+
+    df = load_data()
+    print(f"\n✅ Loaded {len(df):,} rows  |  Columns: {list(df.columns)}\n")
+
+    client = OpenAI(base_url=llm_url, api_key="lm-studio")
+    tests  = build_tests(df)
+    cols   = list(df.columns)
+
+    if not fewshot:
+        s = run_suite(tests, df, lambda q: ask_llm(q, cols, client))
+        print_summary("One-line prompt", len(tests), s)
+        return
+
+    # The app's prompt, as generate_pandas_code() sends it, once with every
+    # SAFE PATTERN and once with the top-k retrieved for each question
+    k = app.FEWSHOT_K if k is None else k
+    summary = app.get_data_summary(build_profile(df))
+    context = {"group_stats": group_stats, "idx": PredicateIndex.build(df)}
+    suites = [(f"All {len(app.PATTERN_INDEX)} patterns", 0), (f"Top {k} retrieved patterns", k)]
+    results = []
+    for label, n in suites:
+        print(f"── {label} " + "─"*(64 - len(label)) + "\n")
+        results.append(run_suite(tests, df, lambda q: ask_app(q, summary, client, n), context))
+    for (label, _), s in zip(suites, results):
+        print_summary(label, len(tests), s)
+
+    base, top = results
+    print(f"  Top {k} vs all patterns: accuracy {(top['passed'] - base['passed']) / len(tests) * 100:+.1f} pts, "
+          f"prompt tokens/call {base['tokens']:,.0f} → {top['tokens']:,.0f} "
+          f"({(top['tokens'] / base['tokens'] - 1) * 100 if base['tokens'] else 0:+.0f}%)\n")
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="InsightX accuracy test suite")
+    ap.add_argument("--fewshot", action="store_true",
+                    help="compare the app's prompt with every SAFE PATTERN vs the top-k retrieved")
+    ap.add_argument("--k", type=int, default=None, help="patterns retrieved per question")
+    ap.add_argument("--llm-url", default=LM_STUDIO, help="OpenAI-compatible endpoint")
+    ap.add_argument("--stub", action="store_true", help="answer from an in-process stub server (no model)")
+    args = ap.parse_args()
+    if args.stub:
+        with StubServer(StubConfig(latency_ms=0, tps=0)) as url:
+            run(fewshot=args.fewshot, k=args.k, llm_url=url)
+    else:
+        run(fewshot=args.fewshot, k=args.k, llm_url=args.llm_url)
@@ -0,0 +1,208 @@
+"""
+InsightX – per-question tracing
+================================
+A question passes through ambiguity detection, query expansion, the
+multi-part splitter, the router / query planner or code generation,
+execution, the insight, recommendations and the chat save — and nothing said
+where its time went.
+
+`trace(name)` opens a root `Span` for one question; inside it `span(name)`,
+the `@traced()` decorator and `start_span()` (for generators, which must not
+change the caller's current span) open nested spans.  Spans carry
+attributes — prompt / completion tokens, rows handed to the code, result-
+and LLM-cache hits, cube lookups — set with `annotate()` or `Span.set()`.
+
+The current span lives in a `ContextVar`, so spans nest per thread of
+execution; the multi-part pool runs each part in a copy of the submitting
+context and its spans land under the question on their own thread.  Outside
+a trace every call is a no-op (one ContextVar lookup), so benchmarks and
+test_accuracy.py pay nothing.
+
+`to_chrome(roots)` writes Chrome trace-event JSON (complete "X" events, one
+track per thread) for chrome://tracing, Perfetto or speedscope;
+`span_rows()` and `stage_summary()` feed the sidebar's 🧭 Trace panel.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+_current = contextvars.ContextVar("insightx_span", default=None)
+
+
+@dataclass
+class Span:
+    """One timed stage and the stages it called."""
+    name: str
+    start_ns: int = field(default_factory=time.perf_counter_ns)
+    end_ns: int = None
+    attrs: dict = field(default_factory=dict)
+    children: list = field(default_factory=list)
+    thread: str = field(default_factory=lambda: threading.current_thread().name)
+    wall: float = field(default_factory=time.time)   # start, for file names and display
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.perf_counter_ns()
+
+    @property
+    def ms(self):
+        """Duration so far (ms) — up to now for a span still open."""
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e6
+
+    @property
+    def self_ms(self):
+        """Time not spent in children on the same thread (ms)."""
+        inner = sum(c.ms for c in self.children if c.thread == self.thread)
+        return max(0.0, self.ms - inner)
+
+    def walk(self, depth=0):
+        """(depth, span) for this span and its descendants, depth first in start order."""
+        yield depth, self
+        for child in sorted(self.children, key=lambda c: c.start_ns):
+            yield from child.walk(depth + 1)
+
+
+class _NoSpan:
+    """Stands in for a span outside a trace: accepts and drops everything."""
+
+    def set(self, **attrs):
+        return self
+
+    def end(self):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def annotate(**attrs):
+    """Set attributes on the current span, if any."""
+    span = _current.get()
+    if span is not None:
+        span.attrs.update(attrs)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """A root span, current for the block — nested spans attach to it."""
+    root = Span(name, attrs=attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    except Exception as e:   # not Streamlit's rerun / stop
+        root.attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        root.end()
+        _current.reset(token)
+
+
+def start_span(name, **attrs):
+    """A child of the current span that is not made current; end() it yourself (NO_SPAN outside a trace)."""
+    parent = _current.get()
+    if parent is None:
+        return NO_SPAN
+    span = Span(name, attrs=attrs)
+    parent.children.append(span)
+    return span
+
+
+@contextmanager
+def span(name, **attrs):
+    """A child of the current span, current for the block."""
+    child = start_span(name, **attrs)
+    if child is NO_SPAN:
+        yield child
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except Exception as e:   # not Streamlit's rerun / stop
+        child.attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        child.end()
+        _current.reset(token)
+
+
+def traced(name=None):
+    """Decorator: run the function inside span(name or its own name)."""
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+# ── Export ────────────────────────────────────────────────────────────────────
+def _args(attrs):
+    return {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v) for k, v in attrs.items()}
+
+
+def to_chrome(roots):
+    """Chrome trace-event JSON (dict) for one or more traces, times relative to the first."""
+    roots = list(roots)
+    if not roots:
+        return {"traceEvents": [], "displayTimeUnit": "ms"}
+    origin = min(r.start_ns for r in roots)
+    pid = os.getpid()
+    tids, events = {}, []
+    for root in roots:
+        for _, s in root.walk():
+            tid = tids.setdefault(s.thread, len(tids) + 1)
+            events.append({"name": s.name, "cat": "insightx", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": (s.start_ns - origin) / 1000, "dur": s.ms * 1000, "args": _args(s.attrs)})
+    events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}}
+               for thread, tid in tids.items()]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome(root, directory):
+    """Write one trace as <directory>/trace-<time>-<question>.json; returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r"[^a-z0-9]+", "-", str(root.attrs.get("question", root.name)).lower()).strip("-")[:40]
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(root.wall))
+    path = os.path.join(directory, f"trace-{stamp}-{root.start_ns % 1000000:06d}-{slug or root.name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome([root]), f)
+    return path
+
+
+# ── Summaries for the debug panel ────────────────────────────────────────────
+def span_rows(root):
+    """One row per span of a trace: indented stage, ms, share of the question, attributes."""
+    total = root.ms or 1.0
+    return [{"Stage": "  " * depth + s.name, "ms": round(s.ms, 2), "%": round(100 * s.ms / total, 1),
+             "thread": s.thread if s.thread != root.thread else "",
+             "details": ", ".join(f"{k}={v}" for k, v in s.attrs.items() if k != "question" and v is not None)}
+            for depth, s in root.walk()]
+
+
+def stage_summary(roots):
+    """Per stage name over many traces: calls, median and total ms, total self ms — biggest self time first."""
+    stages = {}
+    for root in roots:
+        for _, s in root.walk():
+            stages.setdefault(s.name, []).append(s)
+    rows = [{"Stage": name, "calls": len(spans), "median_ms": round(statistics.median(s.ms for s in spans), 2),
+             "total_ms": round(sum(s.ms for s in spans), 1), "self_ms": round(sum(s.self_ms for s in spans), 1)}
+            for name, spans in stages.items()]
+    return sorted(rows, key=lambda r: -r["self_ms"])